@@ -1,17 +1,30 @@
 # app.py
-import os, io, time, json, uuid, queue, threading, tempfile, shutil, subprocess
+import os, io, time, json, uuid, queue, threading, tempfile, shutil, subprocess, atexit, multiprocessing, functools, hashlib, glob
 from urllib.parse import urlparse, unquote
 import requests
+import numpy as np
 from flask import Flask, request, jsonify, send_file, abort
 from flask_cors import CORS
 from flasgger import Swagger
-from reframe_mediapipe_falante_v7 import reframe_video
-from storage.spaces import upload_public, make_key, delete_public
+from reframe_mediapipe_falante_v7 import (reframe_video, parse_target, DetectorBundle,
+                                          render_debug_video, render_debug_contact_sheet, load_crop_paths)
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, Field, File, Data, Epilogue
+from storage.spaces import (upload_public, make_key, delete_public, StreamingUpload, presign_put,
+                            presign_multipart, complete_multipart, abort_multipart, object_size, public_url_for)
 from config import Config
 from utils.response import success_response, error_response, queued_response
+from utils.process_worker import ReframeProcess, ReframeProcessError
+from utils.result_cache import ResultCache, params_digest, hash_file
+from utils.downloader import Downloader
 
 app = Flask(__name__)
 
+# Processos filhos criados com spawn (reframe, trechos do modo segmentado) reimportam o
+# app.py quando ele é o __main__ (python app.py): efeitos colaterais de módulo (snapshot de
+# uploads, cache de resultados, downloader, threads de limpeza e workers) só no processo principal
+_is_main_process = multiprocessing.parent_process() is None
+
 # Configuração CORS para permitir requisições do navegador
 CORS(app, 
      resources={r"/*": {"origins": "*"}},
@@ -174,10 +187,46 @@ _jobs = {}
 _jobs_lock = threading.Lock()
 _q = queue.Queue()
 
+# Downloader compartilhado entre os workers (pool de conexões reaproveitado entre jobs)
+_downloader = Downloader(
+    parts=Config.DOWNLOAD_PARTS,
+    min_part_size=int(Config.DOWNLOAD_MIN_PART_MB * 1024 * 1024),
+    retries=Config.DOWNLOAD_RETRIES,
+    pool_size=max(10, Config.MAX_WORKERS * Config.DOWNLOAD_PARTS)
+) if _is_main_process else None
+
+# Cache de resultados por conteúdo (índice persistente, sobrevive a reinícios)
+_result_cache = ResultCache(
+    os.path.join(Config.RESULT_CACHE_DIR, "result_cache.json"),
+    max_entries=Config.RESULT_CACHE_MAX_ENTRIES,
+    ttl_seconds=Config.RESULT_CACHE_TTL_DAYS * 24 * 3600
+) if Config.RESULT_CACHE_ENABLED and _is_main_process else None
+
+# Arquivos por job no TMP_DIR servidos por endpoints (debug, crop_path): saem após JOB_FILES_TTL_DAYS
+JOB_FILE_PATTERNS = ["trajectory_job_*.npz", "crop_path_job_*.npz", "debug_job_*"]
+
+# Renders de debug em andamento/falhos (chave: arquivo de cache), um por vez
+_debug_renders = {}
+_debug_renders_lock = threading.Lock()
+_debug_render_slots = threading.Semaphore(1)
+
+class _DebugRenderError(Exception):
+    """Falha do render de debug com status HTTP próprio (ex.: 410 para input expirado)."""
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
 # Memória dos uploads (com retenção de 7 dias)
 _uploads = {}
 _uploads_lock = threading.Lock()
 
+# Uploads diretos ao bucket (URLs assinadas) aguardando o /complete: um JSON por upload em
+# UPLOADS_SNAPSHOT_DIR/pending_uploads, visível após reinícios e entre workers do gunicorn
+PENDING_UPLOADS_DIR = os.path.join(Config.UPLOADS_SNAPSHOT_DIR, "pending_uploads")
+
+# Bloco lido do corpo do POST /v1/uploads (o arquivo segue direto para o Spaces)
+UPLOAD_READ_SIZE = 256 * 1024
+
 def _now() -> int:
     """Retorna timestamp atual em segundos"""
     return int(time.time())
@@ -193,7 +242,8 @@ def _progress_for(job: dict) -> float:
     for k, v in STAGE_WEIGHTS.items():
         if k == stage: 
             break
-        done_before += v
+        # Modo streaming: o download continua durante o reframe e conta pelo que já baixou
+        done_before += v * job.get("download_progress", 1.0) if k == "downloading" else v
     return round(100.0 * (done_before + STAGE_WEIGHTS.get(stage, 0.0) * max(0.0, min(1.0, stage_prog))), 1)
 
 def _save_job(job_id: str) -> None:
@@ -228,6 +278,34 @@ def _load_uploads() -> None:
     except Exception:
         pass
 
+def _pending_upload_path(upload_id: str):
+    """Arquivo do upload pendente (None se o id não tem o formato upl_<hex>)"""
+    if not upload_id.startswith("upl_") or not upload_id[4:].isalnum():
+        return None
+    return os.path.join(PENDING_UPLOADS_DIR, f"{upload_id}.json")
+
+def _save_pending_upload(pending: dict) -> None:
+    """Grava o upload pendente (arquivo temporário + troca: nunca fica pela metade)"""
+    os.makedirs(PENDING_UPLOADS_DIR, exist_ok=True)
+    p = _pending_upload_path(pending["upload_id"])
+    with open(p + ".tmp", "w") as f:
+        json.dump(pending, f, ensure_ascii=False)
+    os.replace(p + ".tmp", p)
+
+def _load_pending_upload(upload_id: str):
+    """Upload pendente gravado por qualquer worker (None se não existe)"""
+    p = _pending_upload_path(upload_id)
+    try:
+        with open(p) as f:
+            return json.load(f)
+    except (TypeError, OSError, ValueError):
+        return None
+
+def _drop_pending_upload(upload_id: str) -> None:
+    """Remove o upload pendente (concluído ou abandonado)"""
+    try: os.remove(_pending_upload_path(upload_id))
+    except (TypeError, OSError): pass
+
 def _cleanup_expired_uploads() -> None:
     """Remove uploads expirados do Spaces e da memória"""
     now = _now()
@@ -241,6 +319,18 @@ def _cleanup_expired_uploads() -> None:
                 key = upload.get("key")
                 if key:
                     delete_public(key)
+                _remove_local_upload(upload)
+    
+    # Uploads assinados abandonados (um dia após as URLs expirarem)
+    pending_ids = [f[:-len(".json")] for f in os.listdir(PENDING_UPLOADS_DIR)
+                   if f.endswith(".json")] if os.path.isdir(PENDING_UPLOADS_DIR) else []
+    abandoned = [p for p in map(_load_pending_upload, pending_ids) if p and now >= p["expires_at"] + 86400]
+    for pending in abandoned:
+        _drop_pending_upload(pending["upload_id"])
+        if pending.get("multipart_id"):
+            abort_multipart(pending["key"], pending["multipart_id"])
+        else:
+            delete_public(pending["key"])
     
     # Remove da memória
     with _uploads_lock:
@@ -250,6 +340,142 @@ def _cleanup_expired_uploads() -> None:
     if expired_ids:
         _save_uploads()
 
+def _remove_local_upload(upload: dict) -> None:
+    """Apaga a cópia local do upload (UPLOAD_LOCAL_CACHE_DIR), se houver"""
+    local_path = upload.get("local_path")
+    if local_path:
+        try: os.remove(local_path)
+        except OSError: pass
+
+def _upload_folder(folder) -> str:
+    """Pasta de destino do upload (evita path traversal)"""
+    folder = (folder or Config.UPLOAD_DEFAULT_FOLDER).strip()
+    if '..' in folder or '/' not in folder:
+        folder = Config.UPLOAD_DEFAULT_FOLDER
+    return folder
+
+def _upload_ttl(value) -> int:
+    """Dias até a expiração do upload (padrão UPLOAD_TTL_DAYS, teto UPLOAD_MAX_TTL_DAYS)"""
+    try:
+        ttl_days = int(value if value is not None else Config.UPLOAD_TTL_DAYS)
+    except (TypeError, ValueError):
+        ttl_days = Config.UPLOAD_TTL_DAYS
+    if ttl_days > Config.UPLOAD_MAX_TTL_DAYS:
+        ttl_days = Config.UPLOAD_MAX_TTL_DAYS
+    if ttl_days < 1:
+        ttl_days = Config.UPLOAD_TTL_DAYS
+    return ttl_days
+
+def _register_upload(upload_id: str, key: str, url: str, folder: str, filename: str,
+                     size: int, ttl_days: int, local_path: str = None) -> dict:
+    """Registra um upload concluído em _uploads (com expiração em ttl_days) e salva o snapshot"""
+    created_at = _now()
+    upload_record = {
+        "upload_id": upload_id,
+        "key": key,
+        "upload_url": url,
+        "folder": folder,
+        "filename": filename,
+        "size": size,
+        "created_at": created_at,
+        "expires_at": created_at + (ttl_days * 86400),
+        "ttl_days": ttl_days
+    }
+    if local_path:
+        upload_record["local_path"] = local_path
+    
+    with _uploads_lock:
+        _uploads[upload_id] = upload_record
+    
+    _save_uploads()
+    return upload_record
+
+def _receive_upload(upload_id: str, boundary: str, fields: dict):
+    """
+    Lê o corpo multipart/form-data do request em blocos e envia o campo 'file' direto
+    para o Spaces (StreamingUpload), sem arquivo temporário nem o corpo inteiro em
+    memória. Campos de texto entram em fields; 'folder' só vale se chegar antes de
+    'file' (a chave é definida quando o arquivo começa).
+    Com UPLOAD_LOCAL_CACHE_DIR, os bytes também são copiados para um arquivo local,
+    que jobs com input_upload_id usam no lugar de baixar o vídeo de volta.
+    Retorna {filename, folder, key, upload_url, size, local_path} ou None se não veio 'file'.
+    Levanta ValueError para corpo inválido/incompleto.
+    """
+    decoder = MultipartDecoder(boundary.encode("latin-1"), request.max_form_memory_size)
+    max_field = request.max_form_memory_size or 500_000
+    current = None  # "file" (o arquivo), nome de um campo de texto ou None (parte ignorada)
+    value = bytearray()
+    writer = local = local_path = result = None
+    try:
+        while True:
+            block = request.stream.read(UPLOAD_READ_SIZE)
+            decoder.receive_data(block or None)
+            event = decoder.next_event()
+            while not isinstance(event, NeedData):
+                if isinstance(event, File) and event.name == "file" and writer is None:
+                    if not event.filename:
+                        raise ValueError("Nome do arquivo vazio")
+                    filename = event.filename
+                    folder = _upload_folder(fields.get("folder"))
+                    key = make_key(folder, filename)
+                    writer = StreamingUpload(key, filename)
+                    if Config.UPLOAD_LOCAL_CACHE_DIR:
+                        os.makedirs(Config.UPLOAD_LOCAL_CACHE_DIR, exist_ok=True)
+                        local_path = os.path.join(Config.UPLOAD_LOCAL_CACHE_DIR,
+                                                  upload_id + (os.path.splitext(key)[1] or ".mp4"))
+                        local = open(local_path + ".part", "wb")
+                    current = "file"
+                elif isinstance(event, (Field, File)):
+                    current = event.name if isinstance(event, Field) else None
+                    value = bytearray()
+                elif isinstance(event, Data) and current == "file":
+                    writer.write(event.data)
+                    if local is not None:
+                        local.write(event.data)
+                    if not event.more_data:
+                        result = {"filename": filename, "folder": folder, "key": writer.key, "upload_url": writer.complete(),
+                                  "size": writer.size, "local_path": None}
+                        if local is not None:
+                            local.close()
+                            local = None
+                            os.replace(local_path + ".part", local_path)
+                            result["local_path"] = local_path
+                        current = None
+                elif isinstance(event, Data) and current is not None:
+                    value += event.data
+                    if len(value) > max_field:
+                        raise ValueError(f"Campo '{current}' excede o tamanho máximo")
+                    if not event.more_data:
+                        fields[current] = value.decode("utf-8", "replace")
+                elif isinstance(event, Epilogue):
+                    return result
+                event = decoder.next_event()
+            if not block:
+                raise ValueError("Corpo multipart incompleto")
+    except Exception:
+        # Nada fica para trás: nem partes órfãs, nem objeto sem registro, nem cópia local
+        if result is not None:
+            delete_public(result["key"])
+            _remove_local_upload(result)
+        elif writer is not None:
+            writer.abort()
+        if local is not None:
+            local.close()
+            try: os.remove(local_path + ".part")
+            except OSError: pass
+        raise
+
+def _cleanup_expired_job_files() -> None:
+    """Remove do TMP_DIR os arquivos por job (JOB_FILE_PATTERNS) mais velhos que JOB_FILES_TTL_DAYS"""
+    cutoff = time.time() - Config.JOB_FILES_TTL_DAYS * 86400
+    for pattern in JOB_FILE_PATTERNS:
+        for path in glob.glob(os.path.join(Config.TMP_DIR, pattern)):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
 def _set(job_id: str, **kwargs) -> None:
     """Atualiza dados do job e recalcula progresso"""
     with _jobs_lock:
@@ -258,13 +484,19 @@ def _set(job_id: str, **kwargs) -> None:
     _save_job(job_id)
 
 
-def _download_to_tmp(input_url: str) -> str:
+def _download_to_tmp(input_url: str, hasher=None, dest: str = None, progress_cb=None, cancel=None) -> str:
     """
     Suporta:
       • http(s)://...  -> baixa para /tmp
       • file:///abs/path ou file://localhost/abs/path -> usa caminho local
       • caminho puro (/Users/... ou ./video.mp4)      -> também aceita (converte internamente)
     Sempre retorna um caminho local legível.
+    hasher (ex.: hashlib.sha256()) recebe o conteúdo do vídeo: no download, em
+    streaming junto com a escrita; em caminhos locais, lendo o arquivo em blocos.
+    dest: caminho final do download (padrão: arquivo temporário). O conteúdo é gravado
+    em dest + ".part" e renomeado ao terminar, então dest só existe completo.
+    progress_cb(fração) acompanha o download quando o servidor informa o tamanho.
+    cancel (threading.Event) interrompe um download http(s) em andamento.
     """
     if not input_url:
         raise ValueError("input_url vazio")
@@ -273,19 +505,20 @@ def _download_to_tmp(input_url: str) -> str:
 
     # -------- 1) http(s) -> download --------
     if u.scheme in ("http", "https"):
+        criado = dest is None
+        if criado:
+            fd, dest = tempfile.mkstemp(suffix=os.path.splitext(u.path)[1] or ".mp4")
+            os.close(fd)
         try:
-            r = requests.get(input_url, stream=True, timeout=60)
-            r.raise_for_status()
+            # Sessão compartilhada; partes paralelas por Range quando o servidor aceita
+            _downloader.download(input_url, dest + ".part", hasher, progress_cb, cancel)
+            os.replace(dest + ".part", dest)
         except Exception as e:
+            for path in [dest + ".part"] + ([dest] if criado else []):
+                try: os.remove(path)
+                except OSError: pass
             raise ValueError(f"Falha ao baixar URL remota: {e}") from e
-
-        ext = os.path.splitext(u.path)[1] or ".mp4"
-        fd, tmp_path = tempfile.mkstemp(suffix=ext)
-        with os.fdopen(fd, "wb") as f:
-            for chunk in r.iter_content(1024 * 1024):
-                if chunk:
-                    f.write(chunk)
-        return tmp_path
+        return dest
 
     # -------- 2) file:// -> caminho local --------
     if u.scheme == "file" or input_url.startswith("file:"):
@@ -303,6 +536,8 @@ def _download_to_tmp(input_url: str) -> str:
         candidates = [local_path, os.path.realpath(local_path)]
         for c in candidates:
             if os.path.exists(c) and os.access(c, os.R_OK):
+                if hasher is not None:
+                    hash_file(c, hasher)
                 return c
         raise FileNotFoundError(f"Arquivo local não encontrado: {local_path}")
 
@@ -311,6 +546,8 @@ def _download_to_tmp(input_url: str) -> str:
     candidates = [local_path, os.path.realpath(local_path)]
     for c in candidates:
         if os.path.exists(c) and os.access(c, os.R_OK):
+            if hasher is not None:
+                hash_file(c, hasher)
             return c
 
     raise FileNotFoundError(
@@ -318,8 +555,141 @@ def _download_to_tmp(input_url: str) -> str:
         f"(se for remoto, use http(s)://; se for file URL, use file:///caminho/absoluto)"
     )
 
-def _worker() -> None:
-    """Worker thread que processa jobs da fila"""
+def _start_stream_download(job_id: str, input_url: str, dest: str, hasher=None) -> threading.Thread:
+    """
+    Modo streaming: baixa input_url para dest numa thread enquanto o reframe decodifica
+    direto da URL. O arquivo parcial (dest + ".part") já existe quando a função retorna.
+    A thread guarda a exceção em .error se o download falhar; thread.cancel.set()
+    interrompe o download (ex.: o reframe falhou antes do fim).
+    """
+    open(dest + ".part", "wb").close()
+
+    def run():
+        try:
+            _download_to_tmp(input_url, hasher, dest=dest, cancel=thread.cancel,
+                             progress_cb=lambda p: _set(job_id, download_progress=p))
+            _set(job_id, download_progress=1.0)
+        except Exception as e:
+            thread.error = e
+            # Sem .part nem arquivo final o reframe sabe que o download falhou
+            try: os.remove(dest + ".part")
+            except OSError: pass
+
+    thread = threading.Thread(target=run, name=f"download-{job_id}", daemon=True)
+    thread.error = None
+    thread.cancel = threading.Event()
+    thread.start()
+    return thread
+
+def _render_debug(job: dict, log_path: str, cached: str, fmt: str, scale: float, samples: int) -> None:
+    """
+    Gera o vídeo (ou folha de contato) debug em cached, numa thread. O original é
+    baixado de novo; se a URL não responde mais (ex.: URL assinada expirada), o erro diz isso.
+    """
+    src = None
+    tmp_render = f"{os.path.splitext(cached)[0]}.{uuid.uuid4().hex[:6]}{os.path.splitext(cached)[1]}"
+    try:
+        with _debug_render_slots:
+            try:
+                src = _download_to_tmp(job["input_url"])
+            except ValueError as e:
+                status = getattr(getattr(e.__cause__, "response", None), "status_code", None)
+                if status in (401, 403, 404, 410):
+                    raise _DebugRenderError(
+                        f"vídeo original não está mais acessível (HTTP {status}): a URL de input "
+                        f"expirou ou foi removida; reenvie o job para gerar o debug", 410) from e
+                raise
+            if fmt == "video":
+                render_debug_video(src, log_path, tmp_render, scale=scale)
+            else:
+                render_debug_contact_sheet(src, log_path, tmp_render, samples=samples, scale=scale)
+            os.replace(tmp_render, cached)
+        with _debug_renders_lock:
+            _debug_renders.pop(cached, None)
+    except Exception as e:
+        with _debug_renders_lock:
+            _debug_renders[cached] = {
+                "status": "error",
+                "error": str(e) if isinstance(e, _DebugRenderError) else f"falha ao gerar debug: {e}",
+                "status_code": getattr(e, "status_code", 500)
+            }
+    finally:
+        if os.path.exists(tmp_render):
+            os.remove(tmp_render)
+        # Original baixado de novo só para o debug
+        if src and job["input_url"].startswith(("http://", "https://")):
+            try: os.remove(src)
+            except OSError: pass
+
+def _processing_params(job: dict) -> dict:
+    """Parâmetros que determinam o resultado de um job (parte da chave do cache de resultados)."""
+    return {
+        "app_version": Config.APP_VERSION,
+        "aspect_ratios": job.get("aspect_ratios") or ["9:16"],
+        "output": job.get("output", "video"),
+        "render": Config.REFRAME_RENDER,
+        "detect_stride": Config.REFRAME_DETECT_STRIDE,
+        "analysis_size": Config.REFRAME_ANALYSIS_SIZE,
+        "smoothing": Config.REFRAME_SMOOTHING,
+        "writer": Config.REFRAME_WRITER,
+        "x264_preset": Config.REFRAME_X264_PRESET,
+        "x264_crf": Config.REFRAME_X264_CRF,
+        "scene_threshold": Config.REFRAME_SCENE_THRESHOLD,
+        "silence_stride": Config.REFRAME_SILENCE_STRIDE,
+        "stream_input": Config.REFRAME_STREAM_INPUT,
+        "output_prefix": Config.OUTPUT_PREFIX
+    }
+
+def _cached_result_usable(result: dict) -> bool:
+    """
+    Resultados com arquivos locais (fallback de upload, crop path, log de trajetória) só valem
+    enquanto os arquivos existem: a entrada do cache vive no máximo JOB_FILES_TTL_DAYS depois
+    do último uso (cada acerto renova os arquivos, ver _touch_result_files).
+    """
+    for output in result.get("outputs") or []:
+        url = output.get("output_url") or ""
+        if url.startswith("file://") and not os.path.exists(url[len("file://"):]):
+            return False
+    local_files = [result.get("crop_path_local"), result.get("trajectory_log_local")]
+    return all(not path or os.path.exists(path) for path in local_files)
+
+def _touch_result_files(result: dict) -> None:
+    """Renova a idade dos arquivos locais de um resultado reaproveitado (a limpeza conta pelo mtime)"""
+    for path in (result.get("crop_path_local"), result.get("trajectory_log_local")):
+        if path:
+            try: os.utime(path)
+            except OSError: pass
+
+def _finish_job(job_id: str, job: dict, result: dict) -> None:
+    """Marca o job como concluído com result (output_key/url, outputs, metrics...) e chama o callback."""
+    _set(job_id, status="done", stage="done", stage_progress=1.0, finished_at=_now(), **result)
+
+    # callback opcional
+    cb = job.get("callback_url")
+    if cb:
+        try:
+            requests.post(cb, json={
+                "status": "done",
+                "job_id": job_id,
+                "output_url": result["output_url"],
+                "output_key": result["output_key"],
+                "outputs": result["outputs"],
+                "metrics": result["metrics"],
+                "cache_hit": bool(result.get("cache_hit"))
+            }, timeout=10)
+        except Exception:
+            pass
+
+def _worker(runner=None) -> None:
+    """
+    Worker thread que processa jobs da fila.
+    Com runner (WORKER_MODE=process), o reframe roda no processo filho do worker;
+    senão, a thread mantém seus próprios detectores pré-aquecidos entre os jobs.
+    """
+    if runner:
+        run_reframe = runner.run
+    else:
+        run_reframe = functools.partial(reframe_video, detectors=DetectorBundle())
     while True:
         job_id = _q.get()
         if job_id is None:  # sentinela para encerrar
@@ -327,14 +697,41 @@ def _worker() -> None:
         
         in_path = None
         tmp_out = None
+        extra_outputs = []
+        download = None
         
         try:
             job = _jobs[job_id]
             _set(job_id, stage="downloading", stage_progress=0.0, started_at=_now())
 
-            # 1) download (ou caminho local)
-            in_path = _download_to_tmp(job["input_url"])
-            _set(job_id, stage="downloading", stage_progress=1.0)
+            # 1) download (ou caminho local), com hash do conteúdo calculado no mesmo passo
+            hasher = hashlib.sha256() if _result_cache is not None else None
+            stream_url = None
+            if Config.REFRAME_STREAM_INPUT and urlparse(job["input_url"]).scheme in ("http", "https"):
+                # Streaming: o reframe decodifica da URL enquanto o download segue em paralelo
+                stream_url = job["input_url"]
+                ext = os.path.splitext(urlparse(stream_url).path)[1] or ".mp4"
+                in_path = os.path.join(Config.TMP_DIR, f"input_{job_id}{ext}")
+                _set(job_id, download_progress=0.0)
+                download = _start_stream_download(job_id, stream_url, in_path, hasher)
+            else:
+                in_path = _download_to_tmp(job["input_url"], hasher,
+                                           progress_cb=lambda p: _set(job_id, stage_progress=p))
+                _set(job_id, stage="downloading", stage_progress=1.0)
+
+            # Mesmo conteúdo + mesmos parâmetros já processados: reaproveita o resultado
+            # (no streaming o hash só existe no fim do download: consulta pulada, resultado ainda é gravado)
+            cache_key = None
+            if hasher is not None and download is None:
+                cache_key = f"{hasher.hexdigest()}:{params_digest(_processing_params(job))}"
+                cached = _result_cache.get(cache_key)
+                if cached is not None and not _cached_result_usable(cached):
+                    _result_cache.discard(cache_key)
+                    cached = None
+                if cached is not None:
+                    _touch_result_files(cached)
+                    _finish_job(job_id, job, dict(cached, cache_hit=True, content_hash=hasher.hexdigest()))
+                    continue
 
             # 2) reframe (com callback p/ progresso)
             with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tmp_file:
@@ -347,65 +744,92 @@ def _worker() -> None:
                 elif stage == "muxing":
                     _set(job_id, stage="muxing", stage_progress=float(progress))
 
-            debug_mode = job.get("debug", False)
-            debug_output_path = None
-            if debug_mode:
-                debug_output_path = os.path.join(Config.TMP_DIR, f"debug_{job_id}.mp4")
+            # Todo job grava o log compacto de trajetória; o vídeo debug é gerado sob
+            # demanda em /v1/video/debug/<job_id> (jobs com debug custam o mesmo que os demais)
+            trajectory_log = os.path.join(Config.TMP_DIR, f"trajectory_{job_id}.npz")
+            # Trajetória de corte sempre exportada; output="crop_path" pula render e upload
+            crop_path = os.path.join(Config.TMP_DIR, f"crop_path_{job_id}.npz")
+            only_crop_path = job.get("output") == "crop_path"
             
-            metrics = reframe_video(in_path, tmp_out, progress_cb=progress_cb, debug=debug_mode, debug_output=debug_output_path)
-
-            # 3) upload ao Spaces (ou salvar localmente se falhar)
+            metrics = run_reframe(in_path, None if only_crop_path else tmp_out, progress_cb=progress_cb,
+                                    trajectory_log=trajectory_log, crop_path=crop_path,
+                                    pipeline=Config.REFRAME_PIPELINE,
+                                    render="none" if only_crop_path else Config.REFRAME_RENDER,
+                                    detect_stride=Config.REFRAME_DETECT_STRIDE,
+                                    analysis_size=Config.REFRAME_ANALYSIS_SIZE,
+                                    smoothing=Config.REFRAME_SMOOTHING,
+                                    writer=Config.REFRAME_WRITER,
+                                    encoder_preset=Config.REFRAME_X264_PRESET,
+                                    encoder_crf=Config.REFRAME_X264_CRF,
+                                    scene_threshold=Config.REFRAME_SCENE_THRESHOLD,
+                                    segment_workers=Config.REFRAME_SEGMENT_WORKERS,
+                                    silence_stride=Config.REFRAME_SILENCE_STRIDE,
+                                    analysis_cache=Config.REFRAME_ANALYSIS_CACHE_DIR or None,
+                                    content_hash=hasher.hexdigest() if hasher is not None and download is None else None,
+                                    stream_url=stream_url,
+                                    aspect_ratios=job.get("aspect_ratios"))
+            # Formatos extras já gravados: saem no finally mesmo se o download falhar depois
+            extra_outputs = [o["path"] for o in metrics["outputs"][1:]]
+            if download is not None:
+                # O reframe já esperou o arquivo local; confirma o download e fecha o hash
+                download.join()
+                if download.error:
+                    raise download.error
+                if hasher is not None:
+                    cache_key = f"{hasher.hexdigest()}:{params_digest(_processing_params(job))}"
+
+            # 3) upload ao Spaces (ou salvar localmente se falhar), um arquivo por formato
             _set(job_id, stage="uploading", stage_progress=0.0)
-            try:
-                key = make_key(Config.OUTPUT_PREFIX, os.path.basename(tmp_out))
-                url = upload_public(tmp_out, key)
-                _set(job_id, stage="uploading", stage_progress=1.0)
-            except Exception as upload_error:
-                # Se upload falhar, salva localmente
-                local_output = os.path.join(Config.TMP_DIR, f"reframe_output_{job_id}.mp4")
-                shutil.copy2(tmp_out, local_output)
-                _set(job_id, stage="uploading", stage_progress=1.0, 
-                     upload_error=str(upload_error), local_output=local_output)
-                url = f"file://{local_output}"
-                key = f"local_{job_id}"
+            outputs = []
+            for idx, output in enumerate([] if only_crop_path else metrics["outputs"]):
+                path = output["path"]
+                suffix = "" if idx == 0 else f"_{output['label']}"
+                try:
+                    key = make_key(Config.OUTPUT_PREFIX, os.path.basename(path))
+                    # progresso por bytes enviados, dentro da fatia deste formato no estágio
+                    url = upload_public(path, key, progress_cb=lambda p, idx=idx: _set(
+                        job_id, stage="uploading", stage_progress=(idx + p) / float(len(metrics["outputs"]))))
+                except Exception as upload_error:
+                    # Se upload falhar, salva localmente
+                    local_output = os.path.join(Config.TMP_DIR, f"reframe_output_{job_id}{suffix}.mp4")
+                    shutil.copy2(path, local_output)
+                    if idx == 0:
+                        _set(job_id, upload_error=str(upload_error), local_output=local_output)
+                    url = f"file://{local_output}"
+                    key = f"local_{job_id}{suffix}"
+                outputs.append({"aspect_ratio": output["aspect_ratio"], "output_key": key, "output_url": url})
+                _set(job_id, stage="uploading", stage_progress=(idx + 1) / float(len(metrics["outputs"])))
+
+            # Formato principal continua em output_key/output_url (sem vídeo no modo crop_path)
+            key = outputs[0]["output_key"] if outputs else None
+            url = outputs[0]["output_url"] if outputs else None
 
             # 4) finaliza
-            job_update = {
-                "status": "done",
-                "stage": "done",
-                "stage_progress": 1.0,
-                "finished_at": _now(),
+            result = {
                 "output_key": key,
                 "output_url": url,
+                "outputs": outputs,
                 "metrics": metrics
             }
-            
-            # Se debug foi ativado e arquivo existe, adiciona ao job
-            if debug_mode and debug_output_path and os.path.exists(debug_output_path):
-                job_update["debug_output_local"] = debug_output_path
-            
-            _set(job_id, **job_update)
+            if os.path.exists(trajectory_log):
+                result["trajectory_log_local"] = trajectory_log
+            if os.path.exists(crop_path):
+                result["crop_path_local"] = crop_path
 
-            # callback opcional
-            cb = job.get("callback_url")
-            if cb:
-                try:
-                    requests.post(cb, json={
-                        "status": "done",
-                        "job_id": job_id,
-                        "output_url": url,
-                        "output_key": key,
-                        "metrics": metrics
-                    }, timeout=10)
-                except Exception:
-                    pass
+            # Só entram no cache resultados completos (upload de todos os formatos ok)
+            if cache_key and not any(o["output_key"].startswith("local_") for o in outputs):
+                _result_cache.put(cache_key, result)
+            if hasher is not None:
+                result["content_hash"] = hasher.hexdigest()
+
+            _finish_job(job_id, job, result)
 
         except Exception as e:
             # Captura informações detalhadas do erro
             error_details = {
                 "error": str(e),
                 "error_type": type(e).__name__,
-                "stage": job.get("stage", "unknown")
+                "error_stage": job.get("stage", "unknown")
             }
             
             # Se for erro de RuntimeError (mux), adiciona contexto adicional
@@ -417,47 +841,73 @@ def _worker() -> None:
                 error_details["returncode"] = e.returncode
                 if hasattr(e, 'stderr') and e.stderr:
                     error_details["stderr"] = e.stderr.decode('utf-8', errors='ignore')[:500]
+            elif isinstance(e, ReframeProcessError):
+                error_details["error_category"] = "worker_crash"
+                error_details["message"] = "Processo de reframe encerrado (crash ou limite de memória)"
+            elif isinstance(e, MemoryError):
+                error_details["error_category"] = "memory_error"
+                error_details["message"] = "Limite de memória do processo de reframe excedido"
             else:
                 error_details["error_category"] = "unknown_error"
             
             _set(job_id, status="error", stage="error", **error_details)
         finally:
-            # Limpa arquivos temporários usando context managers
-            try:
-                if in_path and not job["input_url"].startswith("file://") and not os.path.exists(job["input_url"]):
-                    if os.path.isfile(in_path) and os.path.dirname(in_path).startswith("/var/folders/"):
-                        os.remove(in_path)
-            except Exception:
-                pass
-
-            try:
-                if tmp_out and os.path.isfile(tmp_out):
-                    os.remove(tmp_out)
-            except Exception:
-                pass
+            # Streaming: um reframe que falhou não deixa o download seguindo em segundo plano
+            if download is not None:
+                download.cancel.set()
+                download.join()
+
+            # Input baixado (http/https) é cópia nossa: sai junto com o .part de um download interrompido
+            if in_path and urlparse(job["input_url"]).scheme in ("http", "https"):
+                for path in (in_path, in_path + ".part"):
+                    try: os.remove(path)
+                    except OSError: pass
+
+            for path in [tmp_out] + extra_outputs:
+                try:
+                    if path and os.path.isfile(path):
+                        os.remove(path)
+                except Exception:
+                    pass
 
             _q.task_done()
 
 # Carrega uploads do snapshot ao iniciar
-_load_uploads()
+if _is_main_process:
+    _load_uploads()
 
 # Worker para limpeza periódica de uploads expirados
 def _cleanup_worker():
-    """Worker que limpa uploads expirados periodicamente"""
+    """Worker que limpa uploads e arquivos de jobs expirados periodicamente"""
     while True:
         time.sleep(3600)  # Executa a cada hora
         _cleanup_expired_uploads()
+        _cleanup_expired_job_files()
 
 _cleanup_thread = threading.Thread(target=_cleanup_worker, daemon=True)
-_cleanup_thread.start()
+if _is_main_process:
+    _cleanup_thread.start()
 
-# inicia os workers
+# inicia os workers (no modo process, cada um com seu processo de reframe já carregado);
+# só o processo principal sobe workers (ver _is_main_process)
 _workers = []
-for _ in range(Config.MAX_WORKERS):
-    t = threading.Thread(target=_worker, daemon=True)
+_runners = []
+for _ in range(Config.MAX_WORKERS if _is_main_process else 0):
+    runner = None
+    if Config.WORKER_MODE == "process":
+        runner = ReframeProcess(memory_limit_mb=Config.WORKER_MEMORY_LIMIT_MB)
+        runner.start()
+        _runners.append(runner)
+    t = threading.Thread(target=_worker, args=(runner,), daemon=True)
     t.start()
     _workers.append(t)
 
+@atexit.register
+def _stop_runners() -> None:
+    """Encerra os processos de reframe junto com a API"""
+    for runner in _runners:
+        runner.close()
+
 @app.route("/")
 def root() -> tuple:
     """
@@ -539,8 +989,19 @@ def enqueue_reframe() -> tuple:
               example: "https://example.com/callback"
             debug:
               type: boolean
-              description: Ativa modo debug para gerar vídeo com overlays
+              description: Mantido por compatibilidade; todo job grava o log de trajetória e o vídeo debug é gerado sob demanda em /v1/video/debug/{job_id}
               default: false
+            aspect_ratios:
+              type: array
+              items:
+                type: string
+              description: Formatos de saída gerados numa única análise ("9:16", "1:1", "4:5" ou "1080x1920"). O primeiro é o principal (output_url)
+              example: ["9:16", "1:1", "4:5"]
+            output:
+              type: string
+              enum: [video, crop_path]
+              default: video
+              description: '"crop_path" só calcula a trajetória de corte (sem render nem upload); baixe em /v1/video/crop_path/{job_id}'
     responses:
       202:
         description: Job enfileirado com sucesso
@@ -594,7 +1055,29 @@ def enqueue_reframe() -> tuple:
     input_path = data.get("input_path")  # novo: permite caminho local puro
     input_upload_id = data.get("input_upload_id")  # novo: permite usar upload_id
     callback_url = data.get("callback_url")
-    debug = data.get("debug", False)  # modo debug para gerar vídeo com overlays
+    debug = data.get("debug", False)  # compatibilidade: o debug é gerado sob demanda a partir do log
+    aspect_ratios = data.get("aspect_ratios")  # formatos de saída extras (padrão: só 9:16)
+    output = data.get("output", "video")  # "crop_path": só a trajetória de corte, sem vídeo
+
+    if output not in ("video", "crop_path"):
+        return error_response(
+            message="'output' deve ser \"video\" ou \"crop_path\".",
+            status_code=400
+        )
+
+    if aspect_ratios is not None:
+        if isinstance(aspect_ratios, str):
+            aspect_ratios = [aspect_ratios]
+        if not isinstance(aspect_ratios, list) or not aspect_ratios:
+            return error_response(
+                message="'aspect_ratios' deve ser uma lista como [\"9:16\", \"1:1\"].",
+                status_code=400
+            )
+        try:
+            for spec in aspect_ratios:
+                parse_target(spec)
+        except ValueError as e:
+            return error_response(message=str(e), status_code=400)
 
     # Se veio input_upload_id, busca a URL do upload
     if input_upload_id:
@@ -605,6 +1088,9 @@ def enqueue_reframe() -> tuple:
                 status_code=404
             )
         input_url = upload.get("upload_url")
+        # Cópia local gravada durante o upload (UPLOAD_LOCAL_CACHE_DIR): evita baixar de volta
+        if upload.get("local_path") and os.path.exists(upload["local_path"]):
+            input_url = f"file://{upload['local_path']}"
     
     # Se veio input_path, converte automaticamente para file://
     if not input_url and input_path:
@@ -628,7 +1114,9 @@ def enqueue_reframe() -> tuple:
             "progress": 0.0,
             "input_url": input_url,
             "callback_url": callback_url,
-            "debug": bool(debug)
+            "debug": bool(debug),
+            "aspect_ratios": aspect_ratios,
+            "output": output
         }
     _save_job(job_id)
     _q.put(job_id)
@@ -834,10 +1322,112 @@ def download_video(job_id):
         status_code=404
     )
 
+@app.route("/v1/video/crop_path/<job_id>", methods=["GET"])
+def download_crop_path(job_id):
+    """
+    Baixa a trajetória de corte do job (x1, y1, crop_w, crop_h por frame)
+    ---
+    tags:
+      - Video
+    security:
+      - ApiTokenAuth: []
+    parameters:
+      - in: path
+        name: job_id
+        type: string
+        required: true
+        description: ID do job
+      - in: query
+        name: format
+        type: string
+        enum: [json, binary]
+        default: json
+        description: JSON ou array binário int16 little-endian com 4 valores por frame (x1, y1, crop_w, crop_h)
+      - in: query
+        name: aspect_ratio
+        type: string
+        description: Formato pedido no job (padrão o principal)
+    responses:
+      200:
+        description: Trajetória de corte; no binário, fps e dimensões vêm nos headers X-Fps, X-Frame-Count e X-Source-Size
+      400:
+        description: Job ainda não foi concluído ou parâmetros inválidos
+      404:
+        description: Job, formato ou trajetória não encontrados
+    """
+    job = _jobs.get(job_id)
+    if not job:
+        # tenta ler snapshot
+        snap = os.path.join(Config.JOBS_SNAPSHOT_DIR, f"job_{job_id}.json")
+        if os.path.exists(snap):
+            with open(snap) as f:
+                job = json.load(f)
+                _jobs[job_id] = job
+        else:
+            return error_response(
+                message="job não encontrado",
+                status_code=404
+            )
+    
+    if job.get("status") != "done":
+        return error_response(
+            message="job ainda não foi concluído",
+            status_code=400
+        )
+
+    fmt = request.args.get("format", "json")
+    if fmt not in ("json", "binary"):
+        return error_response(message="use format=json ou format=binary", status_code=400)
+
+    path = job.get("crop_path_local")
+    if not path or not os.path.exists(path):
+        return error_response(
+            message=f"trajetória de corte não disponível para este job (expira após {Config.JOB_FILES_TTL_DAYS} dias)",
+            status_code=404
+        )
+
+    crop_paths = load_crop_paths(path)
+    aspect_ratio = request.args.get("aspect_ratio")
+    targets = [t for t in crop_paths["targets"] if aspect_ratio in (None, t["aspect_ratio"], t["label"])]
+    if not targets:
+        return error_response(
+            message=f"formato não gerado neste job: {aspect_ratio}",
+            status_code=404
+        )
+    target = targets[0]
+    trajectory = target["trajectory"]
+
+    if fmt == "binary":
+        rects = np.empty((len(trajectory), 4), dtype="<i2")
+        rects[:, :2] = trajectory
+        rects[:, 2] = target["crop_w"]
+        rects[:, 3] = target["crop_h"]
+        response = send_file(io.BytesIO(rects.tobytes()), mimetype="application/octet-stream", as_attachment=True,
+                             download_name=f"crop_path_{job_id}_{target['label']}.bin")
+        response.headers["X-Fps"] = str(crop_paths["fps"])
+        response.headers["X-Frame-Count"] = str(len(trajectory))
+        response.headers["X-Source-Size"] = f"{crop_paths['width']}x{crop_paths['height']}"
+        response.headers["X-Aspect-Ratio"] = target["aspect_ratio"]
+        return response
+
+    return success_response(
+        data={
+            "job_id": job_id,
+            "aspect_ratio": target["aspect_ratio"],
+            "fps": crop_paths["fps"],
+            "frame_count": len(trajectory),
+            "source_width": crop_paths["width"],
+            "source_height": crop_paths["height"],
+            "output_size": list(target["size"]) if target["size"] else None,
+            "crop": [[int(x1), int(y1), target["crop_w"], target["crop_h"]] for x1, y1 in trajectory.tolist()]
+        },
+        message="Crop path retrieved"
+    )
+
 @app.route("/v1/video/debug/<job_id>", methods=["GET"])
 def download_debug_video(job_id):
     """
-    Baixa o arquivo de vídeo debug (se disponível)
+    Baixa o vídeo debug do job, gerado sob demanda a partir do original e do log de trajetória
     ---
     tags:
       - Video
@@ -849,13 +1439,32 @@ def download_debug_video(job_id):
         type: string
         required: true
         description: ID do job
+      - in: query
+        name: format
+        type: string
+        enum: [video, contact_sheet]
+        default: video
+        description: Vídeo com overlays ou folha de contato (JPEG) com frames amostrados
+      - in: query
+        name: scale
+        type: number
+        description: Fator de resolução (0.05 a 1). Padrão 1 para vídeo e 0.25 para folha de contato
+      - in: query
+        name: samples
+        type: integer
+        default: 12
+        description: Número de frames da folha de contato
     responses:
       200:
-        description: Arquivo de vídeo debug
+        description: Arquivo de vídeo debug (ou JPEG da folha de contato); fica em cache após a primeira geração
+      202:
+        description: Debug em geração em segundo plano; repita a mesma requisição até receber 200
+      410:
+        description: Vídeo original não está mais acessível (URL expirada ou removida)
       400:
-        description: Job ainda não foi concluído
+        description: Job ainda não foi concluído ou parâmetros inválidos
       404:
-        description: Job ou vídeo debug não encontrado
+        description: Job ou log de trajetória não encontrado
     """
     job = _jobs.get(job_id)
     if not job:
@@ -877,15 +1486,59 @@ def download_debug_video(job_id):
             status_code=400
         )
     
+    log_path = job.get("trajectory_log_local")
+    fmt = request.args.get("format", "video")
+    try:
+        scale = float(request.args.get("scale", "1.0" if fmt == "video" else "0.25"))
+        samples = int(request.args.get("samples", "12"))
+    except ValueError:
+        return error_response(message="'scale' deve ser número e 'samples' inteiro", status_code=400)
+    if fmt not in ("video", "contact_sheet") or not 0.05 <= scale <= 1.0 or not 1 <= samples <= 100:
+        return error_response(
+            message="use format=video|contact_sheet, scale entre 0.05 e 1 e samples entre 1 e 100",
+            status_code=400
+        )
+
+    # Jobs antigos: vídeo debug gerado durante o processamento
     debug_output = job.get("debug_output_local")
-    if debug_output and os.path.exists(debug_output):
+    if fmt == "video" and scale == 1.0 and debug_output and os.path.exists(debug_output):
         return send_file(debug_output, as_attachment=True, 
                         download_name=f"debug_{job_id}.mp4")
-    
-    return error_response(
-        message="vídeo debug não disponível. Certifique-se de que o job foi processado com debug=true",
-        status_code=404
-    )
+
+    if not log_path or not os.path.exists(log_path):
+        return error_response(
+            message="log de trajetória não disponível para este job",
+            status_code=404
+        )
+
+    # Renderiza sob demanda a partir do original + log e guarda em cache no TMP_DIR
+    if fmt == "video":
+        cached = os.path.join(Config.TMP_DIR, f"debug_{job_id}_{int(round(scale * 100))}.mp4")
+        download_name = f"debug_{job_id}.mp4"
+    else:
+        cached = os.path.join(Config.TMP_DIR, f"debug_{job_id}_sheet{samples}_{int(round(scale * 100))}.jpg")
+        download_name = f"debug_{job_id}.jpg"
+    if not os.path.exists(cached):
+        # Decodificar e recodificar o original leva tanto quanto o vídeo: roda fora do
+        # request (o worker sync do gunicorn ficaria preso) e o cliente repete até o 200
+        with _debug_renders_lock:
+            render = _debug_renders.get(cached)
+            if render is None:
+                _debug_renders[cached] = {"status": "rendering", "started_at": _now()}
+                threading.Thread(target=_render_debug, name=f"debug-{job_id}", daemon=True,
+                                 args=(job, log_path, cached, fmt, scale, samples)).start()
+            elif render["status"] == "error":
+                # Falha entregue uma vez; a próxima requisição tenta de novo
+                del _debug_renders[cached]
+        if render is not None and render["status"] == "error":
+            return error_response(message=render["error"], status_code=render["status_code"])
+        return queued_response(
+            data={"status": "rendering", "format": fmt, "poll_url": request.full_path.rstrip("?")},
+            message="Debug em geração; repita a requisição para baixar",
+            job_id=job_id
+        )
+
+    return send_file(cached, as_attachment=True, download_name=download_name)
 
 @app.route("/v1/test/upload", methods=["POST"])
 def test_upload():
@@ -935,6 +1588,8 @@ def test_upload():
 def upload_file():
     """
     Faz upload de um arquivo para a CDN
+    O arquivo é repassado ao Spaces em partes enquanto o corpo chega (sem arquivo
+    temporário). Envie folder/ttl_days antes de 'file' no form-data (ou na query string).
     ---
     tags:
       - Uploads
@@ -952,7 +1607,7 @@ def upload_file():
         name: folder
         type: string
         required: false
-        description: "Pasta de destino (padrão: upload/reframe)"
+        description: "Pasta de destino (padrão: upload/reframe); precisa vir antes de 'file'"
       - in: formData
         name: ttl_days
         type: integer
@@ -1018,85 +1673,237 @@ def upload_file():
             build:
               type: object
     """
-    if 'file' not in request.files:
+    # O corpo é lido em streaming: request.files gravaria o arquivo inteiro num
+    # temporário antes de reenviá-lo. folder/ttl_days também valem na query string.
+    mimetype, options = parse_options_header(request.headers.get("Content-Type", ""))
+    if mimetype != "multipart/form-data" or not options.get("boundary"):
         return error_response(
             message="Nenhum arquivo enviado. Use o campo 'file' no form-data.",
             status_code=400
         )
     
-    file = request.files['file']
-    if file.filename == '':
-        return error_response(
-            message="Nome do arquivo vazio",
-            status_code=400
-        )
-    
-    # Parâmetros opcionais
-    folder = request.form.get('folder', Config.UPLOAD_DEFAULT_FOLDER).strip()
-    ttl_days = int(request.form.get('ttl_days', Config.UPLOAD_TTL_DAYS))
-    
-    # Valida TTL máximo
-    if ttl_days > Config.UPLOAD_MAX_TTL_DAYS:
-        ttl_days = Config.UPLOAD_MAX_TTL_DAYS
-    if ttl_days < 1:
-        ttl_days = Config.UPLOAD_TTL_DAYS
-    
-    # Valida nome da pasta (evita path traversal)
-    if '..' in folder or '/' not in folder:
-        folder = Config.UPLOAD_DEFAULT_FOLDER
+    fields = {k: v for k, v in request.args.items() if k in ("folder", "ttl_days")}
+    upload_id = f"upl_{uuid.uuid4().hex[:10]}"
     
     try:
-        # Salva arquivo temporariamente
-        ext = os.path.splitext(file.filename)[1] or ""
-        fd, tmp_path = tempfile.mkstemp(suffix=ext, dir=Config.TMP_DIR)
-        with os.fdopen(fd, "wb") as f:
-            file.save(f)
-        
-        # Faz upload para Spaces
-        key = make_key(folder, file.filename)
-        url = upload_public(tmp_path, key)
-        
-        # Remove arquivo temporário
-        os.remove(tmp_path)
-        
-        # Cria registro do upload
-        upload_id = f"upl_{uuid.uuid4().hex[:10]}"
-        created_at = _now()
-        expires_at = created_at + (ttl_days * 86400)
-        
-        upload_record = {
-            "upload_id": upload_id,
-            "key": key,
-            "upload_url": url,
-            "folder": folder,
-            "filename": file.filename,
-            "created_at": created_at,
-            "expires_at": expires_at,
-            "ttl_days": ttl_days
-        }
-        
-        with _uploads_lock:
-            _uploads[upload_id] = upload_record
+        # Envia para Spaces em partes enquanto o corpo chega
+        received = _receive_upload(upload_id, options["boundary"], fields)
+        if received is None:
+            return error_response(
+                message="Nenhum arquivo enviado. Use o campo 'file' no form-data.",
+                status_code=400
+            )
         
-        _save_uploads()
+        upload_record = _register_upload(
+            upload_id, received["key"], received["upload_url"], received["folder"], received["filename"],
+            received["size"], _upload_ttl(fields.get('ttl_days')), local_path=received["local_path"]
+        )
         
         return success_response(
-            data={
-                "upload_id": upload_id,
-                "upload_url": url,
-                "key": key,
-                "folder": folder,
-                "expires_at": expires_at
-            },
+            data={k: upload_record[k] for k in ("upload_id", "upload_url", "key", "folder", "expires_at")},
             message="Upload realizado com sucesso"
         )
         
+    except ValueError as e:
+        return error_response(
+            message=str(e),
+            status_code=400
+        )
     except Exception as e:
         return error_response(
             message=f"Erro ao fazer upload: {str(e)}",
             status_code=500
         )
 
+@app.route("/v1/uploads/presign", methods=["POST"])
+def presign_upload():
+    """
+    Gera URLs assinadas para enviar um arquivo direto ao bucket
+    O arquivo não passa pela API: o cliente faz PUT nas URLs e depois chama
+    POST /v1/uploads/{upload_id}/complete para registrar o upload.
+    ---
+    tags:
+      - Uploads
+    security:
+      - ApiTokenAuth: []
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - filename
+          properties:
+            filename:
+              type: string
+              example: video.mp4
+            size:
+              type: integer
+              description: Tamanho em bytes (obrigatório para multipart)
+              example: 2147483648
+            multipart:
+              type: boolean
+              description: "Força (ou desliga) multipart (padrão: size acima de SPACES_MULTIPART_THRESHOLD_MB)"
+            folder:
+              type: string
+              description: "Pasta de destino (padrão: upload/reframe)"
+            ttl_days:
+              type: integer
+              description: "Dias até expiração (padrão: 7, máximo: 30)"
+    responses:
+      200:
+        description: URLs geradas
+        examples:
+          application/json:
+            status: success
+            message: URLs de upload geradas
+            data:
+              upload_id: upl_b7e12b661e
+              key: upload/reframe/2025/11/12/abc123.mp4
+              folder: upload/reframe
+              method: PUT
+              expires_in: 3600
+              complete_url: /v1/uploads/upl_b7e12b661e/complete
+              multipart: true
+              part_size: 8388608
+              parts:
+                - part_number: 1
+                  url: https://cod5.nyc3.digitaloceanspaces.com/upload/reframe/2025/11/12/abc123.mp4?partNumber=1&uploadId=...
+      400:
+        description: Erro na requisição
+    """
+    data = request.get_json(silent=True) or {}
+    filename = str(data.get("filename") or "").strip()
+    if not filename:
+        return error_response(message="Envie 'filename'.", status_code=400)
+    try:
+        size = int(data.get("size") or 0)
+    except (TypeError, ValueError):
+        return error_response(message="'size' deve ser o tamanho do arquivo em bytes.", status_code=400)
+    
+    multipart = data.get("multipart")
+    if multipart is None:
+        multipart = size > Config.SPACES_MULTIPART_THRESHOLD_MB * 1024 * 1024
+    if multipart and size <= 0:
+        return error_response(message="Upload multipart precisa de 'size' (bytes).", status_code=400)
+    
+    upload_id = f"upl_{uuid.uuid4().hex[:10]}"
+    folder = _upload_folder(data.get("folder"))
+    key = make_key(folder, filename)
+    expires_in = Config.UPLOAD_PRESIGN_EXPIRES
+    
+    try:
+        if multipart:
+            signed = presign_multipart(key, size, filename, expires_in)
+        else:
+            signed = presign_put(key, filename, expires_in)
+    except Exception as e:
+        return error_response(message=f"Erro ao gerar URLs de upload: {str(e)}", status_code=500)
+    
+    pending = {
+        "upload_id": upload_id,
+        "key": key,
+        "folder": folder,
+        "filename": filename,
+        "ttl_days": _upload_ttl(data.get("ttl_days")),
+        "multipart_id": signed.pop("multipart_id", None),
+        "expires_at": _now() + expires_in
+    }
+    try:
+        _save_pending_upload(pending)
+    except OSError as e:
+        if pending["multipart_id"]:
+            abort_multipart(key, pending["multipart_id"])
+        return error_response(message=f"Erro ao registrar upload pendente: {str(e)}", status_code=500)
+    
+    return success_response(
+        data=dict(
+            signed,
+            upload_id=upload_id,
+            key=key,
+            folder=folder,
+            method="PUT",
+            multipart=bool(multipart),
+            expires_in=expires_in,
+            complete_url=f"/v1/uploads/{upload_id}/complete"
+        ),
+        message="URLs de upload geradas"
+    )
+
+@app.route("/v1/uploads/<upload_id>/complete", methods=["POST"])
+def complete_upload(upload_id):
+    """
+    Registra um upload enviado direto ao bucket via /v1/uploads/presign
+    ---
+    tags:
+      - Uploads
+    security:
+      - ApiTokenAuth: []
+    parameters:
+      - in: path
+        name: upload_id
+        type: string
+        required: true
+        description: ID retornado pelo /v1/uploads/presign
+      - in: body
+        name: body
+        required: false
+        schema:
+          type: object
+          properties:
+            parts:
+              type: array
+              description: "Multipart: [{part_number, etag}] (opcional; sem ele, usa as partes recebidas pelo bucket)"
+              items:
+                type: object
+    responses:
+      200:
+        description: Upload registrado (mesmo formato do POST /v1/uploads)
+      400:
+        description: Objeto ainda não enviado ou multipart incompleto
+      404:
+        description: Upload não encontrado
+    """
+    # Repetir o /complete devolve o mesmo registro
+    upload = _uploads.get(upload_id)
+    if upload:
+        return success_response(
+            data={k: upload[k] for k in ("upload_id", "upload_url", "key", "folder", "expires_at")},
+            message="Upload realizado com sucesso"
+        )
+    
+    pending = _load_pending_upload(upload_id)
+    if not pending:
+        return error_response(message="Upload não encontrado", status_code=404)
+    
+    data = request.get_json(silent=True) or {}
+    key = pending["key"]
+    if pending["multipart_id"]:
+        try:
+            parts = [(p["part_number"], p["etag"]) for p in data.get("parts") or []]
+        except (TypeError, KeyError):
+            return error_response(message="'parts' deve ser uma lista de {part_number, etag}.", status_code=400)
+        try:
+            complete_multipart(key, pending["multipart_id"], parts)
+        except Exception as e:
+            # Já concluído numa tentativa anterior (que não chegou a registrar): segue com o objeto
+            if object_size(key) is None:
+                return error_response(message=f"Multipart incompleto: {str(e)}", status_code=400)
+    
+    size = object_size(key)
+    if size is None:
+        return error_response(message="Arquivo ainda não foi enviado ao bucket", status_code=400)
+    
+    upload_record = _register_upload(upload_id, key, public_url_for(key), pending["folder"],
+                                     pending["filename"], size, pending["ttl_days"])
+    _drop_pending_upload(upload_id)
+    
+    return success_response(
+        data={k: upload_record[k] for k in ("upload_id", "upload_url", "key", "folder", "expires_at")},
+        message="Upload realizado com sucesso"
+    )
+
 @app.route("/v1/uploads", methods=["GET"])
 def list_uploads():
     """
@@ -1342,6 +2149,7 @@ def delete_upload(upload_id):
     key = upload.get("key")
     if key:
         delete_public(key)
+    _remove_local_upload(upload)
     
     # Remove da memória
     with _uploads_lock:
@@ -1586,7 +2394,9 @@ def metrics_health():
                 "active": active_workers,
                 "total": len(_workers),
                 "max": Config.MAX_WORKERS,
-                "all_alive": active_workers == len(_workers)
+                "all_alive": active_workers == len(_workers),
+                "mode": Config.WORKER_MODE,
+                "processes_alive": sum(1 for r in _runners if r.is_alive())
             },
             "storage": {
                 "tmp_dir": Config.TMP_DIR,
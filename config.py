@@ -33,6 +33,36 @@ class Config:
     
     # Workers e fila
     MAX_WORKERS = int(os.getenv("MAX_WORKERS", "2"))
+    # "thread" (reframe roda na thread do worker) ou "process" (cada worker tem um processo filho)
+    WORKER_MODE = os.getenv("WORKER_MODE", "thread")
+    # Teto de memória residente (MB, RSS do processo de reframe + filhos); 0 = sem limite
+    WORKER_MEMORY_LIMIT_MB = int(os.getenv("WORKER_MEMORY_LIMIT_MB", "0"))
+    
+    # Processamento
+    # Pipeline: decode, detecção e escrita em threads separadas (usa mais de um core por job)
+    REFRAME_PIPELINE = os.getenv("REFRAME_PIPELINE", "false").lower() in ("1", "true", "yes")
+    # Render: "opencv" (VideoWriter + mux) ou "ffmpeg" (análise + corte/encode num único ffmpeg)
+    REFRAME_RENDER = os.getenv("REFRAME_RENDER", "opencv")
+    # Detecta rostos a cada N frames (1 = todo frame); centros intermediários são interpolados
+    REFRAME_DETECT_STRIDE = int(os.getenv("REFRAME_DETECT_STRIDE", "1"))
+    # Lado maior (px) do frame usado na detecção de rostos; 0 = resolução original
+    REFRAME_ANALYSIS_SIZE = int(os.getenv("REFRAME_ANALYSIS_SIZE", "0"))
+    # Suavização: "online" (frame a frame), "offline" ou "zero_phase" (trajetória inteira; exigem REFRAME_RENDER=ffmpeg)
+    REFRAME_SMOOTHING = os.getenv("REFRAME_SMOOTHING", "online")
+    # Writer do modo opencv: "opencv" (mp4v + mux) ou "ffmpeg" (libx264 + áudio num único processo)
+    REFRAME_WRITER = os.getenv("REFRAME_WRITER", "opencv")
+    REFRAME_X264_PRESET = os.getenv("REFRAME_X264_PRESET", "veryfast")
+    REFRAME_X264_CRF = int(os.getenv("REFRAME_X264_CRF", "20"))
+    # Limiar do detector de cortes de cena (0 = desativado, padrão): em cada corte o rastreamento recomeça
+    REFRAME_SCENE_THRESHOLD = float(os.getenv("REFRAME_SCENE_THRESHOLD", "0"))
+    # Vídeos longos divididos em trechos processados por até N processos (1 = desativado)
+    REFRAME_SEGMENT_WORKERS = int(os.getenv("REFRAME_SEGMENT_WORKERS", "1"))
+    # Silêncios longos (pelo áudio): detecta a cada N frames; 1 = só desempate entre rostos, 0 = sem análise de áudio (padrão)
+    REFRAME_SILENCE_STRIDE = int(os.getenv("REFRAME_SILENCE_STRIDE", "0"))
+    # Streaming: com input http(s), decodifica direto da URL enquanto baixa (sem análise de áudio)
+    REFRAME_STREAM_INPUT = os.getenv("REFRAME_STREAM_INPUT", "false").lower() in ("1", "true", "yes")
+    # Cache de análise: detecções por vídeo (conteúdo) reaproveitadas quando só suavização/formatos mudam ("" = desativado, padrão)
+    REFRAME_ANALYSIS_CACHE_DIR = os.getenv("REFRAME_ANALYSIS_CACHE_DIR", "")
     
     # Storage (DigitalOcean Spaces)
     OUTPUT_PREFIX = os.getenv("OUTPUT_PREFIX", "reframes")
@@ -42,6 +72,9 @@ class Config:
     SPACES_KEY = os.getenv("SPACES_KEY")
     SPACES_SECRET = os.getenv("SPACES_SECRET")
     SPACES_CDN_BASE = os.getenv("SPACES_CDN_BASE")
+    SPACES_MULTIPART_THRESHOLD_MB = int(os.getenv("SPACES_MULTIPART_THRESHOLD_MB", "16"))
+    SPACES_MULTIPART_CHUNK_MB = int(os.getenv("SPACES_MULTIPART_CHUNK_MB", "8"))
+    SPACES_MAX_CONCURRENCY = int(os.getenv("SPACES_MAX_CONCURRENCY", "8"))
     
     # Autenticação
     API_TOKEN = os.getenv("API_TOKEN")
@@ -57,6 +90,8 @@ class Config:
     
     # Paths
     TMP_DIR = os.getenv("TMP_DIR", "/tmp")
+    # Logs de trajetória, crop paths e renders de debug por job no TMP_DIR: removidos após esse prazo
+    JOB_FILES_TTL_DAYS = int(os.getenv("JOB_FILES_TTL_DAYS", "7"))
     JOBS_SNAPSHOT_DIR = os.getenv("JOBS_SNAPSHOT_DIR", "/tmp")
     
     # Uploads
@@ -64,6 +99,21 @@ class Config:
     UPLOAD_TTL_DAYS = int(os.getenv("UPLOAD_TTL_DAYS", "7"))
     UPLOAD_MAX_TTL_DAYS = int(os.getenv("UPLOAD_MAX_TTL_DAYS", "30"))
     UPLOADS_SNAPSHOT_DIR = os.getenv("UPLOADS_SNAPSHOT_DIR", "/tmp")
+    # Cópia local dos uploads para jobs com input_upload_id (vazio = desligado)
+    UPLOAD_LOCAL_CACHE_DIR = os.getenv("UPLOAD_LOCAL_CACHE_DIR", "")
+    # Validade (segundos) das URLs assinadas do POST /v1/uploads/presign
+    UPLOAD_PRESIGN_EXPIRES = int(os.getenv("UPLOAD_PRESIGN_EXPIRES", "3600"))
+    
+    # Download de inputs http(s): partes paralelas por Range em arquivos grandes
+    DOWNLOAD_PARTS = int(os.getenv("DOWNLOAD_PARTS", "4"))
+    DOWNLOAD_MIN_PART_MB = float(os.getenv("DOWNLOAD_MIN_PART_MB", "8"))
+    DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+    
+    # Cache de resultados: mesmo vídeo (hash do conteúdo) + mesmos parâmetros reaproveita o resultado
+    RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+    RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "/tmp")
+    RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "500"))
+    RESULT_CACHE_TTL_DAYS = int(os.getenv("RESULT_CACHE_TTL_DAYS", "7"))
     
     @classmethod
     def get_build_info(cls) -> dict:
@@ -86,17 +136,42 @@ class Config:
             "host": cls.HOST,
             "port": cls.PORT,
             "max_workers": cls.MAX_WORKERS,
+            "worker_mode": cls.WORKER_MODE,
+            "worker_memory_limit_mb": cls.WORKER_MEMORY_LIMIT_MB,
+            "reframe_pipeline": cls.REFRAME_PIPELINE,
+            "reframe_render": cls.REFRAME_RENDER,
+            "reframe_detect_stride": cls.REFRAME_DETECT_STRIDE,
+            "reframe_analysis_size": cls.REFRAME_ANALYSIS_SIZE,
+            "reframe_smoothing": cls.REFRAME_SMOOTHING,
+            "reframe_writer": cls.REFRAME_WRITER,
+            "reframe_x264_preset": cls.REFRAME_X264_PRESET,
+            "reframe_x264_crf": cls.REFRAME_X264_CRF,
+            "reframe_scene_threshold": cls.REFRAME_SCENE_THRESHOLD,
+            "reframe_segment_workers": cls.REFRAME_SEGMENT_WORKERS,
+            "reframe_silence_stride": cls.REFRAME_SILENCE_STRIDE,
             "output_prefix": cls.OUTPUT_PREFIX,
             "spaces_region": cls.SPACES_REGION,
             "spaces_endpoint": cls.SPACES_ENDPOINT,
             "spaces_bucket": cls.SPACES_BUCKET,
             "spaces_cdn_base": cls.SPACES_CDN_BASE,
+            "spaces_multipart_threshold_mb": cls.SPACES_MULTIPART_THRESHOLD_MB,
+            "spaces_max_concurrency": cls.SPACES_MAX_CONCURRENCY,
             "has_api_token": bool(cls.API_TOKEN),
             "stage_weights": cls.STAGE_WEIGHTS,
             "tmp_dir": cls.TMP_DIR,
+            "job_files_ttl_days": cls.JOB_FILES_TTL_DAYS,
             "jobs_snapshot_dir": cls.JOBS_SNAPSHOT_DIR,
             "upload_default_folder": cls.UPLOAD_DEFAULT_FOLDER,
             "upload_ttl_days": cls.UPLOAD_TTL_DAYS,
-            "upload_max_ttl_days": cls.UPLOAD_MAX_TTL_DAYS
+            "upload_max_ttl_days": cls.UPLOAD_MAX_TTL_DAYS,
+            "upload_local_cache": bool(cls.UPLOAD_LOCAL_CACHE_DIR),
+            "upload_presign_expires": cls.UPLOAD_PRESIGN_EXPIRES,
+            "download_parts": cls.DOWNLOAD_PARTS,
+            "download_retries": cls.DOWNLOAD_RETRIES,
+            "reframe_stream_input": cls.REFRAME_STREAM_INPUT,
+            "reframe_analysis_cache": bool(cls.REFRAME_ANALYSIS_CACHE_DIR),
+            "result_cache_enabled": cls.RESULT_CACHE_ENABLED,
+            "result_cache_max_entries": cls.RESULT_CACHE_MAX_ENTRIES,
+            "result_cache_ttl_days": cls.RESULT_CACHE_TTL_DAYS
         }
 
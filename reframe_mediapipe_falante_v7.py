@@ -4,10 +4,17 @@ import mediapipe as mp
 import numpy as np
 import subprocess
 import os
+import hashlib
 import tempfile
 import time
 import json
-from collections import deque
+import queue
+import shutil
+import threading
+import multiprocessing
+import bisect
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, wait
 
 mp_face_mesh = mp.solutions.face_mesh
 
@@ -17,18 +24,92 @@ DEAD_ZONE_THRESHOLD_Y = 0.05  # 5% da altura do frame (aumentado para reduzir mo
 SMOOTH_ALPHA = 0.05  # Reduzido para suavização ainda mais lenta
 CENTER_HISTORY_SIZE = 7  # Número de centros para média ponderada (aumentado para mais suavização)
 CENTER_OFFSET_Y = 0.05  # Offset vertical para focar acima do nariz (5% da altura)
+DETECT_STRIDE = 1  # Detecta a cada N frames (1 = todo frame); centros intermediários são interpolados
+ACTIVITY_HISTORY_SIZE = 15  # Detecções na média de abertura da boca que decide o falante
+TRACK_MATCH_RADIUS = 1.0  # Distância máxima (em larguras de rosto) para manter o mesmo id de trilha
+TRACK_MAX_MISSES = 15  # Detecções sem o rosto antes de descartar a trilha
+ANALYSIS_LONG_EDGE = 0  # Lado maior do frame de análise em px (ex.: 480); 0 = resolução original
+HAAR_MIN_SIZE = 30  # Tamanho mínimo do rosto no Haar, em pixels da resolução original
+HAAR_LONG_EDGE = 640  # Lado maior da imagem usada pelo fallback Haar; 0 = imagem de análise inteira
+HAAR_SCALE_FACTOR = 1.15  # Pirâmide do fallback (mais grossa que o 1.1 padrão do OpenCV)
+HAAR_ROI_SIZE = (0.5, 0.8)  # Janela de busca (fração da largura, altura) em torno do último centro
+HAAR_FULL_SEARCH_INTERVAL = 10  # A cada N buscas do fallback, varre o frame inteiro
 
-def _calculate_focused_center(landmarks, width, height):
+# Modo pipeline: tamanho das filas entre os estágios decode -> detecção -> escrita
+PIPELINE_QUEUE_SIZE = 8
+
+_STAGE_END = object()  # sentinela de fim de stream entre estágios
+
+# Encoder H.264 usado quando o ffmpeg faz a renderização final
+ENCODER_PRESET = "veryfast"
+ENCODER_CRF = 20
+
+# Codecs de áudio que podem ser copiados direto para MP4 (os demais são convertidos para AAC)
+MP4_AUDIO_COPY_CODECS = ("aac", "mp3", "ac3", "eac3", "alac")
+
+# Detecção de cortes de cena: distância de Bhattacharyya entre histogramas HSV de frames
+# consecutivos (reduzidos); acima do limiar é corte e o rastreamento recomeça do zero
+SCENE_CUT_THRESHOLD = 0.0  # 0 desativa (padrão: enquadramento igual ao de antes); 0.5 é um bom ponto de partida
+SCENE_MIN_SHOT_FRAMES = 12  # plano mínimo: evita tratar flashes/transições como vários cortes
+_SCENE_THUMB_SIZE = (64, 36)
+
+# Atividade de fala pelo áudio: envelope de energia (RMS) por frame, decodificado em streaming.
+# Em silêncios longos a detecção roda a cada SILENCE_DETECT_STRIDE frames e o corte se mantém;
+# entre rostos com abertura de boca parecida, vence o que mexe a boca quando há som
+SILENCE_DETECT_STRIDE = 0  # 0 = sem análise de áudio (padrão); 1 = só desempate pelo áudio; 10 = gating nos silêncios
+SPEECH_ENERGY_DB = -45.0  # RMS (dBFS) acima disso conta como fala
+SILENCE_MIN_SECONDS = 1.0  # silêncios mais curtos não mudam a taxa de detecção
+SPEECH_TIE_MARGIN = 0.15  # atividades a menos de 15% da maior contam como empate
+SPEECH_SAMPLE_RATE = 16000
+_SPEECH_CHUNK_SAMPLES = 1 << 16  # leitura do pipe do ffmpeg em blocos (~4s a 16 kHz)
+
+# Modo segmentado: um vídeo longo é dividido em trechos processados em paralelo (processos),
+# cada trecho com aquecimento antes do início para semear falante e suavização
+SEGMENT_WORKERS = 1  # 1 = desativado
+SEGMENT_MIN_SECONDS = 30.0  # trechos menores que isso não compensam um processo novo
+SEGMENT_WARMUP_SECONDS = 2.0
+
+# Modo render="ffmpeg": fração do estágio "reframing" reservada à análise (o resto é a renderização)
+ANALYSIS_PROGRESS_SHARE = 0.7
+
+# Landmarks do FaceMesh efetivamente usados: só esses são extraídos de cada rosto
+# nariz (1), olhos (33, 263), lábio superior (13-17), lábio inferior (308,312,317,402,318)
+# e extremos do contorno do rosto para a caixa de debug: testa (10), queixo (152), laterais (234, 454)
+_LANDMARK_IDS = (1, 33, 263, 13, 14, 15, 16, 17, 308, 312, 317, 402, 318, 10, 152, 234, 454)
+# Posições dentro do array extraído por _extract_landmarks
+_PT_NOSE = 0
+_PT_LEFT_EYE = 1
+_PT_RIGHT_EYE = 2
+_PT_TOP_LIP = slice(3, 8)
+_PT_BOTTOM_LIP = slice(8, 13)
+
+def _extract_landmarks(landmarks, width, height):
+    """
+    Converte um rosto do FaceMesh uma única vez por frame num array (N, 2) float32
+    em pixels, contendo apenas os landmarks de _LANDMARK_IDS.
+    Todos os consumidores (centro, abertura da boca, debug) compartilham esse array.
+    """
+    lm = landmarks.landmark
+    pts = np.array([(lm[k].x, lm[k].y) for k in _LANDMARK_IDS], dtype=np.float32)
+    pts *= np.array((width, height), dtype=np.float32)
+    return pts
+
+def _mouth_opening(pts):
+    """Abertura da boca (distância entre os centros dos lábios) a partir de _extract_landmarks."""
+    top_lip = pts[_PT_TOP_LIP].mean(axis=0)
+    bottom_lip = pts[_PT_BOTTOM_LIP].mean(axis=0)
+    return float(np.linalg.norm(top_lip - bottom_lip))
+
+def _calculate_focused_center(pts, height):
     """
     Calcula centro focado acima do nariz usando landmarks específicos.
     Usa nariz e olhos para posicionar o centro mais alto, evitando seguir movimentos da boca.
+    pts: array retornado por _extract_landmarks.
     """
-    pts = np.array([(lm.x * width, lm.y * height) for lm in landmarks.landmark])
-    
-    # Landmarks importantes: nariz (1), olhos (33, 263), centro da testa (10)
-    nose_tip = pts[1]  # Ponta do nariz
-    left_eye = pts[33]  # Olho esquerdo
-    right_eye = pts[263]  # Olho direito
+    # Landmarks importantes: nariz (1), olhos (33, 263)
+    nose_tip = pts[_PT_NOSE].astype(np.float64)  # Ponta do nariz
+    left_eye = pts[_PT_LEFT_EYE]  # Olho esquerdo
+    right_eye = pts[_PT_RIGHT_EYE]  # Olho direito
     
     # Calcula centro entre os olhos e nariz (mais estável que média de todos os pontos)
     eye_center = (left_eye + right_eye) / 2
@@ -56,6 +137,11 @@ def _apply_dead_zone(centro_detectado, centro_atual, width, height):
     
     return centro_detectado
 
+def _exceeds_dead_zone(centro_a, centro_b, width, height):
+    """Retorna True se a distância entre os centros excede a zona morta em algum eixo."""
+    return (abs(centro_a[0] - centro_b[0]) >= width * DEAD_ZONE_THRESHOLD_X or
+            abs(centro_a[1] - centro_b[1]) >= height * DEAD_ZONE_THRESHOLD_Y)
+
 def _smooth_center(centro_detectado, centro_history, width, height):
     """
     Aplica média ponderada dos últimos centros detectados.
@@ -80,6 +166,276 @@ def _smooth_center(centro_detectado, centro_history, width, height):
     centro_suavizado = weighted_sum / total_weight
     return tuple(centro_suavizado)
 
+class _TrajectorySmoother:
+    """
+    Estado da suavização online do centro de corte: zona morta, média ponderada
+    dos últimos centros e interpolação exponencial (SMOOTH_ALPHA).
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.centro_atual = (width // 2, height // 2)
+        self.centro_antigo = np.array(self.centro_atual)
+        self.centro_fallback = None  # rosto inicial para fallback quando não há falante detectado
+        self.fallback_offset = 0.0  # fração de CENTER_OFFSET_Y já aplicada ao fallback (1 MediaPipe, 0 Haar)
+        self.centro_history = deque(maxlen=CENTER_HISTORY_SIZE)  # Histórico para suavização
+        self._snap = False  # próximo centro detectado vira o centro atual sem transição
+
+    def reset(self):
+        """Corte de cena: descarta histórico e fallback; o corte salta para o próximo rosto."""
+        self.centro_fallback = None
+        self.fallback_offset = 0.0
+        self.centro_history.clear()
+        self._snap = True
+
+    def step(self, centro_detectado):
+        """
+        Avança um frame. centro_detectado=None significa que nada foi detectado:
+        usa centro_fallback (se já definido) ou mantém o centro atual.
+        Retorna o centro final usado para o corte.
+        """
+        if centro_detectado is None and self.centro_fallback is not None:
+            centro_detectado = tuple(self.centro_fallback)
+        if centro_detectado is not None and self._snap:
+            self._snap = False
+            self.centro_history.append(tuple(centro_detectado))
+            self.centro_atual = np.array(centro_detectado, dtype=np.float64)
+            self.centro_antigo = np.array(self.centro_atual)
+            return self.centro_atual
+        if centro_detectado is not None:
+            # Aplica zona morta para evitar movimentos pequenos
+            centro_detectado = _apply_dead_zone(centro_detectado, self.centro_atual, self.width, self.height)
+            # Aplica média ponderada dos últimos centros
+            self.centro_atual = _smooth_center(centro_detectado, self.centro_history, self.width, self.height)
+
+        # suavização final do corte (interpolação exponencial)
+        self.centro_atual = self.centro_antigo + SMOOTH_ALPHA * (np.array(self.centro_atual) - np.array(self.centro_antigo))
+        self.centro_antigo = np.array(self.centro_atual)
+        return self.centro_atual
+
+def _ema(x, alpha, y0):
+    """
+    Interpolação exponencial y[n] = y[n-1] + alpha * (x[n] - y[n-1]) sobre o array inteiro,
+    vetorizada em blocos (forma fechada por bloco; o bloco limita alpha^-k para não estourar).
+    """
+    y = np.empty_like(x)
+    decay = 1.0 - alpha
+    if alpha >= 1.0 or len(x) == 0:
+        y[:] = x
+        return y
+    if alpha <= 0.0:
+        y[:] = y0
+        return y
+    # tamanho do bloco tal que decay^-bloco <= 1e12
+    bloco = max(1, min(len(x), int(12 * np.log(10) / -np.log(decay))))
+    prev = np.asarray(y0, dtype=np.float64)
+    for ini in range(0, len(x), bloco):
+        xb = x[ini:ini + bloco]
+        k = np.arange(1, len(xb) + 1, dtype=np.float64)[:, None]
+        pot = decay ** k  # decay^(k)
+        y[ini:ini + len(xb)] = pot * (prev + alpha * np.cumsum(xb / pot, axis=0))
+        prev = y[ini + len(xb) - 1]
+    return y
+
+def _smooth_trajectory(raw, width, height, centro_fallback=None, zero_phase=False, snap=False):
+    """
+    Suavização offline da trajetória inteira (modo analyze-then-render).
+    raw: array (N, 2) com o centro bruto de cada frame (NaN = nada detectado).
+    Aplica, sobre o array inteiro: preenchimento com centro_fallback, zona morta,
+    média ponderada (CENTER_HISTORY_SIZE) e interpolação exponencial (SMOOTH_ALPHA).
+    zero_phase: filtra para frente e para trás (sem atraso), então a câmera
+                começa a se mover junto com o falante, não ~1/SMOOTH_ALPHA frames depois.
+    snap: trecho após um corte de cena; parte direto do primeiro centro detectado
+          em vez do centro do frame.
+    Retorna array (N, 2) com o centro final de cada frame.
+    """
+    raw = np.asarray(raw, dtype=np.float64).reshape(-1, 2)
+    n = len(raw)
+    inicio = np.array([width // 2, height // 2], dtype=np.float64)
+    if n == 0:
+        return raw.copy()
+
+    # Sem detecção: centro do frame até a primeira detecção, depois centro_fallback
+    centros = raw.copy()
+    vazio = np.isnan(centros[:, 0])
+    detectados = np.flatnonzero(~vazio)
+    primeiro = detectados[0] if len(detectados) else n
+    if snap and len(detectados):
+        inicio = centros[primeiro].copy()
+    centros[:primeiro] = inicio
+    if centro_fallback is not None:
+        centros[vazio & (np.arange(n) >= primeiro)] = centro_fallback
+    else:
+        centros[vazio] = inicio
+
+    # Zona morta: mantém o centro até o bruto sair da zona (varredura sequencial em floats)
+    th_x = width * DEAD_ZONE_THRESHOLD_X
+    th_y = height * DEAD_ZONE_THRESHOLD_Y
+    mantido = np.empty_like(centros)
+    cx, cy = inicio
+    for i, (x, y) in enumerate(centros.tolist()):
+        if abs(x - cx) >= th_x or abs(y - cy) >= th_y:
+            cx, cy = x, y
+        mantido[i, 0] = cx
+        mantido[i, 1] = cy
+
+    # Média ponderada: causal (pesos crescentes, como _smooth_center) ou janela triangular centrada
+    k = max(1, CENTER_HISTORY_SIZE)
+    if zero_phase:
+        pesos = np.concatenate([np.arange(1, k + 1), np.arange(k - 1, 0, -1)]).astype(np.float64)
+        pad_ini, pad_fim = k - 1, k - 1
+    else:
+        pesos = np.arange(1, k + 1, dtype=np.float64)
+        pad_ini, pad_fim = k - 1, 0
+    pesos /= pesos.sum()
+    padded = np.pad(mantido, ((pad_ini, pad_fim), (0, 0)), mode="edge")
+    media = np.column_stack([
+        np.convolve(padded[:, c], pesos[::-1], mode="valid") for c in range(2)
+    ])
+
+    # Interpolação exponencial; zero_phase aplica também de trás para frente
+    suave = _ema(media, SMOOTH_ALPHA, inicio)
+    if zero_phase:
+        suave = _ema(suave[::-1], SMOOTH_ALPHA, suave[-1])[::-1]
+    return suave
+
+def _smooth_shots(raw, shots, width, height, zero_phase=False):
+    """
+    Suavização offline plano a plano: nenhum estado atravessa um corte de cena.
+    shots: lista de (inicio, fim, centro_fallback) em índices de frame (fim exclusivo).
+    """
+    raw = np.asarray(raw, dtype=np.float64).reshape(-1, 2)
+    partes = [_smooth_trajectory(raw[ini:fim], width, height, fallback, zero_phase=zero_phase, snap=(k > 0))
+              for k, (ini, fim, fallback) in enumerate(shots)]
+    return np.concatenate(partes) if partes else raw.copy()
+
+class _SceneCutDetector:
+    """
+    Detector barato de cortes de cena: compara o histograma HSV (matiz x saturação)
+    de uma miniatura de cada frame com o do frame anterior.
+    """
+
+    def __init__(self, threshold=SCENE_CUT_THRESHOLD, min_shot=SCENE_MIN_SHOT_FRAMES, start=0):
+        self.threshold = threshold
+        self.min_shot = min_shot
+        self._prev = None
+        self._inicio = start  # primeiro frame do plano atual
+
+    def is_cut(self, i, rgb):
+        """True se o frame i (RGB, qualquer resolução) abre um novo plano."""
+        if not self.threshold:
+            return False
+        thumb = cv2.resize(rgb, _SCENE_THUMB_SIZE, interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(thumb, cv2.COLOR_RGB2HSV)
+        hist = cv2.calcHist([hsv], [0, 1], None, [16, 8], [0, 180, 0, 256])
+        cv2.normalize(hist, hist)
+        prev, self._prev = self._prev, hist
+        if prev is None or i - self._inicio < self.min_shot:
+            return False
+        if cv2.compareHist(prev, hist, cv2.HISTCMP_BHATTACHARYYA) < self.threshold:
+            return False
+        self._inicio = i
+        return True
+
+class _FaceTracker:
+    """
+    Trilhas de rostos com id estável entre frames. Cada detecção é associada à
+    trilha de centro mais próximo (até TRACK_MATCH_RADIUS larguras de rosto), de
+    modo que a ordem em que o FaceMesh devolve os rostos não troca o falante.
+    A abertura da boca de cada trilha fica num ring buffer numpy pré-alocado
+    (capacity x ACTIVITY_HISTORY_SIZE); trilhas ausentes registram 0. A energia
+    do áudio de cada detecção fica num ring buffer paralelo, usado no desempate.
+    """
+
+    def __init__(self, capacity=8, history=ACTIVITY_HISTORY_SIZE, max_misses=TRACK_MAX_MISSES):
+        self.history = np.zeros((capacity, history), dtype=np.float32)
+        self.energy = np.zeros(history, dtype=np.float32)
+        self.centers = np.zeros((capacity, 2), dtype=np.float64)
+        self.ids = np.full(capacity, -1, dtype=np.int64)  # -1 = slot livre
+        self.misses = np.zeros(capacity, dtype=np.int64)
+        self.max_misses = max_misses
+        self._pos = 0
+        self._filled = 0
+        self._next_id = 0
+
+    def reset(self):
+        """Descarta todas as trilhas (corte de cena). Os ids continuam crescendo."""
+        self.history.fill(0.0)
+        self.energy.fill(0.0)
+        self.ids.fill(-1)
+        self.misses.fill(0)
+        self._pos = 0
+        self._filled = 0
+
+    def update(self, centers, sizes, openings, energy=0.0):
+        """
+        Registra uma detecção: centers (N, 2), sizes (N,) larguras dos rostos,
+        openings (N,) aberturas da boca e energy, a energia do áudio no frame.
+        Retorna o slot da trilha de cada rosto.
+        """
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        n = len(centers)
+        slots = np.full(n, -1, dtype=np.int64)
+        ativos = np.flatnonzero(self.ids >= 0)
+        if n and len(ativos):
+            dist = np.linalg.norm(centers[:, None, :] - self.centers[ativos][None, :, :], axis=2)
+            dist[dist > np.asarray(sizes, dtype=np.float64)[:, None] * TRACK_MATCH_RADIUS] = np.inf
+            # Associação gulosa: pares mais próximos primeiro
+            usados = set()
+            for flat in np.argsort(dist, axis=None):
+                f, t = divmod(int(flat), len(ativos))
+                if not np.isfinite(dist[f, t]):
+                    break
+                if slots[f] < 0 and t not in usados:
+                    slots[f] = ativos[t]
+                    usados.add(t)
+
+        # Rostos sem par abrem trilha nova num slot livre (ou no mais tempo sem ser visto)
+        for f in np.flatnonzero(slots < 0):
+            livres = np.flatnonzero(self.ids < 0)
+            if len(livres):
+                slot = livres[0]
+            else:
+                misses = self.misses.copy()
+                misses[slots[slots >= 0]] = -1
+                slot = int(np.argmax(misses))
+            self.ids[slot] = self._next_id
+            self._next_id += 1
+            self.history[slot].fill(0.0)
+            slots[f] = slot
+
+        self.history[:, self._pos] = 0.0
+        self.history[slots, self._pos] = openings
+        self.energy[self._pos] = energy
+        self._pos = (self._pos + 1) % self.history.shape[1]
+        self._filled = min(self._filled + 1, self.history.shape[1])
+        self.centers[slots] = centers
+        self.misses += 1
+        self.misses[slots] = 0
+        self.ids[self.misses > self.max_misses] = -1
+        return slots
+
+    def activity(self, slots):
+        """Abertura média da boca no histórico das trilhas em slots."""
+        return self.history[slots].sum(axis=1) / max(1, self._filled)
+
+    def speaker(self, slots, tie_margin=SPEECH_TIE_MARGIN):
+        """
+        Índice (em slots) do falante: maior abertura média da boca. Atividades a
+        menos de tie_margin da maior empatam e o desempate é a abertura ponderada
+        pela energia do áudio nas mesmas detecções (quem mexe a boca quando há som).
+        """
+        atividade = self.activity(slots)
+        idx = int(np.argmax(atividade))
+        if len(slots) > 1 and atividade[idx] > 0 and self.energy.any():
+            empate = atividade >= atividade[idx] * (1.0 - tie_margin)
+            if empate.sum() > 1:
+                fala = self.history[slots] @ self.energy
+                fala[~empate] = -1.0
+                idx = int(np.argmax(fala))
+        return idx
+
 def _adjust_bbox_for_head(x, y, w, h, height_frame):
     """
     Ajusta bounding box para focar apenas na cabeça, removendo área de ombros/mãos.
@@ -103,57 +459,172 @@ def _adjust_bbox_for_head(x, y, w, h, height_frame):
     
     return (x_head, y_head, w_head, h_head, centro_x, centro_y)
 
-def _detect_faces_haar(frame_gray, cascade_frontal, cascade_profile, height_frame):
+def _detect_faces_haar(frame_gray, cascade_frontal, cascade_profile, height_frame, scale=1.0,
+                       roi=None, scale_factor=1.1):
     """
     Detecta rostos usando Haar Cascades como fallback.
+    frame_gray pode estar na resolução de análise: scale é a razão análise/original
+    e as caixas são convertidas de volta para pixels da resolução original.
+    roi: (x0, y0, x1, y1) em pixels de frame_gray; limita a busca a essa janela.
+    O cascade de perfil só reconhece um lado: roda também na imagem espelhada.
+    Caixas repetidas (frontal e perfil no mesmo rosto) contam uma vez só.
     Retorna lista de tuplas (centro_x, centro_y, largura_cabeça, altura_cabeça, x_original, y_original, w_original, h_original).
     """
     faces = []
+    min_size = max(12, int(round(HAAR_MIN_SIZE * scale)))
+    off_x, off_y = 0, 0
+    if roi is not None:
+        x0, y0, x1, y1 = roi
+        frame_gray = frame_gray[y0:y1, x0:x1]
+        off_x, off_y = x0, y0
+    largura = frame_gray.shape[1]
     
-    # Detecta rostos frontais
-    frontal_faces = cascade_frontal.detectMultiScale(
-        frame_gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30)
-    )
-    for (x, y, w, h) in frontal_faces:
-        x_head, y_head, w_head, h_head, centro_x, centro_y = _adjust_bbox_for_head(x, y, w, h, height_frame)
-        faces.append((centro_x, centro_y, w_head, h_head, x, y, w, h))
+    def to_source(x, y, w, h):
+        x, y = x + off_x, y + off_y
+        if scale == 1.0:
+            return int(x), int(y), int(w), int(h)
+        return int(x / scale), int(y / scale), int(w / scale), int(h / scale)
     
-    # Detecta rostos de perfil
-    profile_faces = cascade_profile.detectMultiScale(
-        frame_gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30)
-    )
-    for (x, y, w, h) in profile_faces:
+    params = dict(scaleFactor=scale_factor, minNeighbors=5, minSize=(min_size, min_size))
+    # Rostos frontais, de perfil e de perfil espelhado (caixa volta para a imagem original)
+    caixas = list(cascade_frontal.detectMultiScale(frame_gray, **params))
+    caixas += list(cascade_profile.detectMultiScale(frame_gray, **params))
+    caixas += [(largura - x - w, y, w, h)
+               for x, y, w, h in cascade_profile.detectMultiScale(cv2.flip(frame_gray, 1), **params)]
+
+    aceitas = []
+    for box in caixas:
+        x, y, w, h = box
+        cx, cy = x + w / 2.0, y + h / 2.0
+        if any(ax <= cx <= ax + aw and ay <= cy <= ay + ah for ax, ay, aw, ah in aceitas):
+            continue
+        aceitas.append((x, y, w, h))
+        x, y, w, h = to_source(x, y, w, h)
         x_head, y_head, w_head, h_head, centro_x, centro_y = _adjust_bbox_for_head(x, y, w, h, height_frame)
         faces.append((centro_x, centro_y, w_head, h_head, x, y, w, h))
     
     return faces
 
-def _has_audio(video_path: str) -> bool:
+def _haar_search(frame_gray, cascade_frontal, cascade_profile, height_frame, scale=1.0, centro_ref=None):
     """
-    Verifica se o vídeo possui stream de áudio usando ffprobe.
-    Retorna True se houver pelo menos um stream de áudio, False caso contrário.
+    Fallback Haar barato: reduz a imagem para HAAR_LONG_EDGE, usa a pirâmide
+    HAAR_SCALE_FACTOR e, com centro_ref (pixels originais), busca só na janela
+    HAAR_ROI_SIZE em torno dele. centro_ref=None varre o frame inteiro.
+    """
+    h, w = frame_gray.shape[:2]
+    fator = min(1.0, HAAR_LONG_EDGE / float(max(h, w))) if HAAR_LONG_EDGE else 1.0
+    if fator < 1.0:
+        frame_gray = cv2.resize(frame_gray, (max(1, int(round(w * fator))), max(1, int(round(h * fator)))),
+                                interpolation=cv2.INTER_AREA)
+        h, w = frame_gray.shape[:2]
+    scale = scale * fator
+    roi = None
+    if centro_ref is not None:
+        cx, cy = centro_ref[0] * scale, centro_ref[1] * scale
+        meia_w, meia_h = w * HAAR_ROI_SIZE[0] / 2.0, h * HAAR_ROI_SIZE[1] / 2.0
+        roi = (int(max(0, cx - meia_w)), int(max(0, cy - meia_h)),
+               int(min(w, cx + meia_w)), int(min(h, cy + meia_h)))
+    return _detect_faces_haar(frame_gray, cascade_frontal, cascade_profile, height_frame, scale,
+                              roi=roi, scale_factor=HAAR_SCALE_FACTOR)
+
+class DetectorBundle:
+    """
+    FaceMesh + Haar Cascades de um worker: criados (e aquecidos) uma vez e
+    reaproveitados entre jobs. reset() zera o rastreamento do FaceMesh entre
+    vídeos; close() libera o grafo do MediaPipe.
+    Não é thread-safe: um bundle por thread/processo de worker.
+    """
+
+    def __init__(self, warm_up=True):
+        self.face_mesh = mp_face_mesh.FaceMesh(
+            static_image_mode=False, max_num_faces=4, refine_landmarks=True,
+            min_detection_confidence=0.5, min_tracking_confidence=0.5
+        )
+        # Haar Cascades para fallback de detecção de rostos de perfil
+        cascade_path = cv2.data.haarcascades
+        self.cascade_frontal = cv2.CascadeClassifier(
+            os.path.join(cascade_path, 'haarcascade_frontalface_default.xml')
+        )
+        self.cascade_profile = cv2.CascadeClassifier(
+            os.path.join(cascade_path, 'haarcascade_profileface.xml')
+        )
+        if warm_up:
+            self.warm_up()
+
+    def warm_up(self):
+        """Passa um frame vazio pelos detectores: inicializa o grafo antes do primeiro job."""
+        rgb = np.zeros((360, 640, 3), dtype=np.uint8)
+        self.face_mesh.process(rgb)
+        _detect_faces_haar(rgb[:, :, 0], self.cascade_frontal, self.cascade_profile, rgb.shape[0])
+        self.reset()
+
+    def reset(self):
+        """Descarta o estado de rastreamento do vídeo anterior."""
+        self.face_mesh.reset()
+
+    def close(self):
+        """Libera o grafo do MediaPipe."""
+        self.face_mesh.close()
+
+# Cache do ffprobe: um probe por arquivo, invalidado quando tamanho ou mtime mudam
+_PROBE_CACHE_SIZE = 64
+_probe_cache = OrderedDict()
+_probe_lock = threading.Lock()
+
+def _probe(video_path: str) -> dict:
+    """
+    Uma única chamada ao ffprobe (-show_format -show_streams, JSON) por arquivo,
+    memoizada por (caminho, tamanho, mtime). Caminhos que não são arquivos locais
+    (URLs) não entram no cache. Retorna {} se o ffprobe falhar.
     """
+    try:
+        st = os.stat(video_path)
+        key = (os.path.abspath(video_path), st.st_size, st.st_mtime_ns)
+    except (OSError, TypeError, ValueError):
+        key = None
+    if key is not None:
+        with _probe_lock:
+            if key in _probe_cache:
+                _probe_cache.move_to_end(key)
+                return _probe_cache[key]
+
     try:
         result = subprocess.run(
             [
-                "ffprobe", "-v", "error", "-select_streams", "a",
-                "-show_entries", "stream=index", "-of", "csv=p=0",
-                video_path
+                "ffprobe", "-v", "error", "-show_format", "-show_streams",
+                "-of", "json", video_path
             ],
             stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
             text=True,
             check=False,
             timeout=10
         )
-        return bool(result.stdout.strip())
+        if result.returncode != 0:
+            return {}
+        data = json.loads(result.stdout)
     except Exception:
-        return False
+        return {}
+
+    if key is not None:
+        with _probe_lock:
+            _probe_cache[key] = data
+            while len(_probe_cache) > _PROBE_CACHE_SIZE:
+                _probe_cache.popitem(last=False)
+    return data
+
+def _has_audio(video_path: str) -> bool:
+    """
+    Verifica se o vídeo possui stream de áudio (probe em cache).
+    Retorna True se houver pelo menos um stream de áudio, False caso contrário.
+    """
+    return any(st.get("codec_type") == "audio" for st in _probe(video_path).get("streams", []))
 
 def _get_video_metadata(video_path: str) -> dict:
     """
-    Extrai metadados completos do vídeo usando ffprobe.
+    Extrai metadados completos do vídeo a partir do probe em cache (_probe).
     Retorna dict com informações de codec, duração, streams, etc.
+    frame_count vem do container (nb_frames) ou, sem ele, de duração x fps.
     """
     metadata = {
         "has_audio": False,
@@ -166,111 +637,104 @@ def _get_video_metadata(video_path: str) -> dict:
         "width": None,
         "height": None,
         "fps": None,
+        "frame_count": None,
         "audio_sample_rate": None,
         "audio_channels": None,
         "streams_count": 0
     }
     
     try:
-        # Obtém informações gerais do formato
-        format_result = subprocess.run(
-            [
-                "ffprobe", "-v", "error", "-show_format",
-                "-of", "json", video_path
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=False,
-            timeout=10
-        )
+        probe = _probe(video_path)
+        if "format" in probe:
+            duration_str = probe["format"].get("duration")
+            if duration_str:
+                try:
+                    metadata["duration"] = float(duration_str)
+                except (ValueError, TypeError):
+                    pass
         
-        if format_result.returncode == 0:
-            format_data = json.loads(format_result.stdout)
-            if "format" in format_data:
-                duration_str = format_data["format"].get("duration")
-                if duration_str:
-                    try:
-                        metadata["duration"] = float(duration_str)
-                    except (ValueError, TypeError):
-                        pass
-        
-        # Obtém informações dos streams
-        streams_result = subprocess.run(
-            [
-                "ffprobe", "-v", "error", "-show_streams",
-                "-of", "json", video_path
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=False,
-            timeout=10
-        )
-        
-        if streams_result.returncode == 0:
-            streams_data = json.loads(streams_result.stdout)
-            if "streams" in streams_data:
-                streams = streams_data["streams"]
-                metadata["streams_count"] = len(streams)
+        if "streams" in probe:
+            streams = probe["streams"]
+            metadata["streams_count"] = len(streams)
+            
+            for stream in streams:
+                codec_type = stream.get("codec_type", "")
                 
-                for stream in streams:
-                    codec_type = stream.get("codec_type", "")
+                if codec_type == "video":
+                    metadata["has_video"] = True
+                    metadata["video_codec"] = stream.get("codec_name")
+                    metadata["width"] = stream.get("width")
+                    metadata["height"] = stream.get("height")
                     
-                    if codec_type == "video":
-                        metadata["has_video"] = True
-                        metadata["video_codec"] = stream.get("codec_name")
-                        metadata["width"] = stream.get("width")
-                        metadata["height"] = stream.get("height")
-                        
-                        # FPS pode estar em r_frame_rate ou avg_frame_rate
-                        fps_str = stream.get("r_frame_rate") or stream.get("avg_frame_rate", "")
-                        if fps_str and "/" in fps_str:
-                            try:
-                                num, den = map(int, fps_str.split("/"))
-                                if den > 0:
-                                    metadata["fps"] = num / den
-                            except (ValueError, ZeroDivisionError):
-                                pass
-                        
-                        bitrate = stream.get("bit_rate")
-                        if bitrate:
-                            try:
-                                metadata["video_bitrate"] = int(bitrate)
-                            except (ValueError, TypeError):
-                                pass
+                    # FPS pode estar em r_frame_rate ou avg_frame_rate
+                    fps_str = stream.get("r_frame_rate") or stream.get("avg_frame_rate", "")
+                    if fps_str and "/" in fps_str:
+                        try:
+                            num, den = map(int, fps_str.split("/"))
+                            if den > 0:
+                                metadata["fps"] = num / den
+                        except (ValueError, ZeroDivisionError):
+                            pass
                     
-                    elif codec_type == "audio":
-                        metadata["has_audio"] = True
-                        metadata["audio_codec"] = stream.get("codec_name")
-                        
-                        sample_rate = stream.get("sample_rate")
-                        if sample_rate:
-                            try:
-                                metadata["audio_sample_rate"] = int(sample_rate)
-                            except (ValueError, TypeError):
-                                pass
-                        
-                        channels = stream.get("channels")
-                        if channels:
-                            try:
-                                metadata["audio_channels"] = int(channels)
-                            except (ValueError, TypeError):
-                                pass
-                        
-                        bitrate = stream.get("bit_rate")
-                        if bitrate:
-                            try:
-                                metadata["audio_bitrate"] = int(bitrate)
-                            except (ValueError, TypeError):
-                                pass
-    
+                    bitrate = stream.get("bit_rate")
+                    if bitrate:
+                        try:
+                            metadata["video_bitrate"] = int(bitrate)
+                        except (ValueError, TypeError):
+                            pass
+                    
+                    nb_frames = stream.get("nb_frames")
+                    if nb_frames:
+                        try:
+                            metadata["frame_count"] = int(nb_frames)
+                        except (ValueError, TypeError):
+                            pass
+                
+                elif codec_type == "audio":
+                    metadata["has_audio"] = True
+                    metadata["audio_codec"] = stream.get("codec_name")
+                    
+                    sample_rate = stream.get("sample_rate")
+                    if sample_rate:
+                        try:
+                            metadata["audio_sample_rate"] = int(sample_rate)
+                        except (ValueError, TypeError):
+                            pass
+                    
+                    channels = stream.get("channels")
+                    if channels:
+                        try:
+                            metadata["audio_channels"] = int(channels)
+                        except (ValueError, TypeError):
+                            pass
+                    
+                    bitrate = stream.get("bit_rate")
+                    if bitrate:
+                        try:
+                            metadata["audio_bitrate"] = int(bitrate)
+                        except (ValueError, TypeError):
+                            pass
+
+        # Sem nb_frames no container (ex.: mkv/webm), estima pela duração
+        if not metadata["frame_count"] and metadata["duration"] and metadata["fps"]:
+            metadata["frame_count"] = int(round(metadata["duration"] * metadata["fps"]))
+
     except Exception:
         # Em caso de erro, retorna metadata parcial
         pass
     
     return metadata
 
+def _wait_for_download(path, poll_interval=0.5):
+    """
+    Modo streaming: espera o download de path terminar. Quem baixa grava em
+    path + ".part" e renomeia ao final; sem nenhum dos dois, o download falhou.
+    """
+    while not os.path.exists(path):
+        if not os.path.exists(path + ".part"):
+            raise RuntimeError(f"Download do input não foi concluído: {path}")
+        time.sleep(poll_interval)
+
 def _mux_audio(video_temp: str, source_with_audio: str, output_final: str) -> dict:
     """
     Faz mux de vídeo e áudio. Se o source não tiver áudio, gera áudio silencioso.
@@ -324,57 +788,343 @@ def _mux_audio(video_temp: str, source_with_audio: str, output_final: str) -> di
     
     return mux_info
 
-def _draw_debug_overlays(frame, results, haar_faces, centro_atual, centro_detectado, width, height, debug_info=None):
+def _audio_args(input_metadata: dict, source_index: int, silent_index: int):
+    """
+    Monta os argumentos de áudio do ffmpeg para a saída final.
+    Usa o áudio do source (input source_index) copiando o stream quando o codec
+    cabe em MP4; sem áudio no source, gera silêncio (lavfi) como input silent_index.
+    O silêncio é limitado pela duração do source; -shortest só entra como último
+    recurso (duração desconhecida), pois com filtros/encoder com atraso ele corta
+    os últimos frames de vídeo.
+    Retorna (inputs_extras, args_de_saida, mux_info).
+    """
+    mux_info = {
+        "has_source_audio": bool(input_metadata.get("has_audio")),
+        "audio_source": None,
+        "error": None
+    }
+    if mux_info["has_source_audio"]:
+        mux_info["audio_source"] = "original"
+        codec = "copy" if input_metadata.get("audio_codec") in MP4_AUDIO_COPY_CODECS else "aac"
+        return [], ["-map", f"{source_index}:a:0", "-c:a", codec], mux_info
+
+    # Gera áudio silencioso quando não há áudio no source (mesmo comportamento do mux)
+    mux_info["audio_source"] = "generated_silent"
+    duration = input_metadata.get("duration")
+    limit = ["-t", f"{duration:.3f}"] if duration else []
+    inputs = limit + ["-f", "lavfi", "-i", "anullsrc=channel_layout=stereo:sample_rate=44100"]
+    out_args = ["-map", f"{silent_index}:a:0", "-c:a", "aac"]
+    return inputs, out_args + ([] if limit else ["-shortest"]), mux_info
+
+def _speech_envelope(input_path: str, fps: float, start: int, end: int):
+    """
+    Energia RMS (0..1) do áudio em cada frame de [start, end), decodificada pelo ffmpeg
+    (mono, SPEECH_SAMPLE_RATE) e lida do pipe em blocos: o áudio nunca fica inteiro
+    em memória, só o envelope. Frames sem áudio ficam com 0.
+    Retorna None se o ffmpeg falhar.
+    """
+    n = max(0, end - start)
+    envelope = np.zeros(n, dtype=np.float32)
+    # Limites de cada frame em amostras (relativos a start)
+    limites = np.round(np.arange(n + 1) * (SPEECH_SAMPLE_RATE / float(fps))).astype(np.int64)
+    cmd = ["ffmpeg", "-v", "error"]
+    if start > 0:
+        cmd += ["-ss", f"{start / float(fps):.6f}"]
+    cmd += ["-t", f"{n / float(fps):.6f}", "-i", input_path, "-vn", "-ac", "1",
+            "-ar", str(SPEECH_SAMPLE_RATE), "-f", "s16le", "-"]
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+
+    pos = 0  # amostra (relativa) do início de resto
+    k = 0  # próximo frame a fechar
+    resto = np.zeros(0, dtype=np.float32)
+    try:
+        while k < n:
+            dados = proc.stdout.read(_SPEECH_CHUNK_SAMPLES * 2)
+            if dados:
+                amostras = np.frombuffer(dados[:len(dados) // 2 * 2], dtype="<i2").astype(np.float32) / 32768.0
+                resto = np.concatenate((resto, amostras * amostras))
+            # Frames completos dentro do que já foi lido (no fim do stream, fecha o parcial)
+            fim = n if not dados else int(np.searchsorted(limites, pos + len(resto), side="right")) - 1
+            if fim > k:
+                ini = limites[k:fim] - pos
+                corte = min(len(resto), limites[fim] - pos)
+                validos = ini < corte
+                if validos.any():
+                    somas = np.add.reduceat(resto[:corte], ini[validos])
+                    tamanhos = np.diff(np.append(ini[validos], corte))
+                    envelope[k:fim][validos] = np.sqrt(somas / np.maximum(tamanhos, 1))
+                resto = resto[corte:]
+                pos += corte
+                k = fim
+            if not dados:
+                break
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    if proc.returncode != 0:
+        return None
+    return envelope
+
+def _silence_mask(envelope, fps):
+    """
+    Frames em silêncio longo: RMS abaixo de SPEECH_ENERGY_DB por pelo menos
+    SILENCE_MIN_SECONDS seguidos. Retorna (silencio, proxima_fala), onde
+    proxima_fala[i] é o primeiro frame >= i fora do silêncio (len se não houver).
+    """
+    n = len(envelope)
+    limiar = 10.0 ** (SPEECH_ENERGY_DB / 20.0)
+    silencio = envelope < limiar
+    # Descarta trechos silenciosos curtos (pausas entre frases)
+    bordas = np.flatnonzero(np.diff(np.concatenate(([0], silencio.astype(np.int8), [0]))))
+    for ini, fim in zip(bordas[::2], bordas[1::2]):
+        if fim - ini < SILENCE_MIN_SECONDS * fps:
+            silencio[ini:fim] = False
+    idx = np.where(silencio, n, np.arange(n))
+    proxima_fala = np.minimum.accumulate(idx[::-1])[::-1] if n else idx
+    return silencio, proxima_fala
+
+class _FFmpegWriter:
+    """
+    Writer que envia os frames cortados (BGR cru) para um único processo ffmpeg
+    de longa duração: encode libx264 + áudio lido direto do source.
+    Substitui VideoWriter mp4v + arquivo temporário + segundo passe de mux.
+    Mesma interface do cv2.VideoWriter (write/release).
+    """
+
+    def __init__(self, output_path, fps, size, input_path, input_metadata,
+                 preset=ENCODER_PRESET, crf=ENCODER_CRF, out_size=None, with_audio=True):
+        w, h = size
+        audio_inputs, audio_out, self.mux_info = _audio_args(input_metadata, source_index=1, silent_index=1)
+        if not with_audio:
+            # Trecho do modo segmentado: só vídeo, o áudio entra na concatenação final
+            audio_inputs, audio_out = [], []
+        cmd = ["ffmpeg", "-y", "-v", "error", "-nostats",
+               "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{w}x{h}", "-r", str(fps), "-i", "pipe:0"]
+        if with_audio and self.mux_info["has_source_audio"]:
+            if input_metadata.get("duration"):
+                cmd += ["-t", f"{input_metadata['duration']:.3f}"]
+            cmd += ["-i", input_path]
+        cmd += audio_inputs
+        if out_size:
+            cmd += ["-vf", f"scale={out_size[0]}:{out_size[1]}"]
+        cmd += ["-map", "0:v:0"] + audio_out + [
+            "-c:v", "libx264", "-preset", str(preset), "-crf", str(crf), "-pix_fmt", "yuv420p",
+            "-movflags", "+faststart", output_path
+        ]
+        self._stderr = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr)
+
+    def _error(self, prefix):
+        self._stderr.seek(0)
+        msg = f"{prefix} - {self._stderr.read().decode('utf-8', errors='ignore')[:200]}"
+        self.mux_info["error"] = msg
+        return RuntimeError(msg)
+
+    def write(self, frame):
+        try:
+            self._proc.stdin.write(np.ascontiguousarray(frame).tobytes())
+        except (BrokenPipeError, OSError) as e:
+            raise self._error(f"Erro no encode ffmpeg: {e}") from e
+
+    def release(self):
+        try:
+            self._proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self._proc.wait()
+        try:
+            if self._proc.returncode != 0:
+                raise self._error(f"Erro no encode ffmpeg: código {self._proc.returncode}")
+        finally:
+            self._stderr.close()
+
+    def abort(self):
+        """Encerra o ffmpeg sem finalizar o arquivo (usado quando o processamento falha)."""
+        self._proc.kill()
+        self._proc.wait()
+        self._stderr.close()
+
+def _abort_writer(writer):
+    """Interrompe um writer após erro, sem propagar exceções secundárias."""
+    try:
+        if hasattr(writer, "abort"):
+            writer.abort()
+        else:
+            writer.release()
+    except Exception:
+        pass
+
+def _discard_outputs(targets):
+    """Remove o que o reframe já gravou de cada formato (vídeo temporário e saída final) após uma falha."""
+    for t in targets:
+        for path in (t["tmp_video"], t["path"]):
+            if path:
+                try: os.remove(path)
+                except OSError: pass
+
+def _write_crop_commands(trajectory, fps, cmd_path):
+    """
+    Escreve a trajetória de corte como script do filtro sendcmd do ffmpeg.
+    Só emite comando quando x1/y1 mudam (a trajetória é suavizada, muitos frames repetem).
+    """
+    with open(cmd_path, "w") as f:
+        last = None
+        for i, (x1, y1) in enumerate(trajectory):
+            if (x1, y1) == last:
+                continue
+            f.write(f"{i / fps:.6f} crop x {x1}, crop y {y1};\n")
+            last = (x1, y1)
+
+def _render_ffmpeg(input_path: str, targets, fps: float, input_metadata: dict, progress_cb=None,
+                   preset=ENCODER_PRESET, crf=ENCODER_CRF) -> dict:
+    """
+    Passo 2 do modo analyze-then-render: entrega a trajetória ao ffmpeg como
+    stream de comandos temporizados (sendcmd + crop). Decode, corte, encode e
+    áudio acontecem num único processo nativo, sem passar frames pelo Python.
+    targets: saídas (path, trajectory, crop_w, crop_h, size); todas saem do mesmo
+    decode via split, cada uma com sua própria janela de corte.
+    Retorna dict no mesmo formato do _mux_audio.
+    """
+    if not targets or not targets[0]["trajectory"]:
+        raise RuntimeError("Trajetória de corte vazia: nenhum frame analisado")
+
+    cmd_files = []
+    try:
+        # Timestamps reescritos pelo índice do frame: o comando do frame i cai exatamente em i/fps
+        n = len(targets)
+        graph = [f"[0:v:0]setpts=N/({fps}*TB),split={n}" + "".join(f"[s{k}]" for k in range(n))]
+        for k, t in enumerate(targets):
+            cmd_file = tempfile.NamedTemporaryFile(suffix=".cmd", delete=False).name
+            cmd_files.append(cmd_file)
+            _write_crop_commands(t["trajectory"], fps, cmd_file)
+            x0, y0 = t["trajectory"][0]
+            chain = (f"[s{k}]sendcmd=f='{cmd_file}',"
+                     f"crop=w={t['crop_w']}:h={t['crop_h']}:x={x0}:y={y0}:exact=1")
+            if t["size"]:
+                chain += f",scale={t['size'][0]}:{t['size'][1]}"
+            graph.append(chain + f"[v{k}]")
+
+        audio_inputs, audio_out, mux_info = _audio_args(input_metadata, source_index=0, silent_index=1)
+        cmd = ["ffmpeg", "-y", "-v", "error", "-nostats", "-progress", "pipe:1",
+               "-i", input_path] + audio_inputs + ["-filter_complex", ";".join(graph)]
+        # Duração exata da trajetória: o áudio acompanha o vídeo sem cortar frames
+        total = len(targets[0]["trajectory"])
+        for k, t in enumerate(targets):
+            cmd += ["-map", f"[v{k}]"] + audio_out + [
+                "-r", str(fps), "-t", f"{total / float(fps):.6f}",
+                "-c:v", "libx264", "-preset", str(preset), "-crf", str(crf),
+                "-pix_fmt", "yuv420p", "-movflags", "+faststart", t["path"]
+            ]
+
+        with tempfile.TemporaryFile() as stderr_file:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file, text=True)
+            for line in proc.stdout:
+                if progress_cb and line.startswith("frame="):
+                    try:
+                        progress_cb(int(line.split("=", 1)[1]) / float(total))
+                    except ValueError:
+                        pass
+            proc.wait()
+            if proc.returncode != 0:
+                stderr_file.seek(0)
+                error_msg = (f"Erro na renderização ffmpeg: código {proc.returncode} - "
+                             f"{stderr_file.read().decode('utf-8', errors='ignore')[:200]}")
+                mux_info["error"] = error_msg
+                raise RuntimeError(error_msg)
+    finally:
+        for cmd_file in cmd_files:
+            try: os.remove(cmd_file)
+            except: pass
+
+    return mux_info
+
+# Cache de análise: detecções brutas por conteúdo do vídeo + parâmetros de detecção
+ANALYSIS_CACHE_MAX_FILES = 200
+_ANALYSIS_FORMAT = 1  # muda quando o conteúdo do arquivo ou a lógica de detecção mudam
+_ANALYSIS_COUNTERS = ("faces_detected_sum", "frames_detected", "haar_full_searches", "haar_roi_searches",
+                      "silent_frames")
+
+# Log de trajetória: métodos de detecção por frame e layout das linhas de rosto
+_LOG_METHODS = ("Interpolated", "MediaPipe", "Haar", "Fallback")
+_LOG_INTERPOLATED, _LOG_MEDIAPIPE, _LOG_HAAR, _LOG_FALLBACK = range(4)
+# Linha de rosto (float32): frame, tipo (0 MediaPipe, 1 Haar), trilha (-1 sem trilha),
+# caixa x0, y0, x1, y1 e quatro pontos: olhos e lábios (MediaPipe) ou
+# canto superior/inferior da cabeça e centro da cabeça (Haar; quarto ponto NaN)
+_FACE_ROW_SIZE = 15
+_NO_FACES = np.zeros((0, _FACE_ROW_SIZE), dtype=np.float32)
+
+def _face_rows(i, faces_pts, haar_faces, track_ids=None):
+    """Converte os rostos de uma detecção para linhas compactas do log (N, _FACE_ROW_SIZE)."""
+    rows = np.full((len(faces_pts) + len(haar_faces), _FACE_ROW_SIZE), np.nan, dtype=np.float32)
+    rows[:, 0] = i
+    rows[:, 2] = -1
+    for k, pts in enumerate(faces_pts):
+        rows[k, 1] = 0
+        if track_ids is not None:
+            rows[k, 2] = track_ids[k]
+        rows[k, 3:7] = (pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(), pts[:, 1].max())
+        rows[k, 7:9] = pts[_PT_LEFT_EYE]
+        rows[k, 9:11] = pts[_PT_RIGHT_EYE]
+        rows[k, 11:13] = pts[_PT_TOP_LIP].mean(axis=0)
+        rows[k, 13:15] = pts[_PT_BOTTOM_LIP].mean(axis=0)
+    for k, (cx, cy, w_head, h_head, x_orig, y_orig, w_orig, h_orig) in enumerate(haar_faces, len(faces_pts)):
+        rows[k, 1] = 1
+        rows[k, 3:7] = (x_orig, y_orig, x_orig + w_orig, y_orig + h_orig)
+        x_head, y_head = int(cx - w_head/2), int(cy - h_head/2)
+        rows[k, 7:13] = (x_head, y_head, x_head + w_head, y_head + h_head, cx, cy)
+    return rows
+
+def _draw_debug_overlays(frame, faces, centro_atual, centro_detectado, debug_info=None, crop=None, scale=1.0):
     """
     Desenha overlays de debug no frame: bounding boxes, centros, landmarks.
+    faces: linhas de _face_rows do frame (vazio em frames interpolados).
+    crop: (x1, y1, crop_w, crop_h) da janela de corte, se conhecida.
+    scale: frame já reduzido por esse fator (coordenadas estão na resolução original).
     """
     frame_debug = frame.copy()
-    
-    # Desenha bounding boxes do MediaPipe
-    if results.multi_face_landmarks:
-        for landmarks in results.multi_face_landmarks:
-            pts = np.array([(lm.x * width, lm.y * height) for lm in landmarks.landmark])
+
+    def pt(x, y):
+        return int(x * scale), int(y * scale)
+
+    for row in faces:
+        x0, y0, x1, y1 = row[3:7]
+        if row[1] == 0:
             # Bounding box do MediaPipe
-            x_min, y_min = int(pts[:, 0].min()), int(pts[:, 1].min())
-            x_max, y_max = int(pts[:, 0].max()), int(pts[:, 1].max())
-            cv2.rectangle(frame_debug, (x_min, y_min), (x_max, y_max), (0, 255, 0), 2)
-            
-            # Desenha alguns landmarks importantes
+            cv2.rectangle(frame_debug, pt(x0, y0), pt(x1, y1), (0, 255, 0), 2)
+            if row[2] >= 0:
+                cv2.putText(frame_debug, f"#{int(row[2])}", pt(x0, y0 - 5),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
             # Olhos
-            left_eye = pts[33]
-            right_eye = pts[263]
-            cv2.circle(frame_debug, (int(left_eye[0]), int(left_eye[1])), 3, (255, 0, 0), -1)
-            cv2.circle(frame_debug, (int(right_eye[0]), int(right_eye[1])), 3, (255, 0, 0), -1)
-            
+            cv2.circle(frame_debug, pt(*row[7:9]), 3, (255, 0, 0), -1)
+            cv2.circle(frame_debug, pt(*row[9:11]), 3, (255, 0, 0), -1)
             # Boca (pontos usados para detecção de fala)
-            top_lip = np.mean(pts[[13, 14, 15, 16, 17]], axis=0)
-            bottom_lip = np.mean(pts[[308,312,317,402,318]], axis=0)
-            cv2.circle(frame_debug, (int(top_lip[0]), int(top_lip[1])), 3, (0, 0, 255), -1)
-            cv2.circle(frame_debug, (int(bottom_lip[0]), int(bottom_lip[1])), 3, (0, 0, 255), -1)
-    
-    # Desenha bounding boxes do Haar Cascade
-    for face_info in haar_faces:
-        cx, cy, w_head, h_head, x_orig, y_orig, w_orig, h_orig = face_info
-        # Bounding box original (verde claro)
-        cv2.rectangle(frame_debug, (x_orig, y_orig), (x_orig + w_orig, y_orig + h_orig), (0, 255, 255), 2)
-        # Bounding box ajustado para cabeça (azul)
-        x_head = int(cx - w_head/2)
-        y_head = int(cy - h_head/2)
-        cv2.rectangle(frame_debug, (x_head, y_head), (x_head + w_head, y_head + h_head), (255, 0, 255), 2)
-        # Centro da cabeça
-        cv2.circle(frame_debug, (int(cx), int(cy)), 5, (255, 0, 255), -1)
+            cv2.circle(frame_debug, pt(*row[11:13]), 3, (0, 0, 255), -1)
+            cv2.circle(frame_debug, pt(*row[13:15]), 3, (0, 0, 255), -1)
+        else:
+            # Bounding box original do Haar (verde claro) e ajustado para cabeça (azul)
+            cv2.rectangle(frame_debug, pt(x0, y0), pt(x1, y1), (0, 255, 255), 2)
+            cv2.rectangle(frame_debug, pt(*row[7:9]), pt(*row[9:11]), (255, 0, 255), 2)
+            # Centro da cabeça
+            cv2.circle(frame_debug, pt(*row[11:13]), 5, (255, 0, 255), -1)
+
+    # Janela de corte
+    if crop is not None:
+        x1, y1, crop_w, crop_h = crop
+        cv2.rectangle(frame_debug, pt(x1, y1), pt(x1 + crop_w, y1 + crop_h), (255, 255, 255), 1)
     
     # Desenha centro atual (usado para corte)
     if centro_atual is not None:
-        centro_atual_tuple = tuple(centro_atual) if isinstance(centro_atual, np.ndarray) else centro_atual
-        cv2.circle(frame_debug, (int(centro_atual_tuple[0]), int(centro_atual_tuple[1])), 8, (0, 255, 255), 2)
-        cv2.putText(frame_debug, "CENTER", (int(centro_atual_tuple[0]) + 10, int(centro_atual_tuple[1])), 
+        cx, cy = pt(centro_atual[0], centro_atual[1])
+        cv2.circle(frame_debug, (cx, cy), 8, (0, 255, 255), 2)
+        cv2.putText(frame_debug, "CENTER", (cx + 10, cy), 
                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
     
     # Desenha centro detectado (antes da suavização)
-    if centro_detectado is not None:
-        centro_detectado_tuple = tuple(centro_detectado) if isinstance(centro_detectado, np.ndarray) else centro_detectado
-        cv2.circle(frame_debug, (int(centro_detectado_tuple[0]), int(centro_detectado_tuple[1])), 5, (255, 255, 0), 2)
+    if centro_detectado is not None and not np.isnan(centro_detectado[0]):
+        cv2.circle(frame_debug, pt(centro_detectado[0], centro_detectado[1]), 5, (255, 255, 0), 2)
     
     # Informações de debug
     if debug_info:
@@ -386,216 +1136,1380 @@ def _draw_debug_overlays(frame, results, haar_faces, centro_atual, centro_detect
     
     return frame_debug
 
+class _TrajectoryLog:
+    """
+    Log compacto do reframe, gravado em todo job: por frame, o método de detecção,
+    a trilha do falante, o centro bruto e a fração de CENTER_OFFSET_Y aplicada a
+    ele (1 MediaPipe, 0 Haar, intermediária nos interpolados); por detecção, as linhas de rosto de
+    _face_rows. Junto com a janela de corte final basta para redesenhar o vídeo de
+    debug depois, a partir do original (render_debug_video).
+    """
+
+    def __init__(self):
+        self.frames = []  # (método, trilha do falante, cx, cy, offset)
+        self.faces = []  # arrays de _face_rows
+
+    def add_frame(self, method, speaker, centro, offset=0.0):
+        cx, cy = centro if centro is not None else (np.nan, np.nan)
+        self.frames.append((method, speaker, cx, cy, offset))
+
+    def add_faces(self, rows):
+        if len(rows):
+            self.faces.append(rows)
+
+    def arrays(self):
+        """Arrays numpy do log (também é o formato devolvido pelos trechos do modo segmentado)."""
+        frames = np.array(self.frames, dtype=np.float64).reshape(-1, 5)
+        return {
+            "method": frames[:, 0].astype(np.uint8),
+            "speaker": frames[:, 1].astype(np.int32),
+            "raw": frames[:, 2:4].astype(np.float32),
+            "offset": frames[:, 4].astype(np.float32),
+            "faces": np.concatenate(self.faces) if self.faces else np.zeros((0, _FACE_ROW_SIZE), dtype=np.float32)
+        }
+
+def _write_trajectory_log(path, arrays, target, shots, fps, width, height):
+    """Grava o log (npz comprimido) com a janela de corte do formato principal e os planos."""
+    with open(path, "wb") as f:
+        np.savez_compressed(
+            f, crop=np.asarray(target["trajectory"], dtype=np.int32).reshape(-1, 2),
+            crop_size=np.array((target["crop_w"], target["crop_h"]), dtype=np.int32),
+            shot_starts=np.array([ini for ini, _, _ in shots], dtype=np.int64),
+            fps=np.float64(fps), size=np.array((width, height), dtype=np.int32), **arrays)
+
+def _load_trajectory_log(path):
+    """Lê o log gravado por _write_trajectory_log num dict de arrays."""
+    with np.load(path) as data:
+        return {k: data[k] for k in data.files}
+
+def _debug_frame(frame, log, i, scale=1.0):
+    """Frame i com os overlays de debug redesenhados a partir do log."""
+    linhas = log["faces"]
+    ini, fim = np.searchsorted(linhas[:, 0], [i, i + 1])
+    crop_w, crop_h = (int(v) for v in log["crop_size"])
+    crop = None
+    if i < len(log["crop"]):
+        x1, y1 = (int(v) for v in log["crop"][i])
+        crop = (x1, y1, crop_w, crop_h)
+    centro_atual = (crop[0] + crop_w / 2.0, crop[1] + crop_h / 2.0) if crop else None
+    metodo = int(log["method"][i]) if i < len(log["method"]) else _LOG_FALLBACK
+    debug_info = {
+        "Frame": i,
+        "Shot": int(np.searchsorted(log["shot_starts"], i, side="right")) - 1,
+        "Method": _LOG_METHODS[metodo],
+        "Faces": int(fim - ini)
+    }
+    if i < len(log["speaker"]) and log["speaker"][i] >= 0:
+        debug_info["Speaker"] = f"#{int(log['speaker'][i])}"
+    centro_detectado = log["raw"][i] if i < len(log["raw"]) else None
+    return _draw_debug_overlays(frame, linhas[ini:fim], centro_atual, centro_detectado, debug_info,
+                                crop=crop, scale=scale)
+
+def render_debug_video(input_path: str, log_path: str, output_path: str, scale=1.0, progress_cb=None) -> str:
+    """
+    Gera o vídeo de debug sob demanda: decodifica o original e desenha os overlays
+    a partir do log de trajetória do job (rostos, trilha do falante, centro bruto,
+    janela de corte). scale < 1 reduz a resolução do vídeo gerado.
+    progress_cb(progress) recebe 0..1. Retorna output_path.
+    """
+    log = _load_trajectory_log(log_path)
+    total = len(log["method"])
+    fps = float(log["fps"])
+    width, height = (int(v) for v in log["size"])
+    scale = min(1.0, max(0.05, float(scale)))
+    size = (max(2, int(width * scale)) // 2 * 2, max(2, int(height * scale)) // 2 * 2)
+    cap = cv2.VideoCapture(input_path)
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    try:
+        for i, frame, _ in _read_frames(cap, total):
+            if scale < 1.0:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            out.write(_debug_frame(frame, log, i, scale))
+            if progress_cb and i % 50 == 0:
+                progress_cb(i / float(max(1, total)))
+    finally:
+        cap.release()
+        out.release()
+    return output_path
+
+def render_debug_contact_sheet(input_path: str, log_path: str, output_path: str, samples=12, columns=4,
+                               scale=0.25) -> str:
+    """
+    Folha de contato do debug: samples frames espaçados uniformemente, com os
+    overlays do log, numa grade de columns colunas (imagem, ex.: .jpg).
+    Retorna output_path.
+    """
+    log = _load_trajectory_log(log_path)
+    total = len(log["method"])
+    width, height = (int(v) for v in log["size"])
+    samples = max(1, min(int(samples), total))
+    columns = max(1, min(int(columns), samples))
+    scale = min(1.0, max(0.05, float(scale)))
+    tile = (max(1, int(width * scale)), max(1, int(height * scale)))
+    indices = np.linspace(0, total - 1, samples).round().astype(int)
+    rows = -(-samples // columns)
+    sheet = np.zeros((rows * tile[1], columns * tile[0], 3), dtype=np.uint8)
+    cap = cv2.VideoCapture(input_path)
+    try:
+        for k, i in enumerate(indices):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(i))
+            ok, frame = cap.read()
+            if not ok:
+                continue
+            frame = cv2.resize(frame, tile, interpolation=cv2.INTER_AREA)
+            r, c = divmod(k, columns)
+            sheet[r * tile[1]:(r + 1) * tile[1], c * tile[0]:(c + 1) * tile[0]] = _debug_frame(frame, log, int(i), scale)
+    finally:
+        cap.release()
+    if not cv2.imwrite(output_path, sheet):
+        raise RuntimeError(f"Falha ao gravar folha de contato: {output_path}")
+    return output_path
+
+def _write_crop_paths(path, targets, fps, width, height):
+    """
+    Grava a trajetória de corte de cada formato (npz comprimido): (x1, y1) por
+    frame em int16, tamanho da janela e tamanho de saída (0x0 = sem escala).
+    """
+    with open(path, "wb") as f:
+        np.savez_compressed(
+            f, paths=np.asarray([t["trajectory"] for t in targets], dtype=np.int16).reshape(len(targets), -1, 2),
+            specs=np.array([t["spec"] for t in targets]), labels=np.array([t["label"] for t in targets]),
+            crop_sizes=np.array([(t["crop_w"], t["crop_h"]) for t in targets], dtype=np.int32),
+            output_sizes=np.array([t["size"] or (0, 0) for t in targets], dtype=np.int32),
+            fps=np.float64(fps), size=np.array((width, height), dtype=np.int32))
+
+def load_crop_paths(path: str) -> dict:
+    """
+    Lê o arquivo de _write_crop_paths. Retorna {"fps", "width", "height", "targets"},
+    com um item por formato: aspect_ratio, label, crop_w, crop_h, size (ou None)
+    e trajectory, array (frames, 2) int16 com (x1, y1) de cada frame.
+    """
+    with np.load(path) as data:
+        targets = []
+        for k, spec in enumerate(data["specs"]):
+            size = tuple(int(v) for v in data["output_sizes"][k])
+            targets.append({
+                "aspect_ratio": str(spec),
+                "label": str(data["labels"][k]),
+                "crop_w": int(data["crop_sizes"][k][0]),
+                "crop_h": int(data["crop_sizes"][k][1]),
+                "size": size if size != (0, 0) else None,
+                "trajectory": data["paths"][k]
+            })
+        return {"fps": float(data["fps"]), "width": int(data["size"][0]), "height": int(data["size"][1]),
+                "targets": targets}
+
+def _file_digest(path, block_size=1024 * 1024):
+    """sha256 do conteúdo do arquivo, lido em blocos."""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def _analysis_cache_path(cache_dir, content_hash, analysis_size, detect_stride, scene_threshold, silence_stride):
+    """
+    Arquivo da análise em cache: hash do conteúdo + hash de tudo que muda as detecções.
+    Suavização (SMOOTH_ALPHA, CENTER_HISTORY_SIZE, zona morta), CENTER_OFFSET_Y,
+    formatos e render ficam de fora: mudá-los só refaz trajetória e render (as janelas
+    de busca do Haar, que dependem do centro corrente, seguem as do job que gerou a análise).
+    """
+    settings = {
+        "format": _ANALYSIS_FORMAT,
+        "analysis_size": analysis_size,
+        "detect_stride": detect_stride,
+        "scene": (scene_threshold, SCENE_MIN_SHOT_FRAMES),
+        "silence": (silence_stride, SPEECH_ENERGY_DB, SILENCE_MIN_SECONDS),
+        "haar": (HAAR_MIN_SIZE, HAAR_LONG_EDGE, HAAR_SCALE_FACTOR, HAAR_ROI_SIZE, HAAR_FULL_SEARCH_INTERVAL),
+        "tracker": (ACTIVITY_HISTORY_SIZE, TRACK_MATCH_RADIUS, TRACK_MAX_MISSES, SPEECH_TIE_MARGIN)
+    }
+    if detect_stride > 1:
+        # Com detecção esparsa a zona morta decide onde caem os keyframes
+        settings["dead_zone"] = (DEAD_ZONE_THRESHOLD_X, DEAD_ZONE_THRESHOLD_Y)
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"{content_hash}_{digest[:16]}.npz")
+
+def _write_analysis(path, raw_centers, log_arrays, shots, fallback_offsets, counters, width, height):
+    """
+    Grava a análise (npz comprimido): centros brutos em float64, log do reframe,
+    planos com seus fallbacks e contadores da detecção. Escrita atômica (vários
+    workers podem gravar a mesma chave); o diretório guarda só os
+    ANALYSIS_CACHE_MAX_FILES arquivos usados mais recentemente.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fallbacks = [f if f is not None else (np.nan, np.nan) for _, _, f in shots]
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(
+            f, raw_centers=np.asarray(raw_centers, dtype=np.float64).reshape(-1, 2),
+            shot_starts=np.array([ini for ini, _, _ in shots], dtype=np.int64),
+            shot_fallbacks=np.asarray(fallbacks, dtype=np.float64).reshape(-1, 2),
+            shot_fallback_offsets=np.asarray(fallback_offsets, dtype=np.float64),
+            center_offset_y=np.float64(CENTER_OFFSET_Y), size=np.array((width, height), dtype=np.int32),
+            counters=np.array([counters[k] for k in _ANALYSIS_COUNTERS], dtype=np.int64),
+            **{k: v for k, v in log_arrays.items() if k != "raw"})
+    os.replace(tmp, path)
+
+    arquivos = [os.path.join(directory, n) for n in os.listdir(directory) if n.endswith(".npz")]
+    if len(arquivos) > ANALYSIS_CACHE_MAX_FILES:
+        arquivos.sort(key=lambda a: os.path.getmtime(a) if os.path.exists(a) else 0)
+        for antigo in arquivos[:len(arquivos) - ANALYSIS_CACHE_MAX_FILES]:
+            try: os.remove(antigo)
+            except OSError: pass
+
+def _load_analysis(path, width, height):
+    """
+    Lê a análise de _write_analysis (None se ausente, corrompida ou de outra
+    resolução) e reaplica o CENTER_OFFSET_Y atual aos centros do MediaPipe.
+    Retorna {"raw_centers", "shots", "log", "counters"}.
+    """
+    try:
+        with np.load(path) as data:
+            d = {k: data[k] for k in data.files}
+        os.utime(path)  # uso recente: fica no cache
+    except Exception:
+        return None
+    if tuple(int(v) for v in d["size"]) != (width, height):
+        return None
+
+    delta = height * (float(d["center_offset_y"]) - CENTER_OFFSET_Y)
+    raw = d["raw_centers"]
+    raw[:, 1] += d["offset"] * delta
+    fallbacks = d["shot_fallbacks"]
+    fallbacks[:, 1] += d["shot_fallback_offsets"] * delta
+
+    inicios = d["shot_starts"].tolist()
+    fins = inicios[1:] + [len(raw)]
+    shots = [(ini, fim, None if np.isnan(fb[0]) else fb) for ini, fim, fb in zip(inicios, fins, fallbacks)]
+    log = {k: d[k] for k in ("method", "speaker", "offset", "faces")}
+    log["raw"] = raw.astype(np.float32)
+    return {"raw_centers": raw, "shots": shots, "log": log,
+            "counters": dict(zip(_ANALYSIS_COUNTERS, d["counters"].tolist()))}
+
+def _analysis_scale(width, height, long_edge):
+    """Escala (<= 1) que leva o frame original ao lado maior de análise (0 = sem redução)."""
+    if not long_edge or max(width, height) <= long_edge:
+        return 1.0
+    return long_edge / float(max(width, height))
+
+def parse_target(spec: str):
+    """
+    Interpreta um formato de saída: proporção "9:16" / "1:1" / "4:5" ou tamanho "1080x1920".
+    Retorna (ratio_w, ratio_h, tamanho) onde tamanho é (w, h) ou None (mantém a resolução do corte).
+    Levanta ValueError para formatos inválidos.
+    """
+    txt = str(spec).strip().lower()
+    sep = ":" if ":" in txt else ("x" if "x" in txt else None)
+    try:
+        if sep is None:
+            raise ValueError
+        a, b = (int(v) for v in txt.split(sep, 1))
+    except ValueError:
+        raise ValueError(f"Formato de saída inválido: {spec} (use 'W:H' ou 'LARGURAxALTURA')") from None
+    if a <= 0 or b <= 0:
+        raise ValueError(f"Formato de saída inválido: {spec}")
+    size = (a - a % 2, b - b % 2) if sep == "x" else None
+    return a, b, size
+
+def _crop_size_for(ratio_w, ratio_h, width, height):
+    """Maior janela de corte com a proporção pedida que cabe no frame (dimensões pares)."""
+    if width * ratio_h >= height * ratio_w:
+        crop_h, crop_w = height, int(height * ratio_w / ratio_h)
+    else:
+        crop_w, crop_h = width, int(width * ratio_h / ratio_w)
+    # libx264/yuv420p exige dimensões pares
+    return crop_w - crop_w % 2, crop_h - crop_h % 2
+
+def _output_path_for(output_path, label, index):
+    """Caminho das saídas adicionais: mesmo nome da principal com o formato como sufixo."""
+    if index == 0 or output_path is None:
+        return output_path
+    base, ext = os.path.splitext(output_path)
+    return f"{base}_{label}{ext or '.mp4'}"
+
+def _build_targets(aspect_ratios, width, height, output_path, output_paths=None):
+    """Uma saída por formato pedido (formatos repetidos são ignorados), sem writer ainda."""
+    targets = []
+    for k, spec in enumerate(aspect_ratios or ["9:16"]):
+        ratio_w, ratio_h, size = parse_target(spec)
+        crop_w, crop_h = _crop_size_for(ratio_w, ratio_h, width, height)
+        label = f"{size[0]}x{size[1]}" if size else f"{ratio_w}x{ratio_h}"
+        if any(t["label"] == label for t in targets):
+            continue  # formato repetido: mesmo arquivo
+        targets.append({
+            "spec": str(spec),
+            "label": label,
+            "crop_w": crop_w,
+            "crop_h": crop_h,
+            "size": size,
+            "path": output_paths[k] if output_paths else _output_path_for(output_path, label, k),
+            "out": None,
+            "tmp_video": None,
+            "mux_info": None,
+            "trajectory": []  # (x1, y1) do corte em cada frame
+        })
+    return targets
+
+def _write_crop(target, frame, x1, y1):
+    """
+    Corta a janela do formato em (x1, y1) e escreve no writer dele (se houver).
+    O cv2.VideoWriter foi aberto no tamanho final e descarta em silêncio frames de outro
+    tamanho: redimensiona aqui. O _FFmpegWriter recebe o corte cru e escala no -vf.
+    """
+    if target["out"]:
+        crop = frame[y1:y1+target["crop_h"], x1:x1+target["crop_w"]]
+        if target["size"] and isinstance(target["out"], cv2.VideoWriter):
+            crop = cv2.resize(crop, target["size"], interpolation=cv2.INTER_AREA)
+        target["out"].write(crop)
+
+def _apply_trajectory(targets, centros, width, height):
+    """Converte os centros finais (N, 2) na janela de corte (x1, y1) de cada formato."""
+    for t in targets:
+        x1s = np.clip((centros[:, 0] - t["crop_w"] / 2).astype(int), 0, width - t["crop_w"])
+        y1s = np.clip((centros[:, 1] - t["crop_h"] / 2).astype(int), 0, height - t["crop_h"])
+        t["trajectory"] = list(zip(x1s.tolist(), y1s.tolist()))
+
+def _seek_frame(cap, index, pts_ms=None):
+    """
+    Posiciona cap no frame index (contagem de cap.read() desde o início).
+    Com pts_ms (index é um keyframe), busca por tempo e confere o pts do frame que
+    o decoder entregou; sem pts_ms ou se a conferência falha (VFR, índice do
+    container impreciso), volta ao início e avança com grab() até index: lento, mas
+    exato. Retorna True se o frame index já está decodificado (pegar com retrieve()).
+    """
+    if pts_ms is not None:
+        cap.set(cv2.CAP_PROP_POS_MSEC, pts_ms)
+        meio_frame = 500.0 / max(1.0, cap.get(cv2.CAP_PROP_FPS) or 30.0)
+        if cap.grab() and abs(cap.get(cv2.CAP_PROP_POS_MSEC) - pts_ms) < meio_frame:
+            return True
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    for _ in range(index):
+        if not cap.grab():
+            break
+    return False
+
+def _read_frames(cap, total, scale=1.0, start=0, start_ms=None):
+    """
+    Estágio de decodificação (modo serial).
+    Gera tuplas (indice, frame_bgr, frame_rgb), onde frame_rgb é o frame de
+    análise: redimensionado uma única vez por scale (< 1) antes da conversão.
+    start > 0 posiciona o decoder no frame start (modo segmentado, ver _seek_frame;
+    start_ms é o pts do keyframe start); total é o frame final (exclusivo).
+    """
+    decodificado = _seek_frame(cap, start, start_ms) if start > 0 else False
+    for i in range(start, total):
+        if decodificado:
+            ok, frame = cap.retrieve()
+            decodificado = False
+        else:
+            ok, frame = cap.read()
+        if not ok:
+            break
+        analysis = frame
+        if scale < 1.0:
+            h, w = frame.shape[:2]
+            analysis = cv2.resize(frame, (max(1, int(round(w * scale))), max(1, int(round(h * scale)))),
+                                  interpolation=cv2.INTER_AREA)
+        yield i, frame, cv2.cvtColor(analysis, cv2.COLOR_BGR2RGB)
+
+class _ThreadedFrameReader:
+    """
+    Estágio de decodificação em thread própria (modo pipeline).
+    Decodifica e converte para RGB enquanto o estágio de detecção roda o MediaPipe,
+    entregando os frames por uma fila limitada (evita acumular frames em memória).
+    """
+
+    def __init__(self, cap, total, scale=1.0, maxsize=PIPELINE_QUEUE_SIZE, start=0, start_ms=None):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(cap, total, scale, start, start_ms), daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _run(self, cap, total, scale, start, start_ms):
+        try:
+            for item in _read_frames(cap, total, scale, start, start_ms):
+                if self._stop.is_set():
+                    break
+                self._put(item)
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._put(_STAGE_END)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _STAGE_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        """Interrompe a decodificação e aguarda a thread terminar."""
+        self._stop.set()
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        self._thread.join()
+
+class _ThreadedWriter:
+    """
+    Estágio de escrita em thread própria (modo pipeline).
+    Expõe a mesma interface do cv2.VideoWriter (write/release), mas a codificação
+    acontece em paralelo com a detecção do próximo frame.
+    """
+
+    def __init__(self, writer, maxsize=PIPELINE_QUEUE_SIZE):
+        self._writer = writer
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is _STAGE_END:
+                break
+            if self._error is not None:
+                continue  # descarta frames após erro, mas continua drenando a fila
+            try:
+                self._writer.write(frame)
+            except Exception as e:
+                self._error = e
+
+    def write(self, frame):
+        if self._error is not None:
+            raise RuntimeError(f"Erro no estágio de escrita: {self._error}") from self._error
+        self._queue.put(frame)
+
+    def release(self):
+        self._queue.put(_STAGE_END)
+        self._thread.join()
+        self._writer.release()
+        if self._error is not None:
+            raise RuntimeError(f"Erro no estágio de escrita: {self._error}") from self._error
+
+    def abort(self):
+        """Descarta o restante da fila e interrompe o writer interno."""
+        self._error = self._error or RuntimeError("abortado")
+        self._queue.put(_STAGE_END)
+        self._thread.join()
+        _abort_writer(self._writer)
+
+def _keyframes(video_path):
+    """
+    Keyframes do vídeo como [(índice do frame, pts em ms desde o primeiro frame)], com
+    índices na ordem de apresentação (a mesma contagem de cap.read()). Lê só os
+    pacotes (ffprobe, sem decodificar). None se o ffprobe falhar.
+    """
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", video_path],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=300
+        )
+    except Exception:
+        return None
+    if result.returncode != 0:
+        return None
+    pacotes = []
+    for linha in result.stdout.splitlines():
+        pts, _, flags = linha.partition(",")
+        try:
+            pacotes.append((float(pts), "K" in flags))
+        except ValueError:
+            continue  # pacote sem pts
+    if not pacotes:
+        return None
+    pacotes.sort()
+    inicio = pacotes[0][0]
+    return [(i, (pts - inicio) * 1000.0) for i, (pts, chave) in enumerate(pacotes) if chave]
+
+def _plan_segments(total, fps, workers, min_seconds=None, warmup=None, keyframes=None):
+    """
+    Divide [0, total) em até workers trechos de pelo menos min_seconds.
+    Retorna lista de (inicio_aquecimento, inicio, fim, pts_ms do aquecimento) em
+    índices de frame (fim exclusivo).
+    Com keyframes (_keyframes), cada divisa vai para o keyframe mais próximo (até 1/4
+    de min_seconds de distância): encoders como o x264 põem keyframes nos cortes de
+    cena, e o trecho não começa no meio de um plano. O aquecimento começa no keyframe
+    anterior, ponto de busca que _seek_frame confere pelo pts; sem keyframes (ou se a
+    conferência falhar) o trecho é alcançado lendo o vídeo desde o início.
+    min_seconds/warmup: None usa SEGMENT_MIN_SECONDS/SEGMENT_WARMUP_SECONDS (lidos na chamada).
+    """
+    if min_seconds is None:
+        min_seconds = SEGMENT_MIN_SECONDS
+    if warmup is None:
+        warmup = SEGMENT_WARMUP_SECONDS
+    n = max(1, min(int(workers), int(total / max(1.0, min_seconds * fps))))
+    limites = [int(round(k * total / float(n))) for k in range(n + 1)]
+    aquecimento = int(round(warmup * fps))
+    indices = [k for k, _ in keyframes or []]
+    if indices:
+        janela = min_seconds * fps / 4.0
+        for j in range(1, n):
+            pos = bisect.bisect_left(indices, limites[j])
+            vizinhos = [indices[m] for m in (pos - 1, pos) if 0 <= m < len(indices)]
+            proximo = min(vizinhos, key=lambda k: abs(k - limites[j]))
+            if abs(proximo - limites[j]) <= janela:
+                limites[j] = proximo
+    trechos = []
+    for ini, fim in zip(limites, limites[1:]):
+        if fim <= ini:
+            continue
+        alvo = max(0, ini - aquecimento)
+        m = bisect.bisect_right(indices, alvo) - 1
+        if alvo > 0 and m >= 0 and indices[m] > 0:
+            trechos.append((indices[m], ini, fim, keyframes[m][1]))
+        else:
+            trechos.append((alvo, ini, fim, None))
+    return trechos
+
+def _concat_segments(paths, output_path, input_path=None, input_metadata=None):
+    """
+    Concatena os trechos sem recodificar (concat demuxer + -c:v copy).
+    Com input_metadata, inclui o áudio do source no mesmo comando e retorna o mux_info.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as lista:
+        for path in paths:
+            lista.write(f"file '{path}'\n")
+    try:
+        cmd = ["ffmpeg", "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", lista.name]
+        audio_out, mux_info = [], None
+        if input_metadata is not None:
+            audio_inputs, audio_out, mux_info = _audio_args(input_metadata, source_index=1, silent_index=1)
+            if mux_info["has_source_audio"]:
+                if input_metadata.get("duration"):
+                    cmd += ["-t", f"{input_metadata['duration']:.3f}"]
+                cmd += ["-i", input_path]
+            cmd += audio_inputs
+        cmd += ["-map", "0:v:0"] + audio_out + ["-c:v", "copy", "-movflags", "+faststart", output_path]
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            error_msg = (f"Erro na concatenação dos segmentos: código {result.returncode} - "
+                         f"{result.stderr.decode('utf-8', errors='ignore')[:200]}")
+            if mux_info is not None:
+                mux_info["error"] = error_msg
+            raise RuntimeError(error_msg)
+    finally:
+        try: os.remove(lista.name)
+        except: pass
+    return mux_info
+
+_segment_progress = None  # fila de progresso do processo pai (definida no worker)
+_segment_detectors = None  # detectores do processo do pool, criados na inicialização
+
+def _init_segment_worker(progress_queue):
+    global _segment_progress, _segment_detectors
+    _segment_progress = progress_queue
+    _segment_detectors = DetectorBundle()
+
+def _reframe_segment(index, input_path, segment, options):
+    """Executado no processo do pool: reframe_video de um único trecho."""
+    def progress_cb(stage, progress, meta=None):
+        if _segment_progress is not None and meta and "frame" in meta:
+            _segment_progress.put((index, meta["frame"]))
+    return reframe_video(input_path, None, progress_cb=progress_cb, segment=segment,
+                         detectors=_segment_detectors, **options)
+
+def _shot_list(shots, fps):
+    """Planos detectados (fim exclusivo) no formato das métricas."""
+    return [
+        {"start_frame": ini, "end_frame": fim, "start": round(ini / float(fps), 3), "end": round(fim / float(fps), 3)}
+        for ini, fim, _ in shots
+    ]
+
+def _reframe_segmented(input_path, output_path, segments, options, progress_cb, fps, width, height, total,
+                       input_metadata, trajectory_log=None, crop_path=None, analysis_path=None):
+    """
+    Modo segmentado: cada trecho roda reframe_video num processo próprio (FaceMesh
+    próprio, aquecimento antes do início) e o pai junta tudo. Com render="opencv" os
+    trechos já saem codificados e são concatenados sem recodificar; com render="ffmpeg"
+    os trechos só analisam e o pai suaviza e renderiza a trajetória inteira.
+    """
+    render, writer, smoothing = options["render"], options["writer"], options["smoothing"]
+    targets = _build_targets(options["aspect_ratios"], width, height, output_path, options["output_paths"])
+    options = dict(options, aspect_ratios=[t["spec"] for t in targets])
+    analysis_share = ANALYSIS_PROGRESS_SHARE if render == "ffmpeg" else 1.0
+
+    tmp_dir = tempfile.mkdtemp(prefix="reframe_seg_")
+    seg_paths = [[os.path.join(tmp_dir, f"seg{k:04d}_{t['label']}.mp4") for t in targets]
+                 for k in range(len(segments))]
+    # spawn: o worker do Flask tem threads, e fork com MediaPipe/OpenCV carregados não é seguro
+    ctx = multiprocessing.get_context("spawn")
+    progress_queue = ctx.Queue()
+    feitos = [0] * len(segments)
+    trabalho = float(sum(fim - ini for ini, _, fim, _ in segments))
+    try:
+        with ProcessPoolExecutor(max_workers=len(segments), mp_context=ctx,
+                                 initializer=_init_segment_worker, initargs=(progress_queue,)) as pool:
+            futuros = [pool.submit(_reframe_segment, k, input_path, seg, dict(options, output_paths=seg_paths[k]))
+                       for k, seg in enumerate(segments)]
+            pendentes = set(futuros)
+            while pendentes:
+                _, pendentes = wait(pendentes, timeout=0.5)
+                try:
+                    while True:
+                        k, frame = progress_queue.get_nowait()
+                        feitos[k] = max(feitos[k], frame - segments[k][0])
+                except queue.Empty:
+                    pass
+                if progress_cb:
+                    progress_cb(stage="reframing", progress=min(0.999, analysis_share * sum(feitos) / trabalho),
+                                meta={"frame": int(sum(feitos)), "total_frames": total, "segments": len(segments)})
+            resultados = [f.result() for f in futuros]
+
+        # Junta os trechos: um plano que atravessa a fronteira continua o do trecho anterior
+        raw_centers = []
+        inicios = []  # (frame inicial, centro_fallback, fallback_offset) de cada plano
+        for (_, ini, _, _), res in zip(segments, resultados):
+            raw_centers.extend(res["raw_centers"])
+            for k, frame in enumerate([0] + res["cuts"]):
+                fallback, offset = res["fallbacks"][k], res["fallback_offsets"][k]
+                if k == 0 and inicios:
+                    if inicios[-1][1] is None:
+                        inicios[-1] = (inicios[-1][0], fallback, offset)
+                    continue
+                inicios.append((ini + frame, fallback, offset))
+            for t, trajectory in zip(targets, res["trajectories"]):
+                t["trajectory"].extend(trajectory)
+        fins = [ini for ini, _, _ in inicios[1:]] + [len(raw_centers)]
+        shots = [(ini, fim, fallback) for (ini, fallback, _), fim in zip(inicios, fins)]
+
+        if render == "opencv":
+            for j, t in enumerate(targets):
+                partes = [paths[j] for paths in seg_paths]
+                if writer == "ffmpeg":
+                    t["mux_info"] = _concat_segments(partes, t["path"], input_path, input_metadata)
+                else:
+                    # vídeo mp4v concatenado; o mux de áudio segue o caminho normal
+                    t["tmp_video"] = os.path.join(tmp_dir, f"concat_{t['label']}.mp4")
+                    _concat_segments(partes, t["tmp_video"])
+
+        mux_info, outputs = _finish_outputs(input_path, targets, raw_centers, shots, fps, width, height, total,
+                                            input_metadata, render, writer, smoothing, progress_cb, analysis_share,
+                                            options["encoder_preset"], options["encoder_crf"])
+        logs = [res["log"] for res in resultados]
+        log = {k: np.concatenate([l[k] for l in logs]) for k in logs[0]}
+        if trajectory_log:
+            _write_trajectory_log(trajectory_log, log, targets[0], shots, fps, width, height)
+        if crop_path:
+            _write_crop_paths(crop_path, targets, fps, width, height)
+        if analysis_path:
+            counters = {k: sum(r[k] for r in resultados) for k in _ANALYSIS_COUNTERS}
+            _write_analysis(analysis_path, raw_centers, log, shots, [o for _, _, o in inicios], counters,
+                            width, height)
+    except BaseException:
+        _discard_outputs(targets)
+        raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    shots = _shot_list(shots, fps)
+    return {
+        "frames_processed": total,
+        "fps": float(fps),
+        "faces_detected_sum": sum(r["faces_detected_sum"] for r in resultados),
+        "frames_detected": sum(r["frames_detected"] for r in resultados),
+        "haar_full_searches": sum(r["haar_full_searches"] for r in resultados),
+        "haar_roi_searches": sum(r["haar_roi_searches"] for r in resultados),
+        "silent_frames": sum(r["silent_frames"] for r in resultados),
+        "detect_stride": max(1, int(options["detect_stride"])),
+        "analysis_scale": round(_analysis_scale(width, height, options["analysis_size"]), 4),
+        "smoothing": smoothing,
+        "scene_cuts": len(shots) - 1,
+        "shots": shots,
+        "segments": len(segments),
+        "status": "success",
+        "render": render,
+        "writer": writer if render == "opencv" else render,
+        "input_metadata": input_metadata,
+        "output_metadata": outputs[0]["output_metadata"],
+        "outputs": outputs,
+        "mux_info": mux_info,
+        "trajectory_log": trajectory_log,
+        "crop_path": crop_path,
+        "analysis_cache": analysis_path,
+        "analysis_cache_hit": False
+    }
+
+def _finish_outputs(input_path, targets, raw_centers, shots, fps, width, height, total, input_metadata,
+                    render, writer, smoothing, progress_cb, analysis_share, encoder_preset, encoder_crf):
+    """
+    Etapa pós-análise comum aos modos serial e segmentado: suavização offline
+    (plano a plano), renderização ffmpeg ou mux de áudio e metadados de cada saída.
+    shots: lista de (inicio, fim, centro_fallback). Retorna (mux_info, outputs).
+    """
+    if smoothing != "online":
+        # Suavização da trajetória inteira num único passo vetorizado
+        # Plano a plano: o corte salta no corte de cena em vez de atravessar o quadro
+        centros = _smooth_shots(raw_centers, shots, width, height, zero_phase=(smoothing == "zero_phase"))
+        _apply_trajectory(targets, centros, width, height)
+
+    try:
+        if render == "none":
+            # Só a trajetória (crop path): sem encode, sem mux e sem arquivos de saída
+            mux_info = None
+        elif render == "ffmpeg":
+            # passo 2: ffmpeg aplica as trajetórias (corte + encode + áudio num só processo)
+            def render_progress(p):
+                if progress_cb:
+                    progress_cb(stage="reframing",
+                                progress=min(0.999, analysis_share + (1.0 - analysis_share) * p),
+                                meta={"frame": int(p * len(raw_centers)), "total_frames": total})
+            mux_info = _render_ffmpeg(input_path, targets, fps, input_metadata, progress_cb=render_progress,
+                                      preset=encoder_preset, crf=encoder_crf)
+            for t in targets:
+                t["mux_info"] = mux_info
+            if progress_cb: progress_cb(stage="muxing", progress=1.0, meta={})
+        elif writer == "ffmpeg" and not targets[0]["tmp_video"]:
+            # áudio já entrou no mesmo processo de encode
+            mux_info = targets[0]["mux_info"]
+            if progress_cb: progress_cb(stage="muxing", progress=1.0, meta={})
+        else:
+            # mux de áudio
+            if progress_cb: progress_cb(stage="muxing", progress=0.0, meta={})
+            for k, t in enumerate(targets):
+                t["mux_info"] = _mux_audio(t["tmp_video"], input_path, t["path"])
+                if progress_cb: progress_cb(stage="muxing", progress=(k + 1) / float(len(targets)), meta={})
+            mux_info = targets[0]["mux_info"]
+
+        # Coleta metadados das saídas
+        outputs = []
+        for t in targets:
+            outputs.append({
+                "aspect_ratio": t["spec"],
+                "label": t["label"],
+                "path": t["path"],
+                "crop_w": t["crop_w"],
+                "crop_h": t["crop_h"],
+                "mux_info": t["mux_info"],
+                "output_metadata": _get_video_metadata(t["path"]) if render != "none" else None
+            })
+            if t["tmp_video"]:
+                try: os.remove(t["tmp_video"])
+                except: pass
+    except BaseException:
+        # Um formato que falhou não deixa para trás os que já foram gravados
+        _discard_outputs(targets)
+        raise
+    return mux_info, outputs
+
+def _online_trajectory(raw, shots, method, width, height):
+    """
+    Suavização online (_TrajectorySmoother) refeita sobre os centros brutos da
+    análise, com o mesmo estado do loop de detecção: reset em cada corte de cena e
+    fallback do plano valendo a partir do keyframe que antecede a primeira detecção.
+    """
+    smoother = _TrajectorySmoother(width, height)
+    centros = np.empty_like(raw)
+    for k, (ini, fim, fallback) in enumerate(shots):
+        if k > 0:
+            smoother.reset()
+        ativa = fim
+        detectados = np.flatnonzero(~np.isnan(raw[ini:fim, 0]))
+        if fallback is not None and len(detectados):
+            keyframes = np.flatnonzero(method[ini:ini + detectados[0]] != _LOG_INTERPOLATED)
+            ativa = ini + (keyframes[-1] + 1 if len(keyframes) else 0)
+        for i in range(ini, fim):
+            if i == ativa:
+                smoother.centro_fallback = np.array(fallback)
+            x, y = raw[i]
+            centros[i] = smoother.step(None if np.isnan(x) else (x, y))
+    return centros
+
+def _reframe_from_analysis(input_path, cap, analysis, targets, fps, width, height, total, input_metadata,
+                           render, writer, smoothing, progress_cb, encoder_preset, encoder_crf,
+                           trajectory_log=None, crop_path=None, analysis_path=None):
+    """
+    Reframe a partir de uma análise em cache: sem detecção, só trajetória e render.
+    Com render="opencv" o vídeo ainda é decodificado uma vez para cortar os frames.
+    """
+    raw_centers, shots = analysis["raw_centers"], analysis["shots"]
+    analysis_share = ANALYSIS_PROGRESS_SHARE if render == "ffmpeg" else 1.0
+    if smoothing == "online":
+        _apply_trajectory(targets, _online_trajectory(raw_centers, shots, analysis["log"]["method"], width, height),
+                          width, height)
+
+    try:
+        if render == "opencv":
+            for i in range(len(raw_centers)):
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                for t in targets:
+                    _write_crop(t, frame, *t["trajectory"][i])
+                if progress_cb and i % 50 == 0:
+                    progress_cb(stage="reframing", progress=min(0.999, i / float(max(1, total))),
+                                meta={"frame": i, "total_frames": total})
+    except BaseException:
+        for t in targets:
+            if t["out"]:
+                _abort_writer(t["out"])
+        _discard_outputs(targets)
+        raise
+    finally:
+        cap.release()
+    for t in targets:
+        if t["out"]:
+            t["out"].release()
+
+    mux_info, outputs = _finish_outputs(input_path, targets, raw_centers, shots, fps, width, height, total,
+                                        input_metadata, render, writer, smoothing, progress_cb, analysis_share,
+                                        encoder_preset, encoder_crf)
+    if trajectory_log:
+        _write_trajectory_log(trajectory_log, analysis["log"], targets[0], shots, fps, width, height)
+    if crop_path:
+        _write_crop_paths(crop_path, targets, fps, width, height)
+
+    shots = _shot_list(shots, fps)
+    return dict(analysis["counters"], **{
+        "frames_processed": total,
+        "fps": float(fps),
+        "smoothing": smoothing,
+        "scene_cuts": len(shots) - 1,
+        "shots": shots,
+        "status": "success",
+        "render": render,
+        "writer": writer if render == "opencv" else render,
+        "input_metadata": input_metadata,
+        "output_metadata": outputs[0]["output_metadata"],
+        "outputs": outputs,
+        "mux_info": mux_info,
+        "trajectory_log": trajectory_log,
+        "crop_path": crop_path,
+        "analysis_cache": analysis_path,
+        "analysis_cache_hit": True
+    })
+
 def reframe_video(input_path: str,
                   output_path: str,
                   progress_cb=None,
                   debug=False,
-                  debug_output=None) -> dict:
+                  debug_output=None,
+                  pipeline=False,
+                  render="opencv",
+                  detect_stride=DETECT_STRIDE,
+                  analysis_size=ANALYSIS_LONG_EDGE,
+                  smoothing="online",
+                  writer="opencv",
+                  encoder_preset=ENCODER_PRESET,
+                  encoder_crf=ENCODER_CRF,
+                  aspect_ratios=None,
+                  output_paths=None,
+                  scene_threshold=SCENE_CUT_THRESHOLD,
+                  segment_workers=SEGMENT_WORKERS,
+                  silence_stride=SILENCE_DETECT_STRIDE,
+                  trajectory_log=None,
+                  crop_path=None,
+                  analysis_cache=None,
+                  content_hash=None,
+                  stream_url=None,
+                  segment=None,
+                  detectors=None) -> dict:
     """
     Reenquadra 16:9 -> 9:16 mantendo o falante principal.
     progress_cb(stage, progress, meta)  # progress: 0..1
     debug: se True, gera vídeo com overlays de debug
     debug_output: caminho para salvar vídeo debug (se debug=True)
+    pipeline: se True, decodificação, detecção e escrita rodam em threads separadas
+              ligadas por filas limitadas (OpenCV/FFmpeg e MediaPipe se sobrepõem)
+    render: "opencv" (padrão) escreve cada corte via cv2.VideoWriter e faz mux depois;
+            "ffmpeg" faz dois passos: o loop só calcula a trajetória de corte e o ffmpeg
+            decodifica, corta, codifica e inclui o áudio num único processo;
+            "none" só calcula a trajetória (sem vídeo de saída; use com crop_path)
+    detect_stride: roda a detecção a cada N frames e interpola o centro entre eles;
+                   volta a detectar todo frame quando o centro salta além da zona morta
+    analysis_size: lado maior (px) do frame usado na detecção (ex.: 480); os centros
+                   são mapeados de volta para a resolução original, só o corte usa full-res
+    smoothing: "online" (padrão) suaviza frame a frame; "offline" suaviza a trajetória
+               inteira num passo vetorizado; "zero_phase" também filtra de trás para
+               frente (sem atraso). Os modos offline exigem render="ffmpeg" ou "none"
+    writer: com render="opencv", "opencv" (padrão) grava mp4v + mux separado;
+            "ffmpeg" envia os frames para um único ffmpeg (libx264 + áudio do source)
+    encoder_preset/encoder_crf: parâmetros do libx264 (writer ffmpeg e render ffmpeg)
+    aspect_ratios: formatos de saída ("9:16", "1:1", "4:5" ou tamanho "1080x1920"); todos
+                   saem de um único decode e da mesma trajetória, cada um com sua janela
+                   de corte. Padrão: ["9:16"]
+    output_paths: caminhos de cada formato; se omitido, o primeiro usa output_path e os
+                  demais recebem o formato como sufixo (video_1x1.mp4)
+    scene_threshold: limiar da detecção de cortes de cena (0 desativa); em cada corte o
+                     enquadramento salta para o novo plano e todo o estado de rastreamento
+                     e suavização recomeça. Os planos saem em metrics["shots"]
+    segment_workers: > 1 divide vídeos longos (trechos de pelo menos SEGMENT_MIN_SECONDS)
+                     entre até N processos, cada um com seu FaceMesh e um aquecimento de
+                     SEGMENT_WARMUP_SECONDS antes do trecho; os trechos são concatenados
+                     sem recodificar. Ignorado com debug
+    silence_stride: analisa o áudio (envelope de energia por frame, em streaming) antes
+                    do vídeo; em silêncios de pelo menos SILENCE_MIN_SECONDS a detecção
+                    roda a cada N frames e o corte se mantém, e entre rostos com abertura
+                    de boca parecida vence o que fala quando há som. 1 mantém só o
+                    desempate; 0 desativa a análise de áudio
+    trajectory_log: caminho (.npz) para gravar o log compacto de trajetória (rostos,
+                    trilha do falante, centros, método por frame e janela de corte);
+                    render_debug_video/render_debug_contact_sheet geram o debug depois,
+                    sem o custo de um segundo encode no job. Sai em metrics["trajectory_log"]
+    crop_path: caminho (.npz) para gravar a janela de corte (x1, y1, crop_w, crop_h) de
+               cada frame em cada formato; lido por load_crop_paths. Sai em
+               metrics["crop_path"]
+    analysis_cache: diretório do cache de análise. A análise (centros brutos, rostos,
+                    planos) fica guardada por conteúdo do vídeo + parâmetros de detecção;
+                    um job no mesmo vídeo com outra suavização, CENTER_OFFSET_Y, formatos
+                    ou render pula a detecção e só refaz trajetória e render
+                    (metrics["analysis_cache_hit"]). Ignorado com debug
+    content_hash: sha256 do conteúdo já calculado pelo chamador (ex.: no download);
+                  se omitido, o arquivo é lido uma vez para calculá-lo
+    stream_url: URL http(s) do mesmo vídeo de input_path enquanto ele ainda está sendo
+                baixado (em input_path + ".part", renomeado ao terminar). Os frames são
+                decodificados direto do stream e a detecção começa sem esperar o download;
+                mux, render ffmpeg e o hash do cache de análise esperam o arquivo local.
+                Sem análise de áudio (o envelope precisa do arquivo inteiro) e sem modo
+                segmentado
+    segment: uso interno do modo segmentado: (inicio_aquecimento, inicio, fim, pts_ms do
+             aquecimento) em frames, ver _plan_segments
+    detectors: DetectorBundle do worker, reaproveitado entre jobs (reset no início);
+               se omitido, cria FaceMesh/cascades para este vídeo e fecha ao final
     Retorna métricas para log.
     """
 
-    cap = cv2.VideoCapture(input_path)
-    fps    = cap.get(cv2.CAP_PROP_FPS) or 24.0
+    # Metadados do input num único ffprobe (em cache): fps e número de frames vêm do
+    # container, CAP_PROP_FRAME_COUNT costuma errar; o codec de áudio decide entre
+    # copiar o stream ou converter. Largura/altura seguem o decoder (já com rotação)
+    # No modo streaming o probe e o decode vão direto na URL; o arquivo local fica para o áudio
+    input_metadata = _get_video_metadata(stream_url or input_path)
+    cap = cv2.VideoCapture(stream_url or input_path)
+    fps    = input_metadata.get("fps") or cap.get(cv2.CAP_PROP_FPS) or 24.0
     width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    total  = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or 1
+    total  = input_metadata.get("frame_count") or int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or 1
+
+    # Uma janela de corte por formato de saída; todas compartilham decode e trajetória
+    targets = _build_targets(aspect_ratios, width, height, output_path, output_paths)
+    detect_stride = max(1, int(detect_stride))
+    # Landmarks do MediaPipe são normalizados (0..1) e já multiplicados por width/height;
+    # apenas as caixas do Haar precisam ser reescaladas
+    scale = _analysis_scale(width, height, analysis_size)
+    if render not in ("opencv", "ffmpeg", "none"):
+        raise ValueError(f"render inválido: {render} (use 'opencv', 'ffmpeg' ou 'none')")
+    if smoothing not in ("online", "offline", "zero_phase"):
+        raise ValueError(f"smoothing inválido: {smoothing} (use 'online', 'offline' ou 'zero_phase')")
+    if smoothing != "online" and render == "opencv":
+        raise ValueError("smoothing offline exige render='ffmpeg' ou 'none' (a trajetória inteira precisa existir antes do corte)")
 
-    crop_h = height
-    crop_w = int(height * 9 / 16)
-    tmp_video = tempfile.NamedTemporaryFile(suffix=".mp4", delete=False).name
-    out = cv2.VideoWriter(tmp_video, cv2.VideoWriter_fourcc(*'mp4v'), fps, (crop_w, crop_h))
+    if writer not in ("opencv", "ffmpeg"):
+        raise ValueError(f"writer inválido: {writer} (use 'opencv' ou 'ffmpeg')")
+    if stream_url:
+        if not cap.isOpened():
+            raise RuntimeError(f"Não foi possível abrir o stream: {stream_url}")
+        silence_stride = 0
+
+    # Análise em cache (mesmo conteúdo e mesma detecção): pula direto para trajetória e render
+    analysis_path = analysis = None
+    if analysis_cache and segment is None and not debug and not stream_url:
+        analysis_path = _analysis_cache_path(analysis_cache, content_hash or _file_digest(input_path),
+                                             analysis_size, detect_stride, scene_threshold, silence_stride)
+        analysis = _load_analysis(analysis_path, width, height)
+
+    if segment is None and segment_workers > 1 and not debug and not stream_url and analysis is None:
+        segments = _plan_segments(total, fps, segment_workers)
+        if len(segments) > 1:
+            # Divisas nos keyframes (cortes de cena) e busca conferida pelo pts
+            segments = _plan_segments(total, fps, segment_workers, keyframes=_keyframes(input_path))
+            cap.release()
+            options = {
+                "pipeline": pipeline, "render": render, "detect_stride": detect_stride,
+                "analysis_size": analysis_size, "smoothing": smoothing, "writer": writer,
+                "encoder_preset": encoder_preset, "encoder_crf": encoder_crf,
+                "aspect_ratios": aspect_ratios, "output_paths": output_paths,
+                "scene_threshold": scene_threshold, "silence_stride": silence_stride
+            }
+            return _reframe_segmented(input_path, output_path, segments, options, progress_cb,
+                                      fps, width, height, total, input_metadata, trajectory_log, crop_path,
+                                      analysis_path)
+    seg_ini, seg_start, seg_end, seg_ini_ms = segment or (0, 0, total, None)
+
+    for t in targets:
+        if render == "opencv" and writer == "ffmpeg":
+            # Um único ffmpeg: encode H.264 + áudio do source, sem arquivo intermediário nem mux.
+            # No modo streaming o source ainda está baixando: encode só do vídeo e mux no final
+            if stream_url:
+                t["tmp_video"] = tempfile.NamedTemporaryFile(suffix=".mp4", delete=False).name
+            t["out"] = _FFmpegWriter(t["tmp_video"] or t["path"], fps, (t["crop_w"], t["crop_h"]), input_path,
+                                     input_metadata, preset=encoder_preset, crf=encoder_crf, out_size=t["size"],
+                                     with_audio=segment is None and not stream_url)
+            t["mux_info"] = t["out"].mux_info
+        elif render == "opencv":
+            # Trechos do modo segmentado gravam direto no arquivo do trecho (mux só no final)
+            if segment is None:
+                t["tmp_video"] = tempfile.NamedTemporaryFile(suffix=".mp4", delete=False).name
+            t["out"] = cv2.VideoWriter(t["tmp_video"] or t["path"], cv2.VideoWriter_fourcc(*'mp4v'), fps,
+                                       t["size"] or (t["crop_w"], t["crop_h"]))
+    if analysis is not None:
+        metrics = _reframe_from_analysis(input_path, cap, analysis, targets, fps, width, height, total,
+                                         input_metadata, render, writer, smoothing, progress_cb, encoder_preset,
+                                         encoder_crf, trajectory_log, crop_path, analysis_path)
+        return dict(metrics, detect_stride=detect_stride, analysis_scale=round(scale, 4))
+    raw_centers = []  # centro bruto (antes da suavização) de cada frame
+    log = _TrajectoryLog()
     
     # VideoWriter para debug (vídeo completo com overlays)
     out_debug = None
     if debug and debug_output:
         out_debug = cv2.VideoWriter(debug_output, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
 
-    face_mesh = mp_face_mesh.FaceMesh(
-        static_image_mode=False, max_num_faces=4, refine_landmarks=True,
-        min_detection_confidence=0.5, min_tracking_confidence=0.5
-    )
-
-    # Carrega Haar Cascades para fallback de detecção de rostos de perfil
-    cascade_path = cv2.data.haarcascades
-    cascade_frontal = cv2.CascadeClassifier(
-        os.path.join(cascade_path, 'haarcascade_frontalface_default.xml')
-    )
-    cascade_profile = cv2.CascadeClassifier(
-        os.path.join(cascade_path, 'haarcascade_profileface.xml')
-    )
-
-    # histórico para decidir falante
-    activity_hist = deque(maxlen=15)
-    centro_atual  = (width // 2, height // 2)
-    centro_antigo = np.array(centro_atual)
-    centro_fallback = None  # rosto inicial para fallback quando não há falante detectado
-    centro_history = deque(maxlen=CENTER_HISTORY_SIZE)  # Histórico para suavização
+    if pipeline:
+        frames = _ThreadedFrameReader(cap, seg_end, scale, start=seg_ini, start_ms=seg_ini_ms)
+        for t in targets:
+            if t["out"]:
+                t["out"] = _ThreadedWriter(t["out"])
+        if out_debug:
+            out_debug = _ThreadedWriter(out_debug)
+    else:
+        frames = _read_frames(cap, seg_end, scale, seg_ini, seg_ini_ms)
+
+    # Detectores do worker (pré-aquecidos) ou, sem bundle, criados só para este vídeo
+    own_detectors = detectors is None
+    if own_detectors:
+        detectors = DetectorBundle(warm_up=False)
+    else:
+        detectors.reset()
+    face_mesh = detectors.face_mesh
+    cascade_frontal = detectors.cascade_frontal
+    cascade_profile = detectors.cascade_profile
+
+    # trilhas de rostos e histórico de abertura da boca para decidir o falante
+    face_tracker = _FaceTracker()
+    smoother = _TrajectorySmoother(width, height)
     ultimo_falante_centro = None  # Último centro conhecido do falante (quando MediaPipe detectava)
 
     faces_detected_sum = 0
+    frames_detected = 0
+
+    # Planos: (frame inicial, centro_fallback do plano) — o fallback é fixado no fim do plano
+    scene_cuts = _SceneCutDetector(scene_threshold, start=seg_ini)
+    shot_starts = [seg_ini]
+    shot_fallbacks = []
+    shot_fallback_offsets = []
+
+    # No modo ffmpeg a análise é só parte do trabalho: o restante é a renderização
+    analysis_share = ANALYSIS_PROGRESS_SHARE if render == "ffmpeg" else 1.0
 
     def report(i):
         if progress_cb:
-            progress_cb(stage="reframing", progress=min(0.999, i/float(max(1,total))), meta={
+            progress_cb(stage="reframing", progress=min(0.999, analysis_share * i/float(max(1,total))), meta={
                 "frame": i, "total_frames": total
             })
 
-    for i in range(total):
-        ok, frame = cap.read()
-        if not ok: break
-
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = face_mesh.process(rgb)
-        
-        # Variáveis para debug
-        centro_detectado_debug = None
-        haar_faces_debug = []
-
-        candidatos = []
-        if results.multi_face_landmarks:
-            faces_detected_sum += len(results.multi_face_landmarks)
-            for landmarks in results.multi_face_landmarks:
-                pts = np.array([(lm.x * width, lm.y * height) for lm in landmarks.landmark])
-                top_lip    = np.mean(pts[[13, 14, 15, 16, 17]], axis=0)
-                bottom_lip = np.mean(pts[[308,312,317,402,318]], axis=0)
-                abertura   = float(np.linalg.norm(top_lip - bottom_lip))
-                # Usa centro focado acima do nariz em vez da média de todos os pontos
-                centro     = _calculate_focused_center(landmarks, width, height)
-                candidatos.append((centro, abertura))
-
-            # Define centro_fallback no primeiro frame com rostos detectados
-            if centro_fallback is None and candidatos:
-                # Escolhe o rosto mais próximo do centro horizontal como fallback
-                idx_fallback = np.argmin([abs(c[0][0] - width//2) for c in candidatos])
-                centro_fallback_raw = candidatos[idx_fallback][0]
-                # Aplica estabilização desde o primeiro frame
-                centro_fallback_stable = _apply_dead_zone(centro_fallback_raw, centro_atual, width, height)
-                centro_fallback_stable = _smooth_center(centro_fallback_stable, centro_history, width, height)
-                centro_fallback = np.array(centro_fallback_stable)
-
-            max_faces = max(len(c) for c in [candidatos] + list(activity_hist)) if activity_hist else len(candidatos)
-            atual = [a for _, a in candidatos] + [0.0] * (max_faces - len(candidatos))
-            activity_hist.append(atual)
-
-            hist_array = np.array([h + [0.0]*(max_faces - len(h)) for h in activity_hist])
-            medias = np.mean(hist_array, axis=0)
-            idx = int(np.argmax(medias))
-            if idx >= len(candidatos):
-                # fallback para rosto mais próximo do centro horizontal
-                idx = np.argmin([abs(c[0][0] - width//2) for c in candidatos])
-
-            centro_detectado = candidatos[idx][0]
-            centro_detectado_debug = centro_detectado
-            # Salva o centro do falante identificado para usar em fallback futuro
-            ultimo_falante_centro = np.array(centro_detectado)
-            # Aplica zona morta para evitar movimentos pequenos
-            centro_detectado = _apply_dead_zone(centro_detectado, centro_atual, width, height)
-            # Aplica média ponderada dos últimos centros
-            centro_detectado = _smooth_center(centro_detectado, centro_history, width, height)
-            centro_atual = centro_detectado
+    def emit(i, frame, centro_detectado, detection, offset):
+        """
+        Aplica a suavização ao centro bruto do frame i, corta e escreve.
+        offset: fração de CENTER_OFFSET_Y aplicada ao centro bruto (vai para o log).
+        """
+        # Aquecimento (modo segmentado): só alimenta o estado, o frame pertence ao trecho anterior
+        aquecendo = i < seg_start
+        linhas, falante = detection if detection else (_NO_FACES, -1)
+        if detection is None:
+            metodo = _LOG_INTERPOLATED
+        elif not len(linhas):
+            metodo = _LOG_FALLBACK
         else:
-            # Fallback: tenta detectar rostos usando Haar Cascades quando MediaPipe falha
-            frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            haar_faces = _detect_faces_haar(frame_gray, cascade_frontal, cascade_profile, height)
-            haar_faces_debug = haar_faces
-            
-            if haar_faces:
-                faces_detected_sum += len(haar_faces)
-                
-                # Se há múltiplas cabeças, prioriza a mais próxima do último falante conhecido
-                if len(haar_faces) > 1:
-                    # Define referência: último falante conhecido ou centro atual
-                    referencia = ultimo_falante_centro if ultimo_falante_centro is not None else np.array(centro_atual)
-                    
-                    # Escolhe a cabeça mais próxima da referência (evita centralizar no meio)
-                    def distancia_do_falante(face):
-                        cx, cy, w_head, h_head, x_orig, y_orig, w_orig, h_orig = face
-                        centro_face = np.array([cx, cy])
-                        distancia = np.linalg.norm(centro_face - referencia)
-                        return distancia
-                    
-                    melhor_face = min(haar_faces, key=distancia_do_falante)
-                    centro_haar = (melhor_face[0], melhor_face[1])
-                else:
-                    # Se há apenas uma cabeça, usa ela diretamente
-                    melhor_face = haar_faces[0]
-                    centro_haar = (melhor_face[0], melhor_face[1])
-                
-                centro_detectado_debug = centro_haar
-                
-                # Define centro_fallback se ainda não foi definido (primeiro frame com cabeça)
-                if centro_fallback is None:
-                    # No primeiro frame, aplica estabilização desde o início
-                    centro_haar_stable = _apply_dead_zone(centro_haar, centro_atual, width, height)
-                    centro_haar_stable = _smooth_center(centro_haar_stable, centro_history, width, height)
-                    centro_fallback = np.array(centro_haar_stable)
-                    centro_atual = centro_haar_stable
-                else:
-                    # Aplica zona morta e suavização antes de usar o centro detectado pelo Haar
-                    centro_haar = _apply_dead_zone(centro_haar, centro_atual, width, height)
-                    centro_haar = _smooth_center(centro_haar, centro_history, width, height)
-                    centro_atual = centro_haar
-            elif centro_fallback is not None:
-                # Quando não há rostos detectados por nenhum método, usa centro_fallback
-                # MAS aplica zona morta e suavização para evitar balanço
-                centro_fallback_tuple = tuple(centro_fallback)
-                centro_fallback_tuple = _apply_dead_zone(centro_fallback_tuple, centro_atual, width, height)
-                centro_fallback_tuple = _smooth_center(centro_fallback_tuple, centro_history, width, height)
-                centro_atual = centro_fallback_tuple
-            # Se não há fallback definido ainda, mantém centro_atual (que pode ser o centro da tela inicialmente)
+            metodo = _LOG_MEDIAPIPE if linhas[0, 1] == 0 else _LOG_HAAR
+        if not aquecendo:
+            raw_centers.append(centro_detectado if centro_detectado is not None else (np.nan, np.nan))
+            log.add_frame(metodo, falante, centro_detectado, offset)
+        centro_atual = None
+        if smoothing == "online":
+            centro_atual = smoother.step(centro_detectado)
+        if smoothing == "online" and not aquecendo:
+            x, y = centro_atual
+            # Cada formato aplica o mesmo centro à sua própria janela de corte
+            for t in targets:
+                crop_w, crop_h = t["crop_w"], t["crop_h"]
+                x1 = max(0, min(int(x - crop_w/2), width - crop_w))
+                y1 = max(0, min(int(y - crop_h/2), height - crop_h))
+                t["trajectory"].append((x1, y1))
+                _write_crop(t, frame, x1, y1)
 
-        # suavização final do corte (interpolação exponencial)
-        centro_atual = centro_antigo + SMOOTH_ALPHA * (np.array(centro_atual) - np.array(centro_antigo))
-        centro_antigo = np.array(centro_atual)
-
-        x, y = centro_atual
-        x1 = max(0, min(int(x - crop_w/2), width - crop_w))
-        y1 = max(0, min(int(y - crop_h/2), height - crop_h))
-        crop = frame[y1:y1+crop_h, x1:x1+crop_w]
-        out.write(crop)
-        
         # Gera vídeo debug se solicitado
         if debug and out_debug:
             debug_info = {
                 "Frame": i,
-                "Method": "MediaPipe" if results.multi_face_landmarks else ("Haar" if haar_faces_debug else "Fallback"),
-                "Faces": len(results.multi_face_landmarks) if results.multi_face_landmarks else len(haar_faces_debug)
+                "Shot": len(shot_starts) - 1,
+                "Method": _LOG_METHODS[metodo],
+                "Faces": len(linhas)
             }
-            frame_debug = _draw_debug_overlays(frame, results, haar_faces_debug, centro_atual, centro_detectado_debug, width, height, debug_info)
+            frame_debug = _draw_debug_overlays(frame, linhas, centro_atual, centro_detectado, debug_info)
             out_debug.write(frame_debug)
 
         if i % 50 == 0: report(i)
 
-    cap.release()
-    out.release()
+    # Detecção esparsa: frames entre dois keyframes aguardam a próxima detecção
+    # e recebem o centro bruto interpolado linearmente entre os dois keyframes
+    stride_atual = detect_stride
+    proxima_deteccao = 0
+    pendentes = []  # (i, frame) aguardando o próximo keyframe
+    ultimo_keyframe = None  # (i, centro bruto) do último keyframe
+    haar_buscas = 0  # buscas do fallback Haar desde o início do plano
+    haar_full_searches = 0
+    haar_roi_searches = 0
+
+    # Pré-passo de áudio: envelope de energia do trecho analisado e silêncios longos
+    envelope = silencio = proxima_fala = None
+    if silence_stride and input_metadata.get("has_audio"):
+        envelope = _speech_envelope(input_path, fps, seg_ini, seg_end)
+        if envelope is not None and silence_stride > 1:
+            silencio, proxima_fala = _silence_mask(envelope, fps)
+
+    try:
+        for i, frame, rgb in frames:
+            corte = scene_cuts.is_cut(i, rgb)
+            if i < proxima_deteccao and not corte:
+                pendentes.append((i, frame))
+                continue
+
+            if corte:
+                # Frames pendentes pertencem ao plano anterior: mantêm o último centro
+                # detectado, sem interpolar através do corte
+                for pi, pframe in pendentes:
+                    emit(pi, pframe, ultimo_keyframe[1] if ultimo_keyframe else None, None,
+                         ultimo_keyframe[2] if ultimo_keyframe else 0.0)
+                pendentes = []
+                # Novo plano: nada do rastreamento anterior vale aqui
+                shot_fallbacks.append(smoother.centro_fallback)
+                shot_fallback_offsets.append(smoother.fallback_offset)
+                shot_starts.append(i)
+                smoother.reset()
+                face_tracker.reset()
+                ultimo_falante_centro = None
+                ultimo_keyframe = None
+                stride_atual = 1
+                haar_buscas = 0
+
+            results = face_mesh.process(rgb)
+            frames_detected += 1
+            haar_faces_debug = []
+            centro_detectado = None
+            track_ids = None
+            falante = -1
+
+            # Cada rosto é convertido uma única vez; o array é compartilhado por todos os consumidores
+            faces_pts = [_extract_landmarks(lm, width, height) for lm in (results.multi_face_landmarks or [])]
+
+            candidatos = []
+            if faces_pts:
+                faces_detected_sum += len(faces_pts)
+                for pts in faces_pts:
+                    abertura   = _mouth_opening(pts)
+                    # Usa centro focado acima do nariz em vez da média de todos os pontos
+                    centro     = _calculate_focused_center(pts, height)
+                    candidatos.append((centro, abertura))
+
+                # Define centro_fallback no primeiro frame com rostos detectados
+                if smoother.centro_fallback is None and candidatos:
+                    # Escolhe o rosto mais próximo do centro horizontal como fallback
+                    idx_fallback = np.argmin([abs(c[0][0] - width//2) for c in candidatos])
+                    smoother.centro_fallback = np.array(candidatos[idx_fallback][0])
+                    smoother.fallback_offset = 1.0
+
+                # Falante: trilha visível com maior abertura média da boca no histórico
+                slots = face_tracker.update([c for c, _ in candidatos],
+                                            [np.ptp(pts[:, 0]) for pts in faces_pts],
+                                            [a for _, a in candidatos],
+                                            envelope[i - seg_ini] if envelope is not None else 0.0)
+                idx = face_tracker.speaker(slots)
+                track_ids = face_tracker.ids[slots]
+                falante = int(track_ids[idx])
+
+                centro_detectado = candidatos[idx][0]
+                # Salva o centro do falante identificado para usar em fallback futuro
+                ultimo_falante_centro = np.array(centro_detectado)
+            else:
+                # Fallback: tenta detectar rostos usando Haar Cascades quando MediaPipe falha
+                # Busca numa janela em torno do último centro conhecido (ou do centro atual do
+                # crop); o frame inteiro só é varrido a cada HAAR_FULL_SEARCH_INTERVAL buscas
+                if ultimo_keyframe and ultimo_keyframe[1] is not None:
+                    referencia_roi = ultimo_keyframe[1]
+                elif ultimo_falante_centro is not None:
+                    referencia_roi = ultimo_falante_centro
+                else:
+                    referencia_roi = smoother.centro_atual
+                busca_completa = haar_buscas % HAAR_FULL_SEARCH_INTERVAL == 0
+                haar_buscas += 1
+                frame_gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+                haar_faces = _haar_search(frame_gray, cascade_frontal, cascade_profile, height, scale,
+                                          centro_ref=None if busca_completa else referencia_roi)
+                if busca_completa:
+                    haar_full_searches += 1
+                else:
+                    haar_roi_searches += 1
+                haar_faces_debug = haar_faces
+            
+                if haar_faces:
+                    faces_detected_sum += len(haar_faces)
+                
+                    # Se há múltiplas cabeças, prioriza a mais próxima do último falante conhecido
+                    if len(haar_faces) > 1:
+                        # Define referência: último falante conhecido ou centro atual
+                        referencia = ultimo_falante_centro if ultimo_falante_centro is not None else np.array(smoother.centro_atual)
+                    
+                        # Escolhe a cabeça mais próxima da referência (evita centralizar no meio)
+                        def distancia_do_falante(face):
+                            cx, cy, w_head, h_head, x_orig, y_orig, w_orig, h_orig = face
+                            centro_face = np.array([cx, cy])
+                            distancia = np.linalg.norm(centro_face - referencia)
+                            return distancia
+                    
+                        melhor_face = min(haar_faces, key=distancia_do_falante)
+                        centro_detectado = (melhor_face[0], melhor_face[1])
+                    else:
+                        # Se há apenas uma cabeça, usa ela diretamente
+                        melhor_face = haar_faces[0]
+                        centro_detectado = (melhor_face[0], melhor_face[1])
+                
+                    # Define centro_fallback se ainda não foi definido (primeiro frame com cabeça)
+                    if smoother.centro_fallback is None:
+                        smoother.centro_fallback = np.array(centro_detectado)
+                        smoother.fallback_offset = 0.0
+                # Sem rostos: o smoother usa centro_fallback (ou mantém o centro atual)
+
+            # Stride adaptativo: volta a detectar todo frame quando o centro salta além da zona morta
+            if detect_stride > 1:
+                if (centro_detectado is not None and ultimo_keyframe is not None and ultimo_keyframe[1] is not None
+                        and _exceeds_dead_zone(centro_detectado, ultimo_keyframe[1], width, height)):
+                    stride_atual = 1
+                else:
+                    stride_atual = min(detect_stride, stride_atual + 1)
+
+            # Centros do MediaPipe já incluem CENTER_OFFSET_Y; os do Haar (centro da cabeça) não
+            offset = 1.0 if faces_pts else 0.0
+
+            # Frames intermediários: centro bruto interpolado entre os keyframes
+            for pi, pframe in pendentes:
+                centro_anterior = ultimo_keyframe[1] if ultimo_keyframe else None
+                offset_interp = ultimo_keyframe[2] if ultimo_keyframe else 0.0
+                if centro_anterior is not None and centro_detectado is not None:
+                    t = (pi - ultimo_keyframe[0]) / float(i - ultimo_keyframe[0])
+                    centro_interp = np.array(centro_anterior) + t * (np.array(centro_detectado) - np.array(centro_anterior))
+                    offset_interp += t * (offset - offset_interp)
+                else:
+                    centro_interp = centro_anterior
+                emit(pi, pframe, centro_interp, None, offset_interp)
+            pendentes = []
+
+            linhas = _face_rows(i, faces_pts, haar_faces_debug, track_ids)
+            if i >= seg_start:
+                log.add_faces(linhas)
+            emit(i, frame, centro_detectado, (linhas, falante), offset)
+            ultimo_keyframe = (i, centro_detectado, offset)
+            proxima_deteccao = i + stride_atual
+            if silencio is not None and silencio[i - seg_ini]:
+                # Silêncio longo: mantém o corte e só volta a detectar no passo de silêncio
+                # ou no início da próxima fala (o que vier antes)
+                proxima_deteccao = max(proxima_deteccao,
+                                       min(i + silence_stride, seg_ini + int(proxima_fala[i - seg_ini])))
+
+        # Frames após o último keyframe mantêm o último centro detectado
+        for pi, pframe in pendentes:
+            emit(pi, pframe, ultimo_keyframe[1] if ultimo_keyframe else None, None,
+                 ultimo_keyframe[2] if ultimo_keyframe else 0.0)
+    except BaseException:
+        for w in [t["out"] for t in targets] + [out_debug]:
+            if w:
+                _abort_writer(w)
+        _discard_outputs(targets)
+        raise
+    finally:
+        if pipeline:
+            frames.close()
+        cap.release()
+        if own_detectors:
+            detectors.close()
+
+    for t in targets:
+        if t["out"]:
+            t["out"].release()
     if out_debug:
         out_debug.release()
+    if stream_url:
+        # Daqui em diante (mux/render, hash) o arquivo local precisa estar completo
+        _wait_for_download(input_path)
+        if analysis_cache and not debug:
+            analysis_path = _analysis_cache_path(analysis_cache, content_hash or _file_digest(input_path),
+                                                 analysis_size, detect_stride, scene_threshold, silence_stride)
 
-    # Coleta metadados do input antes do mux
-    input_metadata = _get_video_metadata(input_path)
-
-    # mux de áudio
-    if progress_cb: progress_cb(stage="muxing", progress=0.0, meta={})
-    mux_info = _mux_audio(tmp_video, input_path, output_path)
-    if progress_cb: progress_cb(stage="muxing", progress=1.0, meta={})
+    if segment is not None:
+        # Modo segmentado: o processo pai junta os segmentos, suaviza/renderiza e faz o mux
+        cortes = [k for k in range(1, len(shot_starts)) if shot_starts[k] >= seg_start]
+        primeiro = cortes[0] - 1 if cortes else len(shot_starts) - 1
+        fallbacks = shot_fallbacks + [smoother.centro_fallback]
+        fallback_offsets = shot_fallback_offsets + [smoother.fallback_offset]
+        return {
+            "raw_centers": [tuple(c) for c in raw_centers],
+            "trajectories": [t["trajectory"] for t in targets],
+            "cuts": [shot_starts[k] - seg_start for k in cortes],
+            "fallbacks": [fallbacks[k] for k in [primeiro] + cortes],
+            "fallback_offsets": [fallback_offsets[k] for k in [primeiro] + cortes],
+            "faces_detected_sum": int(faces_detected_sum),
+            "frames_detected": int(frames_detected),
+            "haar_full_searches": haar_full_searches,
+            "haar_roi_searches": haar_roi_searches,
+            "silent_frames": int(silencio[seg_start - seg_ini:].sum()) if silencio is not None else 0,
+            "log": log.arrays()
+        }
 
-    # Coleta metadados do output final
-    output_metadata = _get_video_metadata(output_path)
+    shots = list(zip(shot_starts, shot_starts[1:] + [len(raw_centers)], shot_fallbacks + [smoother.centro_fallback]))
+    mux_info, outputs = _finish_outputs(input_path, targets, raw_centers, shots, fps, width, height, total,
+                                        input_metadata, render, writer, smoothing, progress_cb, analysis_share,
+                                        encoder_preset, encoder_crf)
+    output_metadata = outputs[0]["output_metadata"]
+    if trajectory_log:
+        _write_trajectory_log(trajectory_log, log.arrays(), targets[0], shots, fps, width, height)
+    if crop_path:
+        _write_crop_paths(crop_path, targets, fps, width, height)
+    counters = {
+        "faces_detected_sum": int(faces_detected_sum),
+        "frames_detected": int(frames_detected),
+        "haar_full_searches": haar_full_searches,
+        "haar_roi_searches": haar_roi_searches,
+        "silent_frames": int(silencio.sum()) if silencio is not None else 0
+    }
+    if analysis_path:
+        _write_analysis(analysis_path, raw_centers, log.arrays(), shots,
+                        shot_fallback_offsets + [smoother.fallback_offset], counters, width, height)
 
-    try: os.remove(tmp_video)
-    except: pass
+    # Planos detectados: unidades independentes de processamento
+    shots = _shot_list(shots, fps)
 
-    return {
+    return dict(counters, **{
         "frames_processed": total,
         "fps": float(fps),
-        "faces_detected_sum": int(faces_detected_sum),
+        "detect_stride": detect_stride,
+        "analysis_scale": round(scale, 4),
+        "smoothing": smoothing,
+        "scene_cuts": len(shots) - 1,
+        "shots": shots,
         "status": "success",
+        "render": render,
+        "writer": writer if render == "opencv" else render,
         "input_metadata": input_metadata,
         "output_metadata": output_metadata,
-        "mux_info": mux_info
-    }
+        "outputs": outputs,
+        "mux_info": mux_info,
+        "trajectory_log": trajectory_log,
+        "crop_path": crop_path,
+        "analysis_cache": analysis_path,
+        "analysis_cache_hit": False
+    })
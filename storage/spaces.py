@@ -4,6 +4,8 @@ import boto3
 import mimetypes
 import uuid
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 SPACES_REGION   = os.getenv("SPACES_REGION",  "nyc3")
 SPACES_ENDPOINT = os.getenv("SPACES_ENDPOINT","https://nyc3.digitaloceanspaces.com")
@@ -14,6 +16,11 @@ SPACES_SECRET   = os.getenv("SPACES_SECRET")
 # Opcional: se você tiver um CDN/CNAME (ex.: https://cdn.seudominio.com)
 SPACES_CDN_BASE = os.getenv("SPACES_CDN_BASE")  # e.g. https://cdn.meuspace.com
 
+# Multipart: arquivos acima do limite sobem em partes paralelas (cada parte com retry próprio)
+SPACES_MULTIPART_THRESHOLD_MB = int(os.getenv("SPACES_MULTIPART_THRESHOLD_MB", "16"))
+SPACES_MULTIPART_CHUNK_MB     = int(os.getenv("SPACES_MULTIPART_CHUNK_MB", "8"))
+SPACES_MAX_CONCURRENCY        = int(os.getenv("SPACES_MAX_CONCURRENCY", "8"))
+
 import ssl
 import urllib3
 import warnings
@@ -28,14 +35,27 @@ ssl_context.check_hostname = False
 ssl_context.verify_mode = ssl.CERT_NONE
 
 # Configura botocore para usar SSL customizado
-import botocore
+import botocore.exceptions
 from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
 
 config = Config(
     signature_version='s3v4',
     s3={
         'addressing_style': 'virtual'
-    }
+    },
+    # retry por requisição: no multipart, cada parte é repetida sozinha
+    retries={'max_attempts': 5, 'mode': 'standard'},
+    # uma conexão por parte simultânea
+    max_pool_connections=max(10, SPACES_MAX_CONCURRENCY)
+)
+
+_MB = 1024 * 1024
+transfer_config = TransferConfig(
+    multipart_threshold=SPACES_MULTIPART_THRESHOLD_MB * _MB,
+    multipart_chunksize=SPACES_MULTIPART_CHUNK_MB * _MB,
+    max_concurrency=SPACES_MAX_CONCURRENCY,
+    use_threads=True
 )
 
 _session = boto3.session.Session(
@@ -57,19 +77,208 @@ def public_url_for(key: str) -> str:
     # URL pública default do Spaces
     return f"https://{SPACES_BUCKET}.{SPACES_REGION}.digitaloceanspaces.com/{key}"
 
-def upload_public(file_path: str, key: str) -> str:
+_PUBLIC_OBJECT_ARGS = {"ACL": "public-read", "CacheControl": "public, max-age=31536000, immutable"}
+
+class _UploadProgress:
+    """Soma os bytes enviados pelas partes (threads do boto3) e repassa a fração a cada 1%."""
+
+    def __init__(self, total: int, progress_cb):
+        self.total = total
+        self.progress_cb = progress_cb
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount: int):
+        if not self.total:
+            return
+        with self._lock:
+            before = 100 * self.sent // self.total
+            self.sent += bytes_amount
+            fraction = min(1.0, self.sent / float(self.total))
+            changed = 100 * self.sent // self.total != before
+        if changed:
+            self.progress_cb(fraction)
+
+def upload_public(file_path: str, key: str, progress_cb=None) -> str:
+    """
+    Envia o arquivo como objeto público e retorna a URL pública.
+    Acima de SPACES_MULTIPART_THRESHOLD_MB usa multipart com SPACES_MAX_CONCURRENCY
+    partes simultâneas de SPACES_MULTIPART_CHUNK_MB.
+    progress_cb(fração 0..1), se informado, acompanha os bytes enviados.
+    """
     ctype = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
-    with open(file_path, "rb") as f:
-        _s3.put_object(
-            Bucket=SPACES_BUCKET,
-            Key=key,
-            Body=f,
-            ACL="public-read",
-            ContentType=ctype,
-            CacheControl="public, max-age=31536000, immutable"
-        )
+    callback = _UploadProgress(os.path.getsize(file_path), progress_cb) if progress_cb else None
+    _s3.upload_file(
+        file_path,
+        SPACES_BUCKET,
+        key,
+        ExtraArgs=dict(_PUBLIC_OBJECT_ARGS, ContentType=ctype),
+        Config=transfer_config,
+        Callback=callback
+    )
     return public_url_for(key)
 
+class StreamingUpload:
+    """
+    Objeto público gravado em streaming, sem arquivo local: write() junta os bytes em
+    partes de SPACES_MULTIPART_CHUNK_MB (mínimo de 5 MB do S3) que sobem em paralelo
+    enquanto o restante ainda chega. Com SPACES_MAX_CONCURRENCY partes em voo, write()
+    espera uma terminar, então a memória fica em ~(concorrência + 1) x parte.
+    Conteúdo menor que uma parte vira um PUT único em complete().
+    """
+
+    def __init__(self, key: str, filename: str = None):
+        self.key = key
+        self.content_type = mimetypes.guess_type(filename or key)[0] or "application/octet-stream"
+        self.part_size = max(5, SPACES_MULTIPART_CHUNK_MB) * _MB
+        self.size = 0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = {}  # número da parte -> future com o ETag
+        self._slots = threading.BoundedSemaphore(SPACES_MAX_CONCURRENCY)
+        self._pool = None
+
+    def write(self, data: bytes) -> None:
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._send_part(part)
+
+    def _send_part(self, body: bytes) -> None:
+        if self._upload_id is None:
+            r = _s3.create_multipart_upload(Bucket=SPACES_BUCKET, Key=self.key,
+                                            ContentType=self.content_type, **_PUBLIC_OBJECT_ARGS)
+            self._upload_id = r["UploadId"]
+            self._pool = ThreadPoolExecutor(max_workers=SPACES_MAX_CONCURRENCY, thread_name_prefix="spaces-part")
+        # Uma parte que já falhou (após os retries do botocore) interrompe o envio
+        for future in self._parts.values():
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        self._slots.acquire()
+        future = self._pool.submit(self._upload_part, len(self._parts) + 1, body)
+        future.add_done_callback(lambda f: self._slots.release())
+        self._parts[len(self._parts) + 1] = future
+
+    def _upload_part(self, number: int, body: bytes) -> str:
+        r = _s3.upload_part(Bucket=SPACES_BUCKET, Key=self.key, UploadId=self._upload_id,
+                            PartNumber=number, Body=body)
+        return r["ETag"]
+
+    def complete(self) -> str:
+        """Envia o que falta, fecha o upload e retorna a URL pública."""
+        if self._upload_id is None:
+            _s3.put_object(Bucket=SPACES_BUCKET, Key=self.key, Body=bytes(self._buffer),
+                           ContentType=self.content_type, **_PUBLIC_OBJECT_ARGS)
+            self._buffer = bytearray()
+            return public_url_for(self.key)
+        try:
+            if self._buffer:
+                self._send_part(bytes(self._buffer))
+                self._buffer = bytearray()
+            parts = [{"PartNumber": n, "ETag": f.result()} for n, f in sorted(self._parts.items())]
+            _s3.complete_multipart_upload(Bucket=SPACES_BUCKET, Key=self.key, UploadId=self._upload_id,
+                                          MultipartUpload={"Parts": parts})
+        except Exception:
+            self.abort()
+            raise
+        self._pool.shutdown()
+        return public_url_for(self.key)
+
+    def abort(self) -> None:
+        """Descarta as partes já enviadas (o Spaces cobra por partes órfãs)."""
+        if self._upload_id is None:
+            return
+        for future in self._parts.values():
+            future.cancel()
+        self._pool.shutdown(wait=True)
+        try:
+            _s3.abort_multipart_upload(Bucket=SPACES_BUCKET, Key=self.key, UploadId=self._upload_id)
+        except Exception:
+            pass
+        self._upload_id = None
+        self._buffer = bytearray()
+
+def presign_put(key: str, filename: str = None, expires_in: int = 3600) -> dict:
+    """
+    URL assinada para o cliente enviar o objeto direto ao bucket (um PUT só), com os
+    mesmos metadados do upload_public (ACL pública, Cache-Control). Os headers
+    retornados fazem parte da assinatura e precisam ir no PUT.
+    """
+    ctype = mimetypes.guess_type(filename or key)[0] or "application/octet-stream"
+    url = _s3.generate_presigned_url(
+        "put_object",
+        Params=dict(_PUBLIC_OBJECT_ARGS, Bucket=SPACES_BUCKET, Key=key, ContentType=ctype),
+        ExpiresIn=expires_in
+    )
+    return {
+        "url": url,
+        "headers": {
+            "Content-Type": ctype,
+            "x-amz-acl": _PUBLIC_OBJECT_ARGS["ACL"],
+            "Cache-Control": _PUBLIC_OBJECT_ARGS["CacheControl"]
+        }
+    }
+
+def presign_multipart(key: str, size: int, filename: str = None, expires_in: int = 3600) -> dict:
+    """
+    Abre um upload multipart (objeto público) e assina um PUT por parte.
+    As partes têm SPACES_MULTIPART_CHUNK_MB (maiores se passaria do limite de
+    10000 partes do S3); a última leva o resto. Retorna multipart_id, part_size
+    e parts = [{part_number, url}].
+    """
+    ctype = mimetypes.guess_type(filename or key)[0] or "application/octet-stream"
+    part_size = max(5 * _MB, SPACES_MULTIPART_CHUNK_MB * _MB, -(-size // 10000))
+    r = _s3.create_multipart_upload(Bucket=SPACES_BUCKET, Key=key, ContentType=ctype, **_PUBLIC_OBJECT_ARGS)
+    parts = [
+        {
+            "part_number": n,
+            "url": _s3.generate_presigned_url(
+                "upload_part",
+                Params={"Bucket": SPACES_BUCKET, "Key": key, "UploadId": r["UploadId"], "PartNumber": n},
+                ExpiresIn=expires_in
+            )
+        }
+        for n in range(1, max(1, -(-size // part_size)) + 1)
+    ]
+    return {"multipart_id": r["UploadId"], "part_size": part_size, "parts": parts}
+
+def complete_multipart(key: str, multipart_id: str, parts=None) -> None:
+    """
+    Fecha um upload multipart enviado pelo cliente. parts = [(número, etag)];
+    sem parts, usa as partes que o bucket recebeu (o browser nem sempre
+    consegue ler o ETag da resposta por causa do CORS).
+    """
+    if not parts:
+        parts = []
+        kwargs = {"Bucket": SPACES_BUCKET, "Key": key, "UploadId": multipart_id}
+        while True:
+            r = _s3.list_parts(**kwargs)
+            parts += [(p["PartNumber"], p["ETag"]) for p in r.get("Parts", [])]
+            if not r.get("IsTruncated"):
+                break
+            kwargs["PartNumberMarker"] = r["NextPartNumberMarker"]
+    _s3.complete_multipart_upload(
+        Bucket=SPACES_BUCKET, Key=key, UploadId=multipart_id,
+        MultipartUpload={"Parts": [{"PartNumber": int(n), "ETag": etag} for n, etag in sorted(parts)]}
+    )
+
+def abort_multipart(key: str, multipart_id: str) -> bool:
+    """Descarta um upload multipart não concluído (e as partes já enviadas)."""
+    try:
+        _s3.abort_multipart_upload(Bucket=SPACES_BUCKET, Key=key, UploadId=multipart_id)
+        return True
+    except Exception:
+        return False
+
+def object_size(key: str):
+    """Tamanho do objeto em bytes, ou None se ele não existe."""
+    try:
+        return _s3.head_object(Bucket=SPACES_BUCKET, Key=key)["ContentLength"]
+    except botocore.exceptions.ClientError:
+        return None
+
 def delete_public(key: str) -> bool:
     """
     Remove um objeto público do Spaces.
@@ -0,0 +1,149 @@
+"""
+Download de inputs http(s).
+
+Uma requests.Session compartilhada por todos os jobs (pool de conexões
+keep-alive por host, sem um handshake TCP/TLS novo a cada vídeo). Quando o
+servidor aceita Range e o arquivo é grande, o download é dividido em partes
+paralelas, cada uma gravada na sua posição de um arquivo pré-alocado; uma parte
+que cai no meio retoma do último byte gravado em vez de recomeçar o arquivo.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.result_cache import hash_file
+
+# Leituras menores que o padrão de 1 MiB: a parte 0 reaproveita a resposta do arquivo
+# inteiro e não deve esperar bytes além do seu fim; uma queda perde no máximo um bloco
+CHUNK_SIZE = 256 * 1024
+
+
+class DownloadCancelled(Exception):
+    """Download interrompido pelo evento cancel (ex.: o job falhou antes do fim)."""
+
+
+class Downloader:
+    """
+    Baixador compartilhado entre os workers (thread-safe).
+    parts: conexões simultâneas por arquivo (1 = sempre sequencial).
+    min_part_size: arquivos menores que parts x min_part_size baixam numa conexão só.
+    retries: novas tentativas por parte após erro de rede (retomando do byte onde parou).
+    """
+
+    def __init__(self, parts=4, min_part_size=8 * 1024 * 1024, retries=3, timeout=60, pool_size=16):
+        self.parts = max(1, int(parts))
+        self.min_part_size = max(1, int(min_part_size))
+        self.retries = max(0, int(retries))
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def download(self, url, path, hasher=None, progress_cb=None, cancel=None):
+        """
+        Baixa url em path. hasher recebe o conteúdo (em streaming no modo sequencial;
+        no modo em partes, lendo o arquivo ao final, já que as partes chegam fora de
+        ordem). progress_cb(fração) é chamado a cada 1% quando o tamanho é conhecido.
+        cancel (threading.Event), quando setado, interrompe todas as partes no próximo bloco.
+        Levanta requests.RequestException (ou OSError) se o download falhar e
+        DownloadCancelled se for cancelado.
+        """
+        r = self.session.get(url, stream=True, timeout=self.timeout)
+        r.raise_for_status()
+        size = int(r.headers.get("Content-Length") or 0)
+        ranges = r.headers.get("Accept-Ranges", "").lower() == "bytes" and size > 0
+        progress = _Progress(size, progress_cb)
+
+        parts = min(self.parts, size // self.min_part_size) if ranges else 1
+        if parts <= 1:
+            with open(path, "wb") as f:
+                self._fetch(url, f, 0, size - 1 if size else None, r, progress, hasher, resumable=ranges,
+                            cancel=cancel)
+            return path
+
+        # Arquivo pré-alocado; cada parte escreve no seu intervalo com seu próprio handle
+        with open(path, "wb") as f:
+            f.truncate(size)
+        bounds = [(k * size // parts, (k + 1) * size // parts - 1) for k in range(parts)]
+
+        def fetch_part(k):
+            start, end = bounds[k]
+            with open(path, "r+b") as f:
+                f.seek(start)
+                # A primeira resposta (já aberta, começando no byte 0) serve para a parte 0
+                self._fetch(url, f, start, end, r if k == 0 else None, progress, resumable=True, cancel=cancel)
+
+        try:
+            with ThreadPoolExecutor(max_workers=parts, thread_name_prefix="download") as pool:
+                for future in [pool.submit(fetch_part, k) for k in range(parts)]:
+                    future.result()
+        finally:
+            r.close()
+        if hasher is not None:
+            hash_file(path, hasher)
+        return path
+
+    def _fetch(self, url, f, start, end, response, progress, hasher=None, resumable=False, cancel=None):
+        """
+        Grava os bytes start..end (end None = até o fim) em f, a partir da posição
+        atual. Com resumable, erros de rede retomam do último byte gravado com Range.
+        """
+        pos = start
+        tentativas = 0
+        while True:
+            try:
+                if response is None:
+                    headers = {"Range": f"bytes={pos}-{'' if end is None else end}"}
+                    response = self.session.get(url, stream=True, timeout=self.timeout, headers=headers)
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise requests.HTTPError(f"Servidor ignorou Range (HTTP {response.status_code})")
+                for chunk in response.iter_content(CHUNK_SIZE if end is None else min(CHUNK_SIZE, end + 1 - pos)):
+                    if cancel is not None and cancel.is_set():
+                        raise DownloadCancelled(f"Download cancelado no byte {pos}")
+                    if end is not None and pos + len(chunk) > end + 1:
+                        chunk = chunk[:end + 1 - pos]  # resposta 200 reaproveitada: para no fim da parte
+                    f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    pos += len(chunk)
+                    progress.add(len(chunk))
+                    if end is not None and pos > end:
+                        break
+                if end is not None and pos <= end:
+                    raise requests.ConnectionError(f"Conexão encerrada no byte {pos} de {end + 1}")
+                return
+            except requests.RequestException:
+                tentativas += 1
+                if not resumable or tentativas > self.retries:
+                    raise
+                time.sleep(min(10.0, 0.5 * 2 ** tentativas))
+            finally:
+                if response is not None:
+                    response.close()
+                response = None
+
+
+class _Progress:
+    """Bytes baixados somados entre as partes; repassa a fração a cada 1%."""
+
+    def __init__(self, total, callback):
+        self.total = total
+        self.callback = callback
+        self.done = 0
+        self._lock = threading.Lock()
+
+    def add(self, n):
+        if not self.callback or not self.total:
+            return
+        with self._lock:
+            antes = 100 * self.done // self.total
+            self.done += n
+            fracao = min(1.0, self.done / float(self.total))
+            mudou = 100 * self.done // self.total != antes
+        if mudou:
+            self.callback(fracao)
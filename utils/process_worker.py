@@ -0,0 +1,182 @@
+"""
+Execução do reframe em processo separado.
+
+Cada worker da fila do app.py pode ser dono de um ReframeProcess: um processo
+filho de longa duração (spawn) que recebe jobs por um pipe e devolve progresso
+e métricas pelo mesmo pipe. O trabalho por frame roda fora do processo da API,
+sem disputar o GIL com os outros jobs, e um crash do MediaPipe/OpenCV derruba
+só o processo do job (que é recriado no próximo).
+"""
+import multiprocessing
+import os
+import signal
+import time
+import traceback
+
+
+class ReframeProcessError(RuntimeError):
+    """O processo de reframe terminou sem devolver resultado (crash, OOM, sinal)."""
+
+
+def _descendants(pid):
+    """PIDs dos descendentes de pid (pool do modo segmentado, ffmpeg), lidos do /proc."""
+    filhos = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # o nome do processo vem entre parênteses e pode ter espaços: ppid é o 2º campo após ")"
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        filhos.setdefault(ppid, []).append(int(entry))
+    resultado, pendentes = [], [pid]
+    while pendentes:
+        for filho in filhos.get(pendentes.pop(), []):
+            resultado.append(filho)
+            pendentes.append(filho)
+    return resultado
+
+
+def _rss_mb(pids):
+    """Memória residente (VmRSS) somada dos processos, em MB."""
+    total_kb = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for linha in f:
+                    if linha.startswith("VmRSS:"):
+                        total_kb += int(linha.split()[1])
+                        break
+        except (OSError, ValueError):
+            continue
+    return total_kb / 1024.0
+
+
+def _serve(conn):
+    """Loop do processo filho: um job por mensagem, None encerra."""
+    # Import no filho: MediaPipe/OpenCV e detectores carregam uma vez por processo, antes do primeiro job
+    from reframe_mediapipe_falante_v7 import reframe_video, DetectorBundle
+    detectors = DetectorBundle()
+
+    def progress_cb(stage, progress, meta=None):
+        conn.send(("progress", stage, progress, meta))
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        try:
+            metrics = reframe_video(progress_cb=progress_cb, detectors=detectors, **job)
+            conn.send(("result", metrics))
+        except BaseException as e:
+            try:
+                conn.send(("error", e, traceback.format_exc()))
+            except Exception:
+                # exceção não serializável: envia só o texto
+                conn.send(("error", RuntimeError(f"{type(e).__name__}: {e}"), traceback.format_exc()))
+    detectors.close()
+    conn.close()
+
+
+class ReframeProcess:
+    """
+    Processo filho dedicado a um worker. run() tem a mesma assinatura de
+    reframe_video e bloqueia até o job terminar, repassando o progresso.
+    memory_limit_mb: teto de memória residente (RSS) do filho somado aos seus
+    descendentes (pool do modo segmentado, ffmpeg), conferido a cada poll_interval;
+    acima dele o job é encerrado. Um RLIMIT_AS mataria jobs saudáveis: MediaPipe/TFLite
+    e pilhas de threads reservam bem mais endereço virtual do que usam. Lido do /proc
+    (Linux); em outros sistemas o limite não é aplicado.
+    """
+
+    def __init__(self, memory_limit_mb=0, poll_interval=0.5):
+        self.memory_limit_mb = memory_limit_mb
+        self.poll_interval = poll_interval
+        self._ctx = multiprocessing.get_context("spawn")
+        self._proc = None
+        self._conn = None
+
+    def start(self):
+        """Sobe o processo filho (se ainda não estiver rodando)."""
+        if self._proc is not None and self._proc.is_alive():
+            return
+        self._conn, child_conn = self._ctx.Pipe()
+        # não-daemon: o filho pode abrir o próprio pool de processos (modo segmentado)
+        self._proc = self._ctx.Process(target=_serve, args=(child_conn,),
+                                       name="reframe-worker", daemon=False)
+        self._proc.start()
+        child_conn.close()
+
+    def is_alive(self):
+        """True se o processo filho está rodando."""
+        return self._proc is not None and self._proc.is_alive()
+
+    def run(self, input_path, output_path, progress_cb=None, **kwargs):
+        """Executa reframe_video no processo filho e retorna as métricas."""
+        self.start()
+        self._conn.send(dict(kwargs, input_path=input_path, output_path=output_path))
+        proxima_checagem = time.monotonic()
+        while True:
+            if time.monotonic() >= proxima_checagem:
+                proxima_checagem = time.monotonic() + self.poll_interval
+                self._check_memory()
+            if not self._conn.poll(self.poll_interval):
+                if not self._proc.is_alive():
+                    break
+                continue
+            try:
+                msg = self._conn.recv()
+            except EOFError:
+                break
+            if msg[0] == "progress":
+                if progress_cb:
+                    progress_cb(stage=msg[1], progress=msg[2], meta=msg[3])
+            elif msg[0] == "result":
+                return msg[1]
+            else:
+                raise msg[1]
+
+        # Sem resultado: o filho morreu no meio do job (segfault, OOM killer)
+        self._proc.join(timeout=1)
+        exitcode = self._proc.exitcode
+        self._proc = None
+        self._conn = None
+        raise ReframeProcessError(f"Processo de reframe terminou inesperadamente (código {exitcode})")
+
+    def _check_memory(self):
+        """Encerra o filho e seus descendentes se o RSS somado passar de memory_limit_mb."""
+        if not self.memory_limit_mb or self.memory_limit_mb <= 0 or not os.path.isdir("/proc"):
+            return
+        pids = [self._proc.pid] + _descendants(self._proc.pid)
+        rss = _rss_mb(pids)
+        if rss <= self.memory_limit_mb:
+            return
+        for pid in reversed(pids):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        self._proc.join(timeout=5)
+        self._proc = None
+        self._conn = None
+        raise MemoryError(f"Processo de reframe usou {rss:.0f} MB de RSS (limite {self.memory_limit_mb} MB)")
+
+    def close(self, timeout=5):
+        """Encerra o processo filho."""
+        if self._proc is None:
+            return
+        try:
+            self._conn.send(None)
+        except Exception:
+            pass
+        self._proc.join(timeout=timeout)
+        if self._proc.is_alive():
+            self._proc.terminate()
+            self._proc.join(timeout=timeout)
+        self._proc = None
+        self._conn = None
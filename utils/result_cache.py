@@ -0,0 +1,100 @@
+"""
+Cache de resultados endereçado por conteúdo.
+
+A chave junta o hash do vídeo de entrada (calculado em streaming durante o
+download) com o hash dos parâmetros de processamento; o valor é o resultado de
+um job concluído (output_key/output_url, outputs, métricas). O índice é um JSON
+gravado de forma atômica, sobrevive a reinícios e é podado por idade e por
+número de entradas (as menos usadas saem primeiro).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def params_digest(params: dict) -> str:
+    """Hash estável (sha256) dos parâmetros de processamento."""
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def hash_file(path: str, hasher, block_size: int = 1024 * 1024) -> None:
+    """Alimenta hasher com o conteúdo do arquivo, em blocos."""
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            hasher.update(block)
+
+
+class ResultCache:
+    """Índice persistente chave -> resultado, com expiração e limite de entradas."""
+
+    def __init__(self, path: str, max_entries: int = 500, ttl_seconds: int = 7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    self._entries = json.load(f)
+        except Exception:
+            self._entries = {}
+
+    def _save(self) -> None:
+        # Grava num arquivo temporário e troca: um crash no meio não corrompe o índice
+        try:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except Exception:
+            pass
+
+    def _prune(self, now: int) -> None:
+        expired = [k for k, e in self._entries.items() if now - e.get("created_at", 0) > self.ttl_seconds]
+        for k in expired:
+            del self._entries[k]
+        excess = len(self._entries) - self.max_entries
+        if excess > 0:
+            lru = sorted(self._entries, key=lambda k: self._entries[k].get("last_used_at", 0))
+            for k in lru[:excess]:
+                del self._entries[k]
+
+    def get(self, key: str):
+        """Resultado guardado para key (ou None se ausente/expirado)."""
+        now = int(time.time())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if now - entry.get("created_at", 0) > self.ttl_seconds:
+                del self._entries[key]
+                self._save()
+                return None
+            entry["hits"] = entry.get("hits", 0) + 1
+            entry["last_used_at"] = now
+            self._save()
+            return dict(entry["result"])
+
+    def put(self, key: str, result: dict) -> None:
+        """Guarda o resultado de um job concluído."""
+        now = int(time.time())
+        with self._lock:
+            self._entries[key] = {"created_at": now, "last_used_at": now, "hits": 0, "result": result}
+            self._prune(now)
+            self._save()
+
+    def discard(self, key: str) -> None:
+        """Remove a entrada (ex.: arquivo local do resultado não existe mais)."""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)